@@ -1,19 +1,43 @@
 # app.py
 import streamlit as st
-import sqlite3
-from datetime import date, datetime, timedelta
-import re
-import os
-import random
+from datetime import date, datetime
+import io
 import json
-import smtplib
-from email.message import EmailMessage
+import os
+import tempfile
+from db import (run_write, fetch_all, fetch_one, cached_fetch_all, cache_stats, profile_view, last_render,
+                query_stats, view_stats, slow_queries, query_report, reset_query_stats, SLOW_QUERY_MS)
+from migrations import migrate, reset_schema
+from validation import valid_phone, valid_email
+from donations import log_donation, import_donation_drive, read_donation_csv, delete_donation
+from ledger import transfer, correct, stock_as_of, movements, take_snapshot, start_snapshotter
+from lots import expiring, retire_expired, plan as fefo_plan, start_sweeper, EXPIRING_DAYS
+from reservations import reserve_bank, assign_donor, release
+from imports import import_file, COLUMNS as IMPORT_COLUMNS
+from geo import nearest_donors
+from matching import match_requests, compatible_groups
+from stats import dashboard_stats, low_stock, set_low_threshold, rebuild_dashboard_stats
+from reports import count_inactive_donors, inactive_donors
+from forecast import forecast, HORIZON_DAYS
+from rebalance import plan as rebalance_plan, apply as apply_rebalance, COVER_DAYS, MAX_KM
+from mailer import start_worker, enqueue_email, load_email_config, outbox_summary
+from otp import issue_otp, verify_otp, is_verified, consume_verification
+from exports import export_table, export_tables, table_columns, export_filename, FORMATS as EXPORT_FORMATS, FILTER_OPS, MIME as EXPORT_MIME
+from backup import create_backup, list_backups, rotate, verify_backup, restore_backup, start_scheduler, KEEP_BACKUPS
+from browse import (browse_donors, count_donors, search_donors, get_donor, donor_cities,
+                    browse_banks, count_banks, search_banks, get_bank, donor_map, bank_map,
+                    PAGE_SIZE as BROWSE_PAGE_SIZE, MAP_MAX_ZOOM)
+from search import search as quick_search
+from broadcast import broadcast_request, broadcast_summary, record_response, willing_donors
 
 # ---------- CONFIG ----------
-DB = "blood_donation.db"
 ADMIN_PIN = "1234"                 # keep for destructive ops
 INACTIVE_DAYS = 180
+INACTIVE_PAGE_SIZE = 50
 LOW_INVENTORY_THRESHOLD = 5
+BROADCAST_RADIUS_KM = 25           # default radius for emergency donor alerts
+AUTO_BACKUP = True                 # daily rotating snapshots in ./backups (backup.py)
+QUERY_PANEL = True                 # sidebar summary of the queries behind the page just rendered
 
 # OTP / email controls
 SEND_EMAILS = True                 # True => send real emails via email_config.json
@@ -24,221 +48,186 @@ st.set_page_config(page_title="Blood Donation System", page_icon="🩸", layout=
 st.markdown("<h1 style='text-align:center; margin-bottom: 8px;'>🩸 Blood Donation & Emergency Help System</h1>", unsafe_allow_html=True)
 st.markdown("---")
 
-# ---------- DB Helpers & Schema ----------
-def get_conn():
-    conn = sqlite3.connect(DB)
-    conn.execute("PRAGMA foreign_keys = ON;")
-    return conn
-
-def ensure_schema():
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS Donor (
-        DonorID INTEGER PRIMARY KEY AUTOINCREMENT,
-        Name TEXT NOT NULL,
-        Gender TEXT,
-        DOB TEXT,
-        BloodGroup TEXT NOT NULL,
-        Phone TEXT,
-        Email TEXT,
-        Latitude REAL,
-        Longitude REAL,
-        City TEXT,
-        LastDonationDate TEXT
-    );""")
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS BloodBank (
-        BankID INTEGER PRIMARY KEY AUTOINCREMENT,
-        Name TEXT NOT NULL,
-        Address TEXT,
-        Phone TEXT,
-        Latitude REAL,
-        Longitude REAL,
-        City TEXT
-    );""")
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS Inventory (
-        InventoryID INTEGER PRIMARY KEY AUTOINCREMENT,
-        BankID INTEGER NOT NULL,
-        BloodGroup TEXT NOT NULL,
-        UnitsAvailable INTEGER DEFAULT 0,
-        LastUpdated TEXT,
-        FOREIGN KEY (BankID) REFERENCES BloodBank(BankID) ON DELETE CASCADE
-    );""")
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS Donation (
-        DonationID INTEGER PRIMARY KEY AUTOINCREMENT,
-        DonorID INTEGER NOT NULL,
-        BankID INTEGER,
-        Date TEXT NOT NULL,
-        Units INTEGER NOT NULL,
-        Hemoglobin REAL,
-        FOREIGN KEY (DonorID) REFERENCES Donor(DonorID) ON DELETE CASCADE,
-        FOREIGN KEY (BankID) REFERENCES BloodBank(BankID) ON DELETE SET NULL
-    );""")
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS Request (
-        RequestID INTEGER PRIMARY KEY AUTOINCREMENT,
-        PatientName TEXT,
-        RequiredBloodGroup TEXT NOT NULL,
-        UnitsRequired INTEGER NOT NULL,
-        City TEXT,
-        Email TEXT,
-        Latitude REAL,
-        Longitude REAL,
-        RequestDate TEXT NOT NULL,
-        Status TEXT DEFAULT 'Pending',
-        AssignedBankID INTEGER,
-        AssignedDonorID INTEGER,
-        FOREIGN KEY (AssignedBankID) REFERENCES BloodBank(BankID),
-        FOREIGN KEY (AssignedDonorID) REFERENCES Donor(DonorID)
-    );""")
-    conn.commit()
-    conn.close()
-ensure_schema()
+# ---------- Schema ----------
+migrate()   # no-op once PRAGMA user_version is current
+if AUTO_BACKUP:
+    start_scheduler()           # once per process, survives reruns
+start_snapshotter()             # daily inventory snapshots for as-of reports (ledger.py)
+start_sweeper()                 # writes off expired blood lots (lots.py)
 
 # ---------- Utility ----------
-def run_write(sql, params=()):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(sql, params)
-    conn.commit()
-    conn.close()
-
-def fetch_all(sql, params=()):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(sql, params)
-    rows = cur.fetchall()
-    cols = [d[0] for d in cur.description] if cur.description else []
-    conn.close()
-    return [dict(zip(cols, r)) for r in rows] if cols else []
-
-def fetch_one(sql, params=()):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(sql, params)
-    row = cur.fetchone()
-    conn.close()
-    return row
-
 def iso(d):
     if isinstance(d, (date, datetime)):
         return d.isoformat()[:10]
     return str(d)
 
-def valid_phone(p):
-    return bool(re.match(r"^[0-9]{10}$", p))
-
-def valid_email(e):
-    return bool(re.match(r"[^@]+@[^@]+\.[^@]+", e))
-
-def days_since(date_str):
-    try:
-        dt = datetime.strptime(date_str, "%Y-%m-%d")
-        return (datetime.now() - dt).days
-    except:
-        return None
+def paged_table(key, filters, fetch_page, total):
+    # keyset paging: keep the cursors of the pages we came through (reset when the filters change)
+    state = st.session_state.setdefault(f"{key}_pages", {"filters": None, "cursors": [None]})
+    if state["filters"] != filters:
+        state.update(filters=dict(filters), cursors=[None])
+    cursors = state["cursors"]
+    rows, nxt = fetch_page(cursors[-1])
+    st.dataframe(rows, use_container_width=True, hide_index=True)
+    c1, c2, c3, c4 = st.columns([1,1,1,3])
+    if c1.button("First", key=f"{key}_first", disabled=len(cursors) == 1):
+        state["cursors"] = [None]
+        st.rerun()
+    if c2.button("Previous", key=f"{key}_prev", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    if c3.button("Next", key=f"{key}_next", disabled=nxt is None):
+        cursors.append(nxt)
+        st.rerun()
+    c4.caption(f"Page {len(cursors)} of {max(1, -(-total // BROWSE_PAGE_SIZE))}")
+    return rows
+
+def map_view(key, load):
+    # binned on the server (browse.py): one circle per grid cell, sized by its count
+    detail = st.select_slider("Map detail", ["Auto"] + list(range(3, MAP_MAX_ZOOM + 1)), key=f"{key}_map_zoom")
+    m = load(None if detail == "Auto" else detail)
+    df = m["data"]
+    if df.empty:
+        return
+    if m["mode"] == "bins":
+        df["size"] = m["cell_km"] * 500 * (df["count"] / df["count"].max()) ** 0.5
+        st.map(df, latitude="lat", longitude="lon", size="size")
+        st.caption(f"{m['n']} located, in {len(df)} cells of about {m['cell_km']} km")
+        with st.expander("Largest clusters"):
+            st.dataframe(df.drop(columns="size").nlargest(10, "count").round(4), use_container_width=True, hide_index=True)
+    else:
+        st.map(df, latitude="lat", longitude="lon")
+        st.caption(f"{m['n']} located")
+
+def pick_one(kind, search, id_col):
+    # type-ahead picker: full-text matches for what was typed (search.py)
+    text = st.text_input(f"Find {kind} to edit (name, city, phone... or ID)", key=f"{kind}_pick_q")
+    matches = search(text)
+    opts = ["Add New"] + [f"{m[id_col]} - {m['Name']} ({m['Detail']})" for m in matches]
+    sel = st.selectbox("Select", opts, key=f"{kind}_pick")
+    return None if sel == "Add New" else int(sel.split(" - ")[0])
+
+def bulk_import_ui(kind):
+    # registry files from partner banks (imports.py); bad rows are listed, never fatal
+    with st.expander(f"Bulk import {kind}s (CSV / JSON Lines, .gz ok)"):
+        st.caption("Columns: " + ", ".join(IMPORT_COLUMNS[kind]) + " (* required)")
+        up = st.file_uploader(f"{kind.capitalize()} file", type=["csv", "jsonl", "json", "gz"], key=f"{kind}_import_file")
+        if st.button(f"Import {kind}s", key=f"{kind}_import_btn"):
+            if up is None:
+                st.error("Choose a file first")
+                return
+            bar = st.progress(0.0)
+            status = st.empty()
+            def progress(read, written):
+                status.write(f"{read} rows read, {written} written")
+                bar.progress(min(1.0, up.tell() / max(1, up.size)))
+            n, errors = import_file(kind, up, up.name, progress=progress)
+            bar.progress(1.0)
+            st.success(f"Imported {n} {kind} rows.")
+            if errors:
+                st.warning(f"{len(errors)} rows skipped")
+                st.table([{"Row": r, "Error": e} for r, e in errors[:200]])
 
 # ---------- Email sending ----------
-def load_email_config():
-    if not os.path.exists(EMAIL_CONFIG_FILE):
-        return None
-    with open(EMAIL_CONFIG_FILE, "r") as f:
-        return json.load(f)
+# messages go to the Outbox table; the background worker (mailer.py) sends them
+if SEND_EMAILS:
+    start_worker(EMAIL_CONFIG_FILE)    # once per process, survives reruns
 
 def send_email(recipient_email, subject, body):
-    cfg = load_email_config()
-    if SEND_EMAILS:
-        if not cfg:
-            return False, f"Missing {EMAIL_CONFIG_FILE}"
-        try:
-            msg = EmailMessage()
-            msg["Subject"] = subject
-            sender = cfg.get("email_address")
-            msg["From"] = f"Blood Donation System <{sender}>"
-            msg["To"] = recipient_email
-            msg.set_content(body)
-            host = cfg.get("email_host")
-            port = cfg.get("email_port")
-            password = cfg.get("email_password")
-            use_tls = cfg.get("use_tls", True)
-            if use_tls:
-                server = smtplib.SMTP(host, port, timeout=10)
-                server.starttls()
-                server.login(sender, password)
-                server.send_message(msg)
-                server.quit()
-            else:
-                server = smtplib.SMTP_SSL(host, port, timeout=10)
-                server.login(sender, password)
-                server.send_message(msg)
-                server.quit()
-            return True, "Sent"
-        except Exception as e:
-            return False, str(e)
-    else:
+    if not SEND_EMAILS:
         return False, "Emails disabled (SEND_EMAILS=False)"
+    if not load_email_config(EMAIL_CONFIG_FILE):
+        return False, f"Missing {EMAIL_CONFIG_FILE}"
+    enqueue_email(recipient_email, subject, body)
+    return True, "Queued"
 
 # ---------- OTP helpers ----------
-def generate_otp():
-    return f"{random.randint(0, 999999):06d}"
-
+# codes are stored server-side (otp.py), so any app replica can verify them
 def set_otp_for(action_key, email):
-    otp = generate_otp()
-    expiry = datetime.now() + timedelta(minutes=OTP_EXPIRY_MINUTES)
-    st.session_state[action_key] = {"otp": otp, "expiry": expiry, "email": email}
+    ok, msg, otp = issue_otp(action_key, email, ttl=OTP_EXPIRY_MINUTES * 60)
+    if not ok:
+        return False, msg
     subject = "Blood Donation System — Your OTP"
     body = f"Your OTP for Blood Donation System is: {otp}\nThis code expires in {OTP_EXPIRY_MINUTES} minutes."
     ok, msg = send_email(email, subject, body)
     if ok:
-        return True, "OTP sent to email"
+        return True, "OTP is on its way to your email"
     else:
         return False, f"Failed to send OTP: {msg}"
 
-def verify_otp_for(action_key, code):
-    info = st.session_state.get(action_key)
-    if not info:
-        return False, "No OTP requested for this action"
-    if datetime.now() > info["expiry"]:
-        st.session_state.pop(action_key, None)
-        return False, "OTP expired"
-    if code == info["otp"]:
-        st.session_state.pop(action_key, None)
-        return True, "OTP verified"
-    return False, "Incorrect OTP"
+def verify_otp_for(action_key, email, code):
+    return verify_otp(action_key, email, code)
 
 # ---------- Dashboard ----------
 def dashboard_view():
     st.header("Dashboard")
-    total_donors = fetch_one("SELECT COUNT(*) FROM Donor;")[0]
-    total_banks = fetch_one("SELECT COUNT(*) FROM BloodBank;")[0]
-    units_row = fetch_one("SELECT SUM(UnitsAvailable) FROM Inventory;")
-    total_units = units_row[0] if units_row and units_row[0] else 0
-    pending_requests = fetch_one("SELECT COUNT(*) FROM Request WHERE Status='Pending';")[0]
+    set_low_threshold(LOW_INVENTORY_THRESHOLD)   # no-op unless the config changed
+    stats = dashboard_stats()                    # trigger-maintained, O(1)
+    total_donors, total_banks = stats["donors"], stats["banks"]
+    total_units, pending_requests = stats["units"], stats["pending"]
     c1, c2, c3, c4 = st.columns(4)
     c1.metric("Total Donors", total_donors)
     c2.metric("Total Blood Banks", total_banks)
     c3.metric("Total Units Available", total_units)
     c4.metric("Pending Requests", pending_requests)
     st.markdown("---")
-    low = fetch_all("SELECT BloodBank.Name AS Bank, Inventory.BloodGroup, Inventory.UnitsAvailable FROM Inventory JOIN BloodBank ON Inventory.BankID=BloodBank.BankID WHERE Inventory.UnitsAvailable < ? ORDER BY Inventory.UnitsAvailable ASC", (LOW_INVENTORY_THRESHOLD,))
+    low = low_stock()
     if low:
         st.error("🔴 Low inventory items (units < {})".format(LOW_INVENTORY_THRESHOLD))
         st.table(low)
     else:
         st.success("No low inventory alerts.")
-    donors = fetch_all("SELECT DonorID, Name, LastDonationDate FROM Donor")
-    inactive = []
-    for d in donors:
-        ld = d.get('LastDonationDate')
-        ds = days_since(ld) if ld else None
-        if ds is None or ds > INACTIVE_DAYS:
-            inactive.append({"DonorID": d['DonorID'], "Name": d['Name'], "LastDonationDate": ld, "DaysSince": ds})
-    if inactive:
-        st.warning(f"Donors inactive > {INACTIVE_DAYS} days (or never donated):")
-        st.table(inactive)
+    # days of supply from the daily donated/issued rollups (forecast.py)
+    plan = forecast()
+    soon = [r for r in plan if r["InHorizon"]]
+    if soon:
+        st.warning(f"🟠 {len(soon)} bank/group pairs projected to run out within {HORIZON_DAYS} days")
+        st.dataframe([{k: r[k] for k in ("Bank", "BloodGroup", "Units", "IssuedPerDay", "DonatedPerDay", "DaysOfSupply", "RunsOut")}
+                      for r in soon], use_container_width=True, hide_index=True)
+    elif plan:
+        st.success(f"No bank is projected to run out of any group within {HORIZON_DAYS} days.")
+    with st.expander("Rebalancing plan"):
+        # surplus banks -> short banks, cheapest unit-km first (rebalance.py)
+        c1, c2 = st.columns([1, 1])
+        with c1:
+            cover = st.number_input("Target: days of forecast issues", min_value=0, value=COVER_DAYS, key="rebalance_days")
+        with c2:
+            max_km = st.number_input("Ship at most (km)", min_value=1, value=MAX_KM, key="rebalance_km")
+        if st.button("Compute plan", key="rebalance_plan_btn"):
+            st.session_state["rebalance"] = rebalance_plan(cover_days=int(cover), max_km=float(max_km))
+        if "rebalance" in st.session_state:
+            moves, unmet = st.session_state["rebalance"]
+            if moves:
+                km = sum(m["Units"] * m["DistanceKm"] for m in moves)
+                st.caption(f"{len(moves)} transfers, {sum(m['Units'] for m in moves)} units, {km:,.0f} unit-km")
+                st.dataframe(moves, use_container_width=True, hide_index=True)
+                if st.button("Apply plan", key="rebalance_apply_btn"):
+                    try:
+                        n = apply_rebalance(moves)
+                        st.session_state.pop("rebalance")
+                        st.success(f"{n} transfers booked")
+                    except ValueError as e:
+                        st.error(f"{e}. Stock has moved since the plan was made; compute it again.")
+            else:
+                st.info("No transfers needed")
+            if unmet:
+                st.warning(f"{sum(u['Short'] for u in unmet)} units short at {len(unmet)} bank/groups that no bank in range can cover")
+                st.dataframe(unmet, use_container_width=True, hide_index=True)
+    n_inactive = count_inactive_donors(INACTIVE_DAYS)
+    if n_inactive:
+        st.warning(f"{n_inactive} donors inactive > {INACTIVE_DAYS} days (or never donated):")
+        # keyset paging: keep the cursors of the pages we came through
+        cursors = st.session_state.setdefault("inactive_cursors", [None])
+        rows, nxt = inactive_donors(INACTIVE_DAYS, after=cursors[-1], limit=INACTIVE_PAGE_SIZE)
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+        c1, c2, c3 = st.columns([1,1,4])
+        if c1.button("First page", key="inactive_first", disabled=len(cursors) == 1):
+            st.session_state["inactive_cursors"] = [None]
+            st.rerun()
+        if c2.button("Next page", key="inactive_next", disabled=nxt is None):
+            cursors.append(nxt)
+            st.rerun()
+        c3.caption(f"Page {len(cursors)} of {-(-n_inactive // INACTIVE_PAGE_SIZE)}")
     else:
         st.info("All donors active recently.")
 
@@ -247,37 +236,23 @@ def donors_view():
     st.header("Donors — Add / Edit / Delete / Search")
     # Filters
     with st.expander("Search / Filter"):
-        name_q = st.text_input("Name contains")
-        city_list = [r['City'] for r in fetch_all("SELECT DISTINCT City FROM Donor WHERE City IS NOT NULL")]
-        city_q = st.selectbox("City", ["All"] + city_list)
+        name_q = st.text_input("Search name, city, email or phone")
+        city_q = st.selectbox("City", ["All"] + donor_cities())
         bg_q = st.selectbox("Blood Group", ["All","A+","A-","B+","B-","O+","O-","AB+","AB-"])
-    # Build query
-    q = "SELECT * FROM Donor"
-    conds = []; params = []
-    if name_q:
-        conds.append("Name LIKE ?"); params.append(f"%{name_q}%")
-    if city_q and city_q != "All":
-        conds.append("City = ?"); params.append(city_q)
-    if bg_q and bg_q != "All":
-        conds.append("BloodGroup = ?"); params.append(bg_q)
-    if conds:
-        q += " WHERE " + " AND ".join(conds)
-    donors = fetch_all(q, tuple(params))
-    st.write(f"{len(donors)} donors found")
-    coords = []
-    for d in donors:
-        if d.get('Latitude') is not None and d.get('Longitude') is not None:
-            coords.append({"lat": d['Latitude'], "lon": d['Longitude']})
-    if coords:
-        st.map(coords)
+    filters = dict(text=name_q or None, city=None if city_q == "All" else city_q, group=None if bg_q == "All" else bg_q)
+    n, exact = count_donors(**filters)
+    st.write(f"{n}{'' if exact else '+'} donors found")
+    paged_table("donors", filters, lambda after: browse_donors(**filters, after=after, limit=BROWSE_PAGE_SIZE), n)
+    map_view("donors", lambda zoom: donor_map(**filters, zoom=zoom))
+
+    bulk_import_ui("donor")
 
     st.markdown("### Add new donor / Edit existing")
-    opts = ["Add New"] + [f"{d['DonorID']} - {d['Name']}" for d in donors]
-    sel = st.selectbox("Select", opts)
-    if sel != "Add New":
-        donor_id = int(sel.split(" - ")[0])
-        r = fetch_one("SELECT * FROM Donor WHERE DonorID = ?", (donor_id,))
-        _, name, gender, dob, blood, phone, email, lat, lon, city, lastdon = r
+    donor_id = pick_one("donor", search_donors, "DonorID")
+    r = get_donor(donor_id) if donor_id is not None else None
+    if r:
+        name, gender, dob, blood, phone, email = r['Name'], r['Gender'], r['DOB'], r['BloodGroup'], r['Phone'], r['Email']
+        lat, lon, city, lastdon = r['Latitude'], r['Longitude'], r['City'], r['LastDonationDate']
     else:
         donor_id = None
         name = gender = blood = phone = email = city = ""
@@ -328,10 +303,9 @@ def donors_view():
             if not e:
                 st.error("Provide email first")
             else:
-                ok, msg = verify_otp_for("donor_reg_otp", donor_otp_entered.strip())
+                ok, msg, token = verify_otp_for("donor_reg_otp", e, donor_otp_entered.strip())
                 if ok:
-                    # mark verified for this email
-                    st.session_state["donor_reg_verified_email"] = e
+                    st.session_state["donor_reg_token"] = token   # proof for this session only
                     st.success("OTP verified for " + e)
                 else:
                     st.error(msg)
@@ -353,8 +327,7 @@ def donors_view():
     if submitted:
         # if inserting new donor, OTP required
         if donor_id is None:
-            verified_email = st.session_state.get("donor_reg_verified_email")
-            if not verified_email or verified_email != st.session_state.get("donor_otp_email", "").strip():
+            if not is_verified("donor_reg_otp", st.session_state.get("donor_otp_email", ""), st.session_state.get("donor_reg_token")):
                 st.error("To add a new donor, you must verify the email with OTP. Send & verify OTP first.")
                 st.stop()
         # validate fields
@@ -376,8 +349,7 @@ def donors_view():
                           (name, gender, dob_s, blood, phone, email, lat, lon, city, lastdon_s))
                 st.success("Donor added")
                 # clean verified flag to avoid reuse
-                if "donor_reg_verified_email" in st.session_state:
-                    st.session_state.pop("donor_reg_verified_email", None)
+                consume_verification("donor_reg_otp", st.session_state.get("donor_otp_email", ""), st.session_state.pop("donor_reg_token", None))
 
     # delete donor (outside any form)
     st.markdown("#### Delete Donor (dangerous)")
@@ -393,21 +365,18 @@ def donors_view():
 # ---------- Banks CRUD ----------
 def banks_view():
     st.header("Blood Banks — Add / Edit / Delete")
-    banks = fetch_all("SELECT * FROM BloodBank")
-    st.write(f"{len(banks)} banks")
-    coords = []
-    for b in banks:
-        if b.get('Latitude') is not None and b.get('Longitude') is not None:
-            coords.append({"lat": b['Latitude'], "lon": b['Longitude']})
-    if coords:
-        st.map(coords)
+    bank_q = st.text_input("Search name, address or city", key="bank_name_q")
+    filters = dict(text=bank_q or None)
+    n, exact = count_banks(**filters)
+    st.write(f"{n}{'' if exact else '+'} banks")
+    paged_table("banks", filters, lambda after: browse_banks(**filters, after=after, limit=BROWSE_PAGE_SIZE), n)
+    map_view("banks", lambda zoom: bank_map(**filters, zoom=zoom))
+    bulk_import_ui("bank")
     st.markdown("### Add / Edit Bank")
-    opts = ["Add New"] + [f"{b['BankID']} - {b['Name']}" for b in banks]
-    sel = st.selectbox("Select bank", opts)
-    if sel != "Add New":
-        bid = int(sel.split(" - ")[0])
-        r = fetch_one("SELECT * FROM BloodBank WHERE BankID = ?", (bid,))
-        _, name, address, phone, lat, lon, city = r
+    bid = pick_one("bank", search_banks, "BankID")
+    r = get_bank(bid) if bid is not None else None
+    if r:
+        name, address, phone, lat, lon, city = r['Name'], r['Address'], r['Phone'], r['Latitude'], r['Longitude'], r['City']
     else:
         bid = None
         name = address = phone = city = ""
@@ -445,8 +414,9 @@ def banks_view():
 # ---------- Donations CRUD / Inventory update ----------
 def donations_view():
     st.header("Donations — Log / Delete / Recent")
-    donors = fetch_all("SELECT DonorID, Name FROM Donor ORDER BY Name")
-    banks = fetch_all("SELECT BankID, Name FROM BloodBank ORDER BY Name")
+    # reference lists: served from the query cache until a write touches Donor/BloodBank
+    donors = cached_fetch_all("SELECT DonorID, Name FROM Donor ORDER BY Name")
+    banks = cached_fetch_all("SELECT BankID, Name FROM BloodBank ORDER BY Name")
     if not donors or not banks:
         st.info("Add donors and banks first")
         return
@@ -461,16 +431,22 @@ def donations_view():
         sub = st.form_submit_button("Log Donation")
     if sub:
         did = int(donor_sel.split(" - ")[0]); bid = int(bank_sel.split(" - ")[0])
-        dstr = iso(ddate)
-        run_write("INSERT INTO Donation (DonorID,BankID,Date,Units,Hemoglobin) VALUES (?,?,?,?,?)", (did,bid,dstr,units,hb))
-        run_write("UPDATE Donor SET LastDonationDate = ? WHERE DonorID = ?", (dstr, did))
-        bg = fetch_one("SELECT BloodGroup FROM Donor WHERE DonorID = ?", (did,))[0]
-        row = fetch_one("SELECT UnitsAvailable FROM Inventory WHERE BankID = ? AND BloodGroup = ?", (bid, bg))
-        if row:
-            run_write("UPDATE Inventory SET UnitsAvailable = UnitsAvailable + ?, LastUpdated = ? WHERE BankID = ? AND BloodGroup = ?", (units, dstr, bid, bg))
-        else:
-            run_write("INSERT INTO Inventory (BankID,BloodGroup,UnitsAvailable,LastUpdated) VALUES (?,?,?,?)", (bid, bg, units, dstr))
+        log_donation(did, bid, iso(ddate), units, hb)
         st.success("Donation logged and inventory updated.")
+    with st.expander("Bulk import (donation drive CSV)"):
+        st.caption("Columns: DonorID, BankID, Date (YYYY-MM-DD), Units, Hemoglobin. Missing dates use the drive date below.")
+        up = st.file_uploader("Donations CSV", type=["csv"], key="drive_csv")
+        drive_date = st.date_input("Drive date", value=date.today(), key="drive_date")
+        if st.button("Import donations", key="drive_import_btn"):
+            if up is None:
+                st.error("Choose a CSV file first")
+            else:
+                rows = read_donation_csv(io.TextIOWrapper(up, encoding="utf-8-sig"))
+                n, errors = import_donation_drive(rows, default_date=iso(drive_date))
+                st.success(f"Imported {n} donations in one transaction.")
+                if errors:
+                    st.warning(f"{len(errors)} rows skipped")
+                    st.table([{"Row": r, "Error": e} for r, e in errors[:200]])
     st.markdown("### Recent Donations")
     rec = fetch_all("""SELECT D.DonationID, Donor.Name AS Donor, BloodBank.Name AS Bank, D.Date, D.Units, D.Hemoglobin
                        FROM Donation D JOIN Donor ON D.DonorID = Donor.DonorID JOIN BloodBank ON D.BankID = BloodBank.BankID
@@ -484,8 +460,13 @@ def donations_view():
     pin = st.text_input("Admin PIN", type="password", key="del_d_pin")
     if st.button("Delete Donation", key="delete_donation_btn"):
         if delid > 0 and pin == ADMIN_PIN:
-            run_write("DELETE FROM Donation WHERE DonationID = ?", (delid,))
-            st.success("Donation deleted (inventory NOT auto-corrected).")
+            try:
+                if delete_donation(int(delid)):
+                    st.success("Donation deleted and its units taken back out of inventory.")
+                else:
+                    st.error("No such donation")
+            except ValueError as e:
+                st.error(str(e))
         else:
             st.error("Invalid ID or PIN")
 
@@ -516,9 +497,9 @@ def requests_view():
             if not e:
                 st.error("Provide email first")
             else:
-                ok, msg = verify_otp_for("req_reg_otp", req_otp_entered.strip())
+                ok, msg, token = verify_otp_for("req_reg_otp", e, req_otp_entered.strip())
                 if ok:
-                    st.session_state["req_reg_verified_email"] = e
+                    st.session_state["req_reg_token"] = token     # proof for this session only
                     st.success("OTP verified for " + e)
                 else:
                     st.error(msg)
@@ -536,47 +517,69 @@ def requests_view():
         s = st.form_submit_button("Create Request")
     if s:
         # require OTP verification for request creation
-        verified = st.session_state.get("req_reg_verified_email")
-        if not verified or verified != st.session_state.get("req_otp_email", "").strip():
+        if not is_verified("req_reg_otp", st.session_state.get("req_otp_email", ""), st.session_state.get("req_reg_token")):
             st.error("To create a request, you must verify the email with OTP. Send & verify OTP first.")
             st.stop()
         run_write("INSERT INTO Request (PatientName, RequiredBloodGroup, UnitsRequired, City, Email, Latitude, Longitude, RequestDate) VALUES (?,?,?,?,?,?,?,?)",
                   (patient, req_bg, units, city, st.session_state.get("req_otp_email","").strip(), lat, lon, iso(rdate)))
         st.success("Request created")
-        if "req_reg_verified_email" in st.session_state:
-            st.session_state.pop("req_reg_verified_email", None)
+        consume_verification("req_reg_otp", st.session_state.get("req_otp_email", ""), st.session_state.pop("req_reg_token", None))
 
     st.markdown("### Pending Requests (suggestions shown)")
     pending = fetch_all("SELECT * FROM Request WHERE Status='Pending' ORDER BY RequestDate DESC")
     if not pending:
         st.info("No pending requests")
     else:
+        # one matching pass for every pending request (compatible groups, no double-booking)
+        plan = {m['RequestID']: m for m in match_requests(sorted(pending, key=lambda x: (x['RequestDate'], x['RequestID'])))}
         for r in pending:
             st.write(f"Request {r['RequestID']}: {r['PatientName']} — {r['RequiredBloodGroup']} x {r['UnitsRequired']} ({r['City']})")
-            banks = fetch_all("""SELECT Inventory.BankID, BloodBank.Name, Inventory.UnitsAvailable, BloodBank.Latitude, BloodBank.Longitude
-                                 FROM Inventory JOIN BloodBank ON Inventory.BankID = BloodBank.BankID
-                                 WHERE Inventory.BloodGroup = ? AND Inventory.UnitsAvailable >= ?""", (r['RequiredBloodGroup'], r['UnitsRequired']))
-            if banks:
-                for b in banks:
-                    b['dist2'] = (b['Latitude'] - r['Latitude'])**2 + (b['Longitude'] - r['Longitude'])**2
-                banks_sorted = sorted(banks, key=lambda x: x['dist2'])
-                nearest = banks_sorted[0]
-                st.success(f"Suggested Bank: {nearest['Name']} — UnitsAvailable: {nearest['UnitsAvailable']}")
-                if st.button(f"Assign Bank {nearest['BankID']} to Req {r['RequestID']}", key=f"assignb_{r['RequestID']}"):
-                    run_write("UPDATE Request SET AssignedBankID=?, Status='Assigned' WHERE RequestID = ?", (nearest['BankID'], r['RequestID']))
-                    run_write("UPDATE Inventory SET UnitsAvailable = UnitsAvailable - ? WHERE BankID = ? AND BloodGroup = ?", (r['UnitsRequired'], nearest['BankID'], r['RequiredBloodGroup']))
-                    st.success("Assigned and inventory decremented")
+            m = plan.get(r['RequestID'])
+            if m and m['BankID'] is not None:
+                dist = f" — {m['DistanceKm']} km away" if m['DistanceKm'] is not None else ""
+                grp = "" if m['Exact'] else f" — compatible group {m['BloodGroup']}"
+                st.success(f"Suggested Bank: {m['Bank']} — UnitsAvailable: {m['UnitsAvailable']}{grp}{dist}")
+                if st.button(f"Assign Bank {m['BankID']} to Req {r['RequestID']}", key=f"assignb_{r['RequestID']}"):
+                    # one transaction that re-checks status and stock; another operator may have been faster
+                    ok, msg = reserve_bank(r['RequestID'], m['BankID'], m['BloodGroup'])
+                    (st.success if ok else st.error)(msg)
             else:
                 st.warning("No bank with sufficient units. Showing nearest donors.")
-                donors = fetch_all("SELECT DonorID, Name, Latitude, Longitude, Phone FROM Donor WHERE BloodGroup = ?", (r['RequiredBloodGroup'],))
+                donors = nearest_donors(r['Latitude'], r['Longitude'], compatible_groups(r['RequiredBloodGroup']), k=1)
                 if donors:
-                    for d in donors:
-                        d['dist2'] = (d['Latitude'] - r['Latitude'])**2 + (d['Longitude'] - r['Longitude'])**2
-                    nearest = sorted(donors, key=lambda x: x['dist2'])[0]
-                    st.info(f"Suggested Donor: {nearest['Name']} — Phone: {nearest.get('Phone')}")
+                    nearest = donors[0]
+                    dist = f" — {nearest['DistanceKm']} km away" if nearest['DistanceKm'] is not None else ""
+                    st.info(f"Suggested Donor: {nearest['Name']} ({nearest['BloodGroup']}) — Phone: {nearest.get('Phone')}{dist}")
                     if st.button(f"Assign Donor {nearest['DonorID']} to Req {r['RequestID']}", key=f"assignd_{r['RequestID']}"):
-                        run_write("UPDATE Request SET AssignedDonorID=?, Status='Assigned' WHERE RequestID = ?", (nearest['DonorID'], r['RequestID']))
-                        st.success("Donor assigned")
+                        ok, msg = assign_donor(r['RequestID'], nearest['DonorID'])
+                        (st.success if ok else st.error)(msg)
+                # emergency broadcast to every eligible compatible donor nearby
+                with st.expander(f"Emergency broadcast for Req {r['RequestID']}"):
+                    summary = broadcast_summary(r['RequestID'])
+                    st.write(f"Notified: {summary['Notified']} — Yes: {summary['Yes']} — No: {summary['No']}")
+                    radius = st.number_input("Radius (km)", min_value=1, max_value=500, value=BROADCAST_RADIUS_KM, key=f"bc_radius_{r['RequestID']}")
+                    if st.button("Alert donors", key=f"bc_send_{r['RequestID']}"):
+                        if not SEND_EMAILS or not load_email_config(EMAIL_CONFIG_FILE):
+                            st.error(f"Emails disabled or missing {EMAIL_CONFIG_FILE}")
+                        else:
+                            try:
+                                _, sent, skipped = broadcast_request(r['RequestID'], radius)
+                                st.success(f"Queued alerts to {sent} donors ({skipped} already alerted recently)")
+                            except ValueError as e:
+                                st.error(str(e))
+                    c1, c2 = st.columns([1, 1])
+                    with c1:
+                        resp_donor = st.number_input("DonorID who replied", min_value=0, step=1, key=f"bc_donor_{r['RequestID']}")
+                    with c2:
+                        resp = st.radio("Response", ["yes", "no"], horizontal=True, key=f"bc_resp_{r['RequestID']}")
+                    if st.button("Record response", key=f"bc_record_{r['RequestID']}"):
+                        if record_response(r['RequestID'], int(resp_donor), resp):
+                            st.success("Response recorded")
+                        else:
+                            st.error("That donor was not alerted for this request")
+                    willing = willing_donors(r['RequestID'])
+                    if willing:
+                        st.table(willing)
             st.markdown("---")
     st.markdown("### All Requests (recent)")
     allr = fetch_all("SELECT * FROM Request ORDER BY RequestDate DESC LIMIT 20")
@@ -589,11 +592,23 @@ def requests_view():
             st.success("Request marked fulfilled")
         else:
             st.error("Enter a valid RequestID")
+    st.markdown("#### Release / Cancel Assignment")
+    relid = st.number_input("RequestID (0 skip)", min_value=0, step=1, key="release_req")
+    c1, c2 = st.columns([1, 1])
+    with c1:
+        if st.button("Release (back to Pending)", key="release_req_btn") and relid > 0:
+            ok, msg = release(int(relid))
+            (st.success if ok else st.error)(msg)
+    with c2:
+        if st.button("Cancel request", key="cancel_req_btn") and relid > 0:
+            ok, msg = release(int(relid), cancel=True)
+            (st.success if ok else st.error)(msg)
     st.markdown("#### Delete Request (dangerous)")
     delid = st.number_input("RequestID to delete (0 skip)", min_value=0, step=1, key="del_req")
     pin = st.text_input("Admin PIN", type="password", key="del_req_pin")
     if st.button("Delete Request", key="delete_request_btn"):
         if delid > 0 and pin == ADMIN_PIN:
+            release(int(delid), cancel=True)   # return any reserved units first
             run_write("DELETE FROM Request WHERE RequestID = ?", (delid,))
             st.success("Request deleted")
         else:
@@ -602,31 +617,128 @@ def requests_view():
 # ---------- Inventory & Exports ----------
 def inventory_and_export_view():
     st.header("Inventory & Exports")
-    inv = fetch_all("""SELECT Inventory.InventoryID, BloodBank.Name AS Bank, Inventory.BloodGroup, Inventory.UnitsAvailable, Inventory.LastUpdated
+    inv = cached_fetch_all("""SELECT Inventory.InventoryID, BloodBank.Name AS Bank, Inventory.BloodGroup, Inventory.UnitsAvailable, Inventory.LastUpdated
                        FROM Inventory JOIN BloodBank ON Inventory.BankID = BloodBank.BankID ORDER BY Inventory.UnitsAvailable ASC""")
     if inv:
         st.table(inv)
     else:
         st.info("No inventory records")
+    with st.expander("Lots and expiry"):
+        # per-lot stock, served first-expiry-first-out (lots.py)
+        days = st.number_input("Expiring within (days)", min_value=0, value=EXPIRING_DAYS, key="expiring_days")
+        soon = expiring(days)
+        if soon:
+            st.dataframe(soon, use_container_width=True)
+        else:
+            st.info("No lots expire in that window")
+        if st.button("Retire expired lots now", key="retire_lots_btn"):
+            n = retire_expired()
+            st.success(f"{n} expired units written off" if n else "Nothing has expired")
+        banks = cached_fetch_all("SELECT BankID, Name FROM BloodBank ORDER BY Name")
+        if banks:
+            c1, c2, c3 = st.columns([2, 1, 1])
+            with c1:
+                pb = st.selectbox("Bank", [f"{b['BankID']} - {b['Name']}" for b in banks], key="fefo_bank")
+            with c2:
+                pg = st.selectbox("Group", ["A+","A-","B+","B-","O+","O-","AB+","AB-"], key="fefo_group")
+            with c3:
+                pn = st.number_input("Units", min_value=1, value=1, key="fefo_units")
+            lots_used = fefo_plan(int(pb.split(" - ")[0]), pg, int(pn))
+            st.caption(f"A request for {int(pn)} units would be served from these lots")
+            if lots_used:
+                st.table(lots_used)
+            else:
+                st.info("No usable lots")
+    with st.expander("Stock as of a date / movement history"):
+        # nearest snapshot + later movements from InventoryLedger (ledger.py)
+        c1, c2 = st.columns([1, 1])
+        with c1:
+            as_of = st.date_input("Stock at end of", value=date.today(), key="stock_asof")
+        with c2:
+            if st.button("Take snapshot now", key="take_snapshot_btn"):
+                st.success(f"Snapshot {take_snapshot()} stored")
+        rows = stock_as_of(as_of)
+        if rows:
+            st.table(rows)
+        else:
+            st.info("No stock on that date")
+        st.markdown("Recent movements")
+        hist = movements(until=as_of, limit=50)
+        if hist:
+            st.table(hist)
+    with st.expander("Transfer units / book a stock count"):
+        banks = cached_fetch_all("SELECT BankID, Name FROM BloodBank ORDER BY Name")
+        bank_opts = [f"{b['BankID']} - {b['Name']}" for b in banks]
+        if bank_opts:
+            groups = ["A+","A-","B+","B-","O+","O-","AB+","AB-"]
+            c1, c2, c3, c4 = st.columns([2, 2, 1, 1])
+            with c1:
+                src = st.selectbox("From bank", bank_opts, key="xfer_from")
+            with c2:
+                dst = st.selectbox("To bank", bank_opts, key="xfer_to")
+            with c3:
+                grp = st.selectbox("Group", groups, key="xfer_group")
+            with c4:
+                n = st.number_input("Units", min_value=1, value=1, key="xfer_units")
+            if st.button("Transfer", key="xfer_btn"):
+                try:
+                    transfer(int(src.split(" - ")[0]), int(dst.split(" - ")[0]), grp, int(n))
+                    st.success("Transfer booked")
+                except ValueError as e:
+                    st.error(str(e))
+            c1, c2, c3 = st.columns([2, 1, 1])
+            with c1:
+                cb = st.selectbox("Bank counted", bank_opts, key="count_bank")
+            with c2:
+                cg = st.selectbox("Group", groups, key="count_group")
+            with c3:
+                counted = st.number_input("Units on the shelf", min_value=0, value=0, key="count_units")
+            if st.button("Book stock count", key="count_btn"):
+                delta = correct(int(cb.split(" - ")[0]), cg, int(counted))
+                st.success(f"Correction of {delta:+d} units booked" if delta else "Count matches; nothing booked")
+    bulk_import_ui("inventory")
     st.markdown("---")
     st.subheader("Download / Backup")
-    if os.path.exists(DB):
-        with open(DB, "rb") as f:
-            data = f.read()
-        st.download_button("Download database file (.sqlite)", data=data, file_name=DB, mime="application/octet-stream")
-    tlist = [r['name'] for r in fetch_all("SELECT name FROM sqlite_master WHERE type='table'")]
-    sel = st.selectbox("Export table to CSV", [""] + tlist)
+    # consistent online snapshot (backup.py); the file is only read when one is made
+    if st.button("Create backup now", key="create_backup_btn"):
+        bar = st.progress(0.0)
+        path = create_backup(progress=bar.progress)
+        rotate(KEEP_BACKUPS)
+        with open(path, "rb") as f:
+            st.download_button(f"Download {os.path.basename(path)}", data=f, file_name=os.path.basename(path),
+                               mime="application/gzip" if path.endswith(".gz") else "application/octet-stream")
+    st.subheader("Export table")
+    sel = st.selectbox("Table", [""] + export_tables())
     if sel:
-        rows = fetch_all(f"SELECT * FROM {sel}")
-        if rows:
-            header = ",".join(rows[0].keys())
-            lines = [header]
-            for r in rows:
-                lines.append(",".join(str(r[k]) if r[k] is not None else "" for k in r.keys()))
-            csv = "\n".join(lines).encode()
-            st.download_button(f"Download {sel}.csv", data=csv, file_name=f"{sel}.csv", mime="text/csv")
-        else:
-            st.info("No data to export for this table")
+        cols = [c for c, _ in table_columns(sel)]
+        chosen = st.multiselect("Columns", cols, default=cols)
+        c1, c2, c3 = st.columns([1, 1, 2])
+        with c1:
+            fmt = st.selectbox("Format", list(EXPORT_FORMATS))
+        with c2:
+            gz = st.checkbox("gzip", value=False)
+        with c3:
+            fcol = st.selectbox("Filter column (optional)", [""] + cols)
+        filters = []
+        if fcol:
+            f1, f2 = st.columns([1, 2])
+            with f1:
+                fop = st.selectbox("Operator", list(FILTER_OPS))
+            with f2:
+                fval = st.text_input("Value", disabled=fop.startswith("IS"))
+            filters.append((fcol, fop, fval))
+        if st.button("Prepare export", key="prepare_export"):
+            # stream to a temp file and hand the button the open file, like the backup download
+            try:
+                with tempfile.TemporaryDirectory() as tmpdir:
+                    path = os.path.join(tmpdir, export_filename(sel, fmt, gz))
+                    with open(path, "wb") as out:
+                        n = export_table(sel, out, fmt, columns=chosen or None, filters=filters, compress=gz)
+                    with open(path, "rb") as f:
+                        st.download_button(f"Download {n} rows", data=f, file_name=os.path.basename(path),
+                                           mime="application/gzip" if gz and fmt != "parquet" else EXPORT_MIME[fmt])
+            except ValueError as e:
+                st.error(str(e))
 
 # ---------- Simple admin: reset ----------
 def admin_view():
@@ -635,31 +747,108 @@ def admin_view():
     pin = st.text_input("Admin PIN", type="password")
     if st.button("Reset DB (drop tables)", key="reset_db_btn"):
         if pin == ADMIN_PIN:
-            for t in ["Request","Donation","Inventory","BloodBank","Donor"]:
-                run_write(f"DROP TABLE IF EXISTS {t}")
-            ensure_schema()
+            reset_schema()
             st.success("Dropped and re-created schema. (No sample data added.)")
         else:
             st.error("Wrong PIN")
+    st.markdown("Backups (newest first)")
+    backups = list_backups()
+    if backups:
+        st.table([{k: b[k] for k in ("File", "SizeMB", "Created")} for b in backups])
+        pick = st.selectbox("Backup file", [b["File"] for b in backups], key="backup_pick")
+        path = next(b["Path"] for b in backups if b["File"] == pick)
+        c1, c2 = st.columns([1, 1])
+        with c1:
+            if st.button("Verify backup", key="verify_backup_btn"):
+                ok, msg = verify_backup(path)
+                (st.success if ok else st.error)(msg)
+        with c2:
+            if st.button("Restore backup (uses Admin PIN)", key="restore_backup_btn"):
+                if pin != ADMIN_PIN:
+                    st.error("Wrong PIN")
+                else:
+                    ok, msg = restore_backup(path, progress=st.progress(0.0).progress)
+                    if ok:
+                        migrate()
+                        st.success(msg)
+                    else:
+                        st.error(msg)
+    else:
+        st.caption("No backups yet.")
+    st.markdown("Query cache")
+    st.table([cache_stats()])
+    st.markdown("Query profile (since the app started)")
+    order = st.selectbox("Hottest by", ["ms", "calls", "avg_ms", "max_ms", "rows"], key="qstats_order",
+                         format_func={"ms": "total time", "calls": "calls", "avg_ms": "average time",
+                                      "max_ms": "worst time", "rows": "rows"}.get)
+    hot = query_stats(20, order)
+    if hot:
+        st.dataframe(hot, use_container_width=True, hide_index=True)
+        st.dataframe(view_stats(), use_container_width=True, hide_index=True)
+    slow = slow_queries()
+    st.caption(f"{len(slow)} statements slower than {SLOW_QUERY_MS} ms logged")
+    for e in slow[:20]:
+        with st.expander(f"{e['ms']:.0f} ms · {e['view'] or 'background'} · {e['at']}"):
+            st.code(e["sql"], language="sql")
+            if e["params"]:
+                st.caption(f"params {e['params']}, {e['rows']} rows")
+            st.text("\n".join(e["plan"] or ["(no plan)"]))
+    c1, c2 = st.columns([1, 1])
+    with c1:
+        st.download_button("Download query report (JSON)", json.dumps(query_report(), indent=1),
+                           file_name=f"query_report_{date.today().isoformat()}.json", mime="application/json")
+    with c2:
+        if st.button("Reset query stats", key="reset_qstats_btn"):
+            reset_query_stats()
+            st.success("Query stats cleared.")
+    st.markdown("Outbound email queue")
+    outbox = outbox_summary()
+    if outbox:
+        st.table(outbox)
+    else:
+        st.caption("No emails queued yet.")
+    st.markdown("Rebuild dashboard counters from the base tables (repair after manual DB edits).")
+    if st.button("Rebuild dashboard stats", key="rebuild_stats_btn"):
+        rebuild_dashboard_stats(LOW_INVENTORY_THRESHOLD)
+        st.success("Dashboard stats rebuilt.")
 
 # ---------- App Navigation ----------
 menu = ["Dashboard","Donors","Banks","Donations","Requests","Inventory/Export","Admin"]
 choice = st.sidebar.selectbox("Menu", menu)
-
-if choice == "Dashboard":
-    dashboard_view()
-elif choice == "Donors":
-    donors_view()
-elif choice == "Banks":
-    banks_view()
-elif choice == "Donations":
-    donations_view()
-elif choice == "Requests":
-    requests_view()
-elif choice == "Inventory/Export":
-    inventory_and_export_view()
-elif choice == "Admin":
-    admin_view()
+# front-desk lookup across donors, banks and requests
+lookup = st.sidebar.text_input("Quick search", key="quick_search")
+if lookup:
+    hits = quick_search(lookup)
+    if hits:
+        for h in hits:
+            st.sidebar.write(f"{h['Kind'].title()} {h['ID']}: **{h['Label']}** — {h['Detail']}")
+    else:
+        st.sidebar.caption("No matches")
+
+# every statement the view runs is charged to this render (db.py instrumentation)
+with profile_view(choice):
+    if choice == "Dashboard":
+        dashboard_view()
+    elif choice == "Donors":
+        donors_view()
+    elif choice == "Banks":
+        banks_view()
+    elif choice == "Donations":
+        donations_view()
+    elif choice == "Requests":
+        requests_view()
+    elif choice == "Inventory/Export":
+        inventory_and_export_view()
+    elif choice == "Admin":
+        admin_view()
+
+if QUERY_PANEL:
+    prof = last_render(choice)
+    if prof:
+        with st.sidebar.expander(f"Queries: {prof['calls']} in {prof['db_ms']:.0f} ms"):
+            st.caption(f"Page render {prof['ms']:.0f} ms, {prof['rows']} rows read. Slowest statements:")
+            for q in prof["statements"][:5]:
+                st.caption(f"{q['ms']:.1f} ms × {q['calls']} ({q['rows']} rows): `{q['sql'][:120]}`")
 
 # ---------- Quick note ----------
 if SEND_EMAILS and not os.path.exists(EMAIL_CONFIG_FILE):
@@ -0,0 +1,243 @@
+# backup.py
+# Online backups with the SQLite backup API. Pages are copied in steps from a
+# read transaction (WAL readers don't block writers), so the copy is a
+# consistent snapshot and never has to fit in memory. Backups are written to
+# BACKUP_DIR as <db>-YYYYmmdd-HHMMSS.db[.gz], the oldest beyond KEEP_BACKUPS are
+# rotated out, and verify/restore work from the same files.
+#   python backup.py                  take a backup now
+#   python backup.py list
+#   python backup.py verify FILE
+#   python backup.py restore FILE
+import glob
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+import db
+
+BACKUP_DIR = "backups"
+KEEP_BACKUPS = 7                   # newest snapshots kept by rotate()
+BACKUP_STEP_PAGES = 1024           # pages copied per step (4 MB at the default page size)
+BACKUP_STEP_SLEEP = 0.0            # pause between steps; raise it to leave more I/O to the app
+MAX_RESTARTS = 3                   # then fall back to a one-step copy (see _copy)
+BACKUP_INTERVAL_HOURS = 24         # scheduled backups
+COMPRESS_BACKUPS = True
+
+
+def _stem():
+    return os.path.splitext(os.path.basename(db.DB))[0]
+
+
+class _Restarted(Exception):
+    pass
+
+
+def _copy(src, dst, progress=None, pages=BACKUP_STEP_PAGES):
+    # if another connection writes to src between steps SQLite restarts the
+    # copy (so the result is always one consistent snapshot). On a busy database
+    # that can go on forever, so after a few restarts copy everything in a
+    # single step: one read transaction, which in WAL mode doesn't block writers.
+    seen = {"remaining": None, "restarts": 0}
+
+    def step(status, remaining, total):
+        if seen["remaining"] is not None and remaining > seen["remaining"]:
+            seen["restarts"] += 1
+            if seen["restarts"] > MAX_RESTARTS:
+                raise _Restarted()
+        seen["remaining"] = remaining
+        if progress and total:
+            progress((total - remaining) / total)
+    try:
+        src.backup(dst, pages=pages, progress=step, sleep=BACKUP_STEP_SLEEP)
+    except _Restarted:
+        src.backup(dst, pages=-1)
+    if progress:
+        progress(1.0)
+
+
+def _gzip(src_path, dst_path):
+    with open(src_path, "rb") as f, gzip.open(dst_path, "wb", compresslevel=6) as g:
+        shutil.copyfileobj(f, g, 1024 * 1024)
+
+
+def create_backup(directory=None, compress=COMPRESS_BACKUPS, progress=None):
+    """Snapshot the live database into `directory`. Returns the backup path.
+
+    progress(fraction) is called after every step.
+    """
+    directory = directory or BACKUP_DIR
+    os.makedirs(directory, exist_ok=True)
+    name = f"{_stem()}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db"
+    final = os.path.join(directory, name + (".gz" if compress else ""))
+    part = os.path.join(directory, name + ".part")
+    try:
+        dst = sqlite3.connect(part)
+        try:
+            with db.get_conn() as src:
+                _copy(src, dst, progress)
+            # self-contained file: no -wal/-shm needed to open it later
+            dst.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            dst.close()
+        if compress:
+            _gzip(part, final + ".part")
+            os.replace(final + ".part", final)
+        else:
+            os.replace(part, final)
+    finally:
+        for p in (part, final + ".part"):
+            if os.path.exists(p):
+                os.remove(p)
+    return final
+
+
+def list_backups(directory=None):
+    """Backups in `directory`, newest first."""
+    directory = directory or BACKUP_DIR
+    paths = glob.glob(os.path.join(directory, f"{_stem()}-*.db")) + glob.glob(os.path.join(directory, f"{_stem()}-*.db.gz"))
+    out = [{"File": os.path.basename(p), "Path": p, "SizeMB": round(os.path.getsize(p) / 1e6, 2),
+            "Created": datetime.fromtimestamp(os.path.getmtime(p)).strftime("%Y-%m-%d %H:%M:%S")} for p in paths]
+    return sorted(out, key=lambda b: b["File"], reverse=True)
+
+
+def rotate(keep=KEEP_BACKUPS, directory=None):
+    """Delete all but the newest `keep` backups. Returns the deleted paths."""
+    old = [b["Path"] for b in list_backups(directory)[keep:]]
+    for p in old:
+        os.remove(p)
+    return old
+
+
+class _Opened:
+    # a backup as a plain .db file (decompressed to a temp file when gzipped)
+    def __init__(self, path):
+        self.path, self.tmp = path, None
+
+    def __enter__(self):
+        if not self.path.endswith(".gz"):
+            return self.path
+        fd, self.tmp = tempfile.mkstemp(suffix=".db")
+        with os.fdopen(fd, "wb") as f, gzip.open(self.path, "rb") as g:
+            shutil.copyfileobj(g, f, 1024 * 1024)
+        return self.tmp
+
+    def __exit__(self, *exc):
+        if self.tmp and os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+
+def _verify_file(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        if result != "ok":
+            return False, f"integrity_check: {result}"
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        tables = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table'").fetchone()[0]
+        return True, f"ok (schema version {version}, {tables} tables)"
+    except sqlite3.DatabaseError as e:
+        return False, str(e)
+    finally:
+        conn.close()
+
+
+def verify_backup(path):
+    """Run PRAGMA integrity_check on a backup. Returns (ok, msg)."""
+    try:
+        with _Opened(path) as p:
+            return _verify_file(p)
+    except (OSError, EOFError) as e:
+        return False, str(e)
+
+
+def restore_backup(path, progress=None):
+    """Verify a backup and copy it over the live database. Returns (ok, msg).
+
+    The copy goes through the backup API into the live file, so other
+    connections just see the new contents; run migrations afterwards if the
+    backup is from an older schema.
+    """
+    try:
+        with _Opened(path) as p:
+            ok, msg = _verify_file(p)
+            if not ok:
+                return False, f"Backup failed verification: {msg}"
+            src = sqlite3.connect(f"file:{p}?mode=ro", uri=True)
+            try:
+                with db.get_conn() as dst:
+                    _copy(src, dst, progress)
+            finally:
+                src.close()
+    except (OSError, EOFError, sqlite3.Error) as e:
+        return False, f"Restore failed: {e}"
+    db.close_all()
+    db.invalidate_cache()
+    return True, f"Restored {os.path.basename(path)}"
+
+
+# ---------- scheduled backups ----------
+_scheduler = {"thread": None, "stop": threading.Event()}
+_scheduler_lock = threading.Lock()
+
+
+def backup_due(interval_hours=BACKUP_INTERVAL_HOURS, directory=None):
+    # looks at the files, so several app processes don't each take one
+    latest = list_backups(directory)
+    return not latest or time.time() - os.path.getmtime(latest[0]["Path"]) >= interval_hours * 3600
+
+
+def _run(interval_hours, keep, directory):
+    stop = _scheduler["stop"]
+    while not stop.is_set():
+        try:
+            if backup_due(interval_hours, directory):
+                create_backup(directory)
+                rotate(keep, directory)
+        except Exception:
+            pass                   # try again next round (disk full, db locked, ...)
+        stop.wait(min(3600, interval_hours * 3600 / 4))
+
+
+def start_scheduler(interval_hours=BACKUP_INTERVAL_HOURS, keep=KEEP_BACKUPS, directory=None):
+    """Take rotating backups in a background thread (once per process)."""
+    with _scheduler_lock:
+        t = _scheduler["thread"]
+        if t and t.is_alive():
+            return t
+        _scheduler["stop"].clear()
+        t = threading.Thread(target=_run, args=(interval_hours, keep, directory), name="backup-scheduler", daemon=True)
+        t.start()
+        _scheduler["thread"] = t
+        return t
+
+
+def stop_scheduler(timeout=10):
+    _scheduler["stop"].set()
+    if _scheduler["thread"]:
+        _scheduler["thread"].join(timeout)
+    _scheduler["thread"] = None
+
+
+if __name__ == "__main__":
+    import sys
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "backup"
+    if cmd == "backup":
+        t = time.perf_counter()
+        path = create_backup(progress=lambda f: print(f"\r{f:6.1%}", end="", flush=True))
+        print(f"\n{path} in {time.perf_counter() - t:.2f}s; rotated out: {rotate()}")
+    elif cmd == "list":
+        for b in list_backups():
+            print(b["File"], b["SizeMB"], "MB", b["Created"])
+    elif cmd in ("verify", "restore") and len(sys.argv) > 2:
+        ok, msg = (verify_backup if cmd == "verify" else restore_backup)(sys.argv[2])
+        print(msg)
+        if cmd == "restore" and ok:
+            from migrations import migrate
+            print("schema version", migrate())
+        sys.exit(0 if ok else 1)
+    else:
+        sys.exit("usage: python backup.py [backup | list | verify FILE | restore FILE]")
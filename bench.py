@@ -0,0 +1,193 @@
+# bench.py
+# Times the app's core operations against a database (normally one made by
+# synthetic.py) and appends the numbers to bench_results.jsonl, so a run can
+# be compared with earlier ones on the same dataset.
+#   python synthetic.py bench.db --donors 1000000 --banks 2000 --years 3
+#   python bench.py bench.db                     run everything
+#   python bench.py bench.db --only search --repeat 50
+#   python bench.py bench.db --compare           also diff against the previous run
+# The write cases (donation logging, reservations) really write: run them on
+# a synthetic database, not the live one.
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import time
+from datetime import date, datetime, timedelta
+import db
+
+RESULTS_FILE = "bench_results.jsonl"
+REPEAT = 20                        # timed calls per case (heavy cases cap this, see _cases)
+WARMUP = 2                         # untimed calls first (page cache, statement cache)
+REGRESSION_PCT = 20                # --compare flags medians this much slower...
+NOISE_MS = 0.5                     # ...and at least this much slower (sub-ms cases jitter)
+
+SEARCH_TERMS = ["asha", "sharma", "riya ku", "mumbai", "pune pa", "rahul verma", "98", "kolkata o", "nair", "del"]
+
+
+def _sizes():
+    return {t.lower(): db.fetch_one(f"SELECT COUNT(*) FROM {t}")[0] for t in ("Donor", "BloodBank", "Donation", "Request")}
+
+
+def _commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _cases(rnd):
+    # name -> (callable, max repeats). Imports here so --help works without the app's dependencies.
+    from stats import dashboard_stats, low_stock
+    from reports import count_inactive_donors, inactive_donors
+    from browse import browse_donors, count_donors, search_donors, donor_map
+    from search import search
+    from geo import nearest_donors, nearest_banks
+    from matching import match_requests, load_pending_requests
+    from donations import log_donation
+    from reservations import reserve_bank, release
+    from ledger import stock_as_of
+    from lots import plan
+    from rebalance import plan as rebalance_plan
+    from exports import export_table
+
+    donor_max = db.fetch_one("SELECT MAX(DonorID) FROM Donor")[0] or 1
+    banks = [r["BankID"] for r in db.fetch_all("SELECT BankID FROM BloodBank")]
+    places = db.fetch_all("SELECT Latitude, Longitude FROM BloodBank WHERE Latitude IS NOT NULL") or [{"Latitude": 19.07, "Longitude": 72.87}]
+    terms = iter(SEARCH_TERMS * 1000)
+
+    def place():
+        p = rnd.choice(places)
+        return p["Latitude"], p["Longitude"]
+
+    def donate():
+        log_donation(rnd.randint(1, donor_max), rnd.choice(banks), date.today().isoformat(), 1, 13.5)
+
+    def reserve_release():
+        # a pending request and a bank that can serve it, then hand the units back
+        pending = load_pending_requests()
+        if not pending:
+            return
+        r = rnd.choice(pending)
+        row = db.fetch_one("""SELECT BankID, BloodGroup FROM Inventory WHERE BloodGroup = ? AND UnitsAvailable >= ?
+                              ORDER BY UnitsAvailable DESC LIMIT 1""", (r["RequiredBloodGroup"], r["UnitsRequired"]))
+        if row and reserve_bank(r["RequestID"], row[0], row[1])[0]:
+            release(r["RequestID"])
+
+    def export_donations():
+        export_table("Donation", io.BytesIO(), "csv")
+
+    year_ago = date.today() - timedelta(days=365)
+    return {
+        "dashboard": (lambda: (dashboard_stats(), low_stock()), None),
+        "inactive_report": (lambda: (count_inactive_donors(), inactive_donors(limit=50)), None),
+        "donor_page": (lambda: (browse_donors(limit=25), count_donors()), None),
+        "donor_filter": (lambda: browse_donors(city="Pune", group="O-", limit=25), None),
+        "donor_search": (lambda: search_donors(next(terms)), None),
+        "search": (lambda: search(next(terms)), None),
+        "donor_map": (lambda: donor_map(group=rnd.choice(["O+", "O-", "A+", "B+", None])), None),
+        "nearest_donors": (lambda: nearest_donors(*place(), group=["O+", "O-"], k=10), None),
+        "nearest_banks": (lambda: nearest_banks(*place(), group=["O+", "O-"], min_units=2, k=5), None),
+        "match_requests": (match_requests, 5),
+        "stock_as_of": (lambda: stock_as_of(year_ago), 5),
+        "fefo_plan": (lambda: plan(rnd.choice(banks), rnd.choice(["O+", "A+", "B+", "O-"]), 10), None),
+        "rebalance_plan": (rebalance_plan, 3),
+        "log_donation": (donate, None),
+        "reserve_release": (reserve_release, None),
+        "export_donations": (export_donations, 3),
+    }
+
+
+def _time(fn, repeat):
+    for _ in range(min(WARMUP, repeat)):
+        fn()
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t) * 1000)
+    times.sort()
+    return {"n": repeat, "min_ms": round(times[0], 3), "median_ms": round(statistics.median(times), 3),
+            "p95_ms": round(times[min(len(times) - 1, int(len(times) * 0.95))], 3)}
+
+
+def run(path, only=None, repeat=REPEAT, seed=1, progress=print):
+    """Benchmark the database at `path`. Returns the result record (also appended to RESULTS_FILE)."""
+    if not os.path.exists(path):
+        raise ValueError(f"No database at {path}; make one with synthetic.py")
+    live = db.DB
+    db.configure(path)
+    try:
+        from migrations import migrate
+        migrate()
+        record = {"at": datetime.now().isoformat(timespec="seconds"), "commit": _commit(), "db": os.path.abspath(path),
+                  "sizes": _sizes(), "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                  "profile": db.DB_PROFILE, "results": {}}
+        for name, (fn, cap) in _cases(random.Random(seed)).items():
+            if only and not any(o in name for o in only):
+                continue
+            n = min(repeat, cap) if cap else repeat
+            record["results"][name] = r = _time(fn, n)
+            progress(f"{name:<18} median {r['median_ms']:>10.2f} ms   p95 {r['p95_ms']:>10.2f} ms   (n={n})")
+    finally:
+        db.configure(live)
+    with open(RESULTS_FILE, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    return record
+
+
+def previous_run(record):
+    """The latest earlier run on a dataset of the same shape (donor and bank counts)."""
+    if not os.path.exists(RESULTS_FILE):
+        return None
+    key = (record["sizes"]["donor"], record["sizes"]["bloodbank"])
+    best = None
+    with open(RESULTS_FILE) as f:
+        for line in f:
+            r = json.loads(line)
+            if r != record and (r["sizes"]["donor"], r["sizes"]["bloodbank"]) == key:
+                best = r
+    return best
+
+
+def compare(record, old):
+    """[(case, old median, new median, change %, regressed)] for cases in both runs."""
+    out = []
+    for name, new in record["results"].items():
+        if name in old["results"]:
+            before, after = old["results"][name]["median_ms"], new["median_ms"]
+            pct = (after - before) / before * 100 if before else 0.0
+            out.append((name, before, after, round(pct, 1), pct > REGRESSION_PCT and after - before > NOISE_MS))
+    return out
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Time the core operations on a (synthetic) database.")
+    p.add_argument("path")
+    p.add_argument("--only", nargs="*", help="run only cases whose name contains one of these")
+    p.add_argument("--repeat", type=int, default=REPEAT)
+    p.add_argument("--compare", action="store_true", help=f"diff against the previous run in {RESULTS_FILE}")
+    a = p.parse_args()
+    try:
+        rec = run(a.path, a.only, a.repeat)
+    except ValueError as e:
+        p.exit(1, f"{e}\n")
+    print(f"sizes {rec['sizes']} -> {RESULTS_FILE}")
+    if a.compare:
+        old = previous_run(rec)
+        if old is None:
+            print("no earlier run on a dataset of this size")
+        else:
+            print(f"vs {old['at']} ({old['commit']}):")
+            rows = compare(rec, old)
+            for name, before, after, pct, bad in rows:
+                print(f"{name:<18} {before:>10.2f} -> {after:>10.2f} ms  {pct:+6.1f}%{'  SLOWER' if bad else ''}")
+            if any(r[4] for r in rows):
+                raise SystemExit(1)
@@ -0,0 +1,96 @@
+# broadcast.py
+# Emergency broadcast: notify every eligible, compatible donor near a request.
+# Recipients are picked with the R*Tree (geo.donors_within), de-duplicated
+# against earlier broadcasts and queued in one transaction on the Outbox, where
+# mailer.py's rate-limited sender threads fan them out. Donor replies are
+# recorded per recipient and summarised against the Request.
+import time
+from db import transaction, fetch_all, fetch_one
+from geo import donors_within, has_coords
+from mailer import enqueue_many
+from matching import compatible_groups
+
+BROADCAST_RADIUS_KM = 25
+MIN_DONATION_GAP_DAYS = 90         # whole blood donors must wait this long between donations
+DEDUPE_HOURS = 24                  # don't alert the same donor again within this window
+RESPONSES = ("yes", "no")
+
+
+def eligible_donors(request, radius_km=BROADCAST_RADIUS_KM):
+    """Compatible donors with an email who may donate again, within radius_km of the request."""
+    return donors_within(request["Latitude"], request["Longitude"], radius_km,
+                         compatible_groups(request["RequiredBloodGroup"]),
+                         where="d.Email IS NOT NULL AND d.Email != '' "
+                               "AND coalesce(d.LastDonationDate, '') <= date('now', 'localtime', ?)",
+                         params=(f"-{MIN_DONATION_GAP_DAYS} days",))
+
+
+def _recently_alerted(request_id, since):
+    rows = fetch_all("""SELECT DISTINCT r.DonorID FROM BroadcastRecipient r JOIN Broadcast b ON b.BroadcastID = r.BroadcastID
+                        WHERE b.RequestID = ? OR b.CreatedAt >= ?""", (request_id, since))
+    return {r["DonorID"] for r in rows}
+
+
+def _message(request, donor):
+    subject = f"URGENT: {request['RequiredBloodGroup']} blood needed near you"
+    body = (f"Dear {donor['Name']},\n\n"
+            f"A patient in {request['City'] or 'your area'} urgently needs {request['UnitsRequired']} unit(s) of "
+            f"{request['RequiredBloodGroup']} blood, about {donor['DistanceKm']} km from you. "
+            f"Your blood group ({donor['BloodGroup']}) is compatible.\n\n"
+            f"If you can donate, please reply YES to this email (reference: request #{request['RequestID']}).\n\n"
+            "Blood Donation System")
+    return donor["Email"], subject, body
+
+
+def broadcast_request(request_id, radius_km=BROADCAST_RADIUS_KM, dedupe_hours=DEDUPE_HOURS):
+    """Alert eligible compatible donors near a request.
+
+    Returns (broadcast_id, notified, skipped_as_duplicates). Raises ValueError
+    when the request doesn't exist or has no coordinates.
+    """
+    reqs = fetch_all("SELECT * FROM Request WHERE RequestID = ?", (request_id,))
+    if not reqs:
+        raise ValueError(f"No request {request_id}")
+    req = reqs[0]
+    if not has_coords(req["Latitude"], req["Longitude"]):
+        raise ValueError("Request has no coordinates to search around")
+    donors = eligible_donors(req, radius_km)
+    now = time.time()
+    seen = _recently_alerted(request_id, now - dedupe_hours * 3600)
+    targets = [d for d in donors if d["DonorID"] not in seen]
+    with transaction() as conn:
+        bid = conn.execute("INSERT INTO Broadcast (RequestID, RadiusKm, CreatedAt, Notified) VALUES (?,?,?,?)",
+                           (request_id, radius_km, now, len(targets))).lastrowid
+        conn.executemany("INSERT INTO BroadcastRecipient (BroadcastID, DonorID, DistanceKm) VALUES (?,?,?)",
+                         [(bid, d["DonorID"], d["DistanceKm"]) for d in targets])
+        enqueue_many([_message(req, d) for d in targets])
+    return bid, len(targets), len(donors) - len(targets)
+
+
+def record_response(request_id, donor_id, response):
+    """Record a donor's yes/no to the latest broadcast they got for this request."""
+    if response not in RESPONSES:
+        raise ValueError(f"response must be one of {RESPONSES}")
+    with transaction() as conn:
+        row = conn.execute("""SELECT r.BroadcastID FROM BroadcastRecipient r JOIN Broadcast b ON b.BroadcastID = r.BroadcastID
+                              WHERE b.RequestID = ? AND r.DonorID = ? ORDER BY r.BroadcastID DESC LIMIT 1""",
+                           (request_id, donor_id)).fetchone()
+        if not row:
+            return False
+        conn.execute("UPDATE BroadcastRecipient SET Response = ?, RespondedAt = ? WHERE BroadcastID = ? AND DonorID = ?",
+                     (response, time.time(), row[0], donor_id))
+    return True
+
+
+def broadcast_summary(request_id):
+    row = fetch_one("""SELECT COUNT(*), coalesce(SUM(r.Response = 'yes'), 0), coalesce(SUM(r.Response = 'no'), 0)
+                       FROM BroadcastRecipient r JOIN Broadcast b ON b.BroadcastID = r.BroadcastID
+                       WHERE b.RequestID = ?""", (request_id,))
+    return {"Notified": row[0], "Yes": row[1], "No": row[2]}
+
+
+def willing_donors(request_id):
+    return fetch_all("""SELECT d.DonorID, d.Name, d.BloodGroup, d.Phone, r.DistanceKm
+                        FROM BroadcastRecipient r JOIN Broadcast b ON b.BroadcastID = r.BroadcastID
+                        JOIN Donor d ON d.DonorID = r.DonorID
+                        WHERE b.RequestID = ? AND r.Response = 'yes' ORDER BY r.DistanceKm""", (request_id,))
@@ -0,0 +1,201 @@
+# browse.py
+# Paged browsing and type-ahead lookup for the Donors and Banks pages.
+# Pages are keyset-paged on the primary key (WHERE ... AND DonorID > cursor
+# LIMIT n), so every page costs the same however deep it is; totals come from
+# the trigger-maintained DashboardStats row or a capped COUNT. Text filters and
+# the pickers go through the FTS5 indexes (search.py).
+# The page maps get the whole filtered set, aggregated in SQL into grid cells
+# sized for its extent (counts per blood group); single points are only sent
+# when few remain. Donor counts per fine cell are kept current by triggers
+# (DonorMapCell), so the national map sums a few thousand cells instead of
+# grouping every donor. Bins go through the query cache.
+import math
+from db import fetch_all, fetch_one, cached_fetch_all, fetch_columns
+from search import search, match_query, matching_ids
+
+PAGE_SIZE = 25
+COUNT_CAP = 10000                  # filtered counts stop here ("10000+")
+SEARCH_LIMIT = 20                  # suggestions shown by the pickers
+MAP_POINTS_MAX = 2000              # up to this many located rows the map shows each one
+MAP_TARGET_CELLS = 48              # grid cells across the filtered extent when binning
+MAP_MAX_ZOOM = 16                  # finest grid: 360 / 2**16 degrees (~600 m)
+MAP_CELL_ZOOM = 12                 # grid kept in DonorMapCell (~10 km cells); coarser grids are sums of it
+
+DONOR_COLS = "DonorID, Name, Gender, DOB, BloodGroup, Phone, Email, City, Latitude, Longitude, LastDonationDate"
+BANK_COLS = "BankID, Name, Address, Phone, City, Latitude, Longitude"
+
+
+def _text_filter(kind, text):
+    q = match_query(text)
+    return ([matching_ids(kind)], [q]) if q else ([], [])
+
+
+def _donor_filter(text=None, city=None, group=None):
+    conds, params = _text_filter("donor", text)
+    if city:
+        conds.append("City = ?"); params.append(city)
+    if group:
+        conds.append("BloodGroup = ?"); params.append(group)
+    return conds, params
+
+
+def _page(table, cols, key, conds, params, after, limit):
+    conds = list(conds)
+    params = list(params)
+    if after is not None:
+        conds.append(f"{key} > ?"); params.append(after)
+    where = " WHERE " + " AND ".join(conds) if conds else ""
+    rows = fetch_all(f"SELECT {cols} FROM {table}{where} ORDER BY {key} LIMIT ?", tuple(params) + (limit + 1,))
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, (rows[-1][key] if more else None)
+
+
+def _count(table, conds, params, stat):
+    if not conds:
+        row = fetch_one("SELECT Value FROM DashboardStats WHERE Name = ?", (stat,))
+        if row:
+            return row[0], True
+    n = fetch_one(f"SELECT COUNT(*) FROM (SELECT 1 FROM {table} WHERE {' AND '.join(conds)} LIMIT ?)",
+                  tuple(params) + (COUNT_CAP + 1,))[0]
+    return min(n, COUNT_CAP), n <= COUNT_CAP
+
+
+def browse_donors(text=None, city=None, group=None, after=None, limit=PAGE_SIZE):
+    """One page of donors in DonorID order. Returns (rows, next_cursor).
+
+    text is a full-text search over name, city, email and phone.
+    """
+    conds, params = _donor_filter(text, city, group)
+    return _page("Donor", DONOR_COLS, "DonorID", conds, params, after, limit)
+
+
+def count_donors(text=None, city=None, group=None):
+    """(count, exact): exact is False when the count was capped at COUNT_CAP."""
+    conds, params = _donor_filter(text, city, group)
+    return _count("Donor", conds, params, "donors")
+
+
+def browse_banks(text=None, city=None, after=None, limit=PAGE_SIZE):
+    conds, params = _text_filter("bank", text)
+    if city:
+        conds.append("City = ?"); params.append(city)
+    return _page("BloodBank", BANK_COLS, "BankID", conds, params, after, limit)
+
+
+def count_banks(text=None, city=None):
+    conds, params = _text_filter("bank", text)
+    if city:
+        conds.append("City = ?"); params.append(city)
+    return _count("BloodBank", conds, params, "banks")
+
+
+LOCATED = "Latitude IS NOT NULL AND Longitude IS NOT NULL AND NOT (Latitude = 0 AND Longitude = 0)"
+
+
+def _scale(zoom):
+    # degrees -> grid index at a zoom level; +90/+180 keep values positive so CAST truncation is floor()
+    return 2 ** zoom / 360
+
+
+def zoom_for(span_deg):
+    """Grid level whose cells split span_deg into about MAP_TARGET_CELLS.
+    Levels are powers of two (cell = 360 / 2**zoom degrees) so nearby filters share cached bins."""
+    cell = max(span_deg, 1e-6) / MAP_TARGET_CELLS
+    return max(0, min(MAP_MAX_ZOOM, int(math.floor(math.log2(360 / cell)))))
+
+
+def _map(table, conds, params, group_col, zoom, cells=None):
+    # cells: (conditions, params) on DonorMapCell equivalent to conds, when there is one
+    import pandas as pd
+    where = " AND ".join(list(conds) + [LOCATED])
+    use_cells = cells is not None and (zoom is None or zoom <= MAP_CELL_ZOOM)
+    if use_cells:
+        cwhere = " AND ".join(cells[0]) or "1"
+        ext = cached_fetch_all(f"""SELECT coalesce(SUM(N), 0) AS n, MIN(Y) AS y_lo, MAX(Y) + 1 AS y_hi,
+                                          MIN(X) AS x_lo, MAX(X) + 1 AS x_hi FROM DonorMapCell WHERE {cwhere}""", cells[1])[0]
+        n = ext["n"]
+        span = max(ext["y_hi"] - ext["y_lo"], ext["x_hi"] - ext["x_lo"]) / _scale(MAP_CELL_ZOOM) if n else 0
+    else:
+        ext = cached_fetch_all(f"""SELECT COUNT(*) AS n, MAX(Latitude) - MIN(Latitude) AS dlat, MAX(Longitude) - MIN(Longitude) AS dlon
+                                   FROM {table} WHERE {where}""", params)[0]
+        n = ext["n"]
+        span = max(ext["dlat"], ext["dlon"]) if n else 0
+    grp = f", {group_col} AS BloodGroup" if group_col else ""
+    if n == 0 or (zoom is None and n <= MAP_POINTS_MAX):
+        df = fetch_columns(f"SELECT Latitude AS lat, Longitude AS lon{grp} FROM {table} WHERE {where}", params, kind="pandas")
+        df["count"] = 1
+        return {"mode": "points", "n": n, "zoom": None, "cell_km": None, "data": df}
+    zoom = zoom_for(span) if zoom is None else zoom
+    if use_cells and zoom <= MAP_CELL_ZOOM:
+        k = MAP_CELL_ZOOM - zoom
+        rows = cached_fetch_all(f"""SELECT Y >> {k} AS y, X >> {k} AS x, BloodGroup, SUM(N) AS n, SUM(SumLat) AS slat, SUM(SumLon) AS slon
+                                    FROM DonorMapCell WHERE {cwhere} GROUP BY 1, 2, 3""", cells[1])
+    else:
+        s = _scale(zoom)
+        rows = cached_fetch_all(f"""SELECT CAST((Latitude + 90) * ? AS INTEGER) AS y, CAST((Longitude + 180) * ? AS INTEGER) AS x{grp},
+                                           COUNT(*) AS n, SUM(Latitude) AS slat, SUM(Longitude) AS slon
+                                    FROM {table} WHERE {where} GROUP BY 1, 2{", 3" if group_col else ""}""", (s, s) + tuple(params))
+    raw = pd.DataFrame(rows)
+    cells_df = raw.groupby(["y", "x"], sort=False)[["n", "slat", "slon"]].sum()
+    # drawn at the centroid of the cell's points rather than the cell's corner
+    df = pd.DataFrame({"lat": cells_df["slat"] / cells_df["n"], "lon": cells_df["slon"] / cells_df["n"], "count": cells_df["n"]})
+    if group_col:
+        df = df.join(raw.pivot_table(index=["y", "x"], columns="BloodGroup", values="n", aggfunc="sum", fill_value=0))
+    return {"mode": "bins", "n": n, "zoom": zoom, "cell_km": round(360 / 2 ** zoom * 111.2, 1), "data": df.reset_index(drop=True)}
+
+
+def donor_map(text=None, city=None, group=None, zoom=None):
+    """Map data for the filtered donors: {"mode", "n", "zoom", "cell_km", "data"}.
+
+    data is a DataFrame with lat, lon and count, one row per donor ("points",
+    when there are at most MAP_POINTS_MAX and no zoom is forced) or per grid
+    cell ("bins", plus one count column per blood group). zoom=None picks the
+    grid from the filtered extent.
+    """
+    conds, params = _donor_filter(text, city, group)
+    # text and city filters can't be answered from DonorMapCell; a group filter can
+    cells = None if text or city else (["BloodGroup = ?"] if group else [], [group] if group else [])
+    return _map("Donor", conds, params, "BloodGroup", zoom, cells)
+
+
+def bank_map(text=None, city=None, zoom=None):
+    conds, params = _text_filter("bank", text)
+    if city:
+        conds.append("City = ?"); params.append(city)
+    return _map("BloodBank", conds, params, None, zoom)
+
+
+def _pick(kind, table, key, text, limit):
+    text = (text or "").strip()
+    rows = []
+    if text.isdigit():
+        rows = fetch_all(f"SELECT {key}, Name, City AS Detail FROM {table} WHERE {key} = ?", (int(text),))
+    seen = {r[key] for r in rows}
+    for m in search(text, kind, limit):
+        if m["ID"] not in seen:
+            rows.append({key: m["ID"], "Name": m["Label"], "Detail": m["Detail"]})
+    return rows[:limit]
+
+
+def search_donors(text, limit=SEARCH_LIMIT):
+    """Picker suggestions: the donor with that ID, then full-text matches."""
+    return _pick("donor", "Donor", "DonorID", text, limit)
+
+
+def search_banks(text, limit=SEARCH_LIMIT):
+    return _pick("bank", "BloodBank", "BankID", text, limit)
+
+
+def get_donor(donor_id):
+    rows = fetch_all(f"SELECT {DONOR_COLS} FROM Donor WHERE DonorID = ?", (donor_id,))
+    return rows[0] if rows else None
+
+
+def get_bank(bank_id):
+    rows = fetch_all(f"SELECT {BANK_COLS} FROM BloodBank WHERE BankID = ?", (bank_id,))
+    return rows[0] if rows else None
+
+
+def donor_cities():
+    return [r["City"] for r in cached_fetch_all("SELECT DISTINCT City FROM Donor WHERE City IS NOT NULL ORDER BY City")]
@@ -0,0 +1,603 @@
+# db.py
+# Shared SQLite layer for the app and the helper scripts.
+# Connections are pooled and kept open across Streamlit reruns (this module
+# stays in sys.modules, only app.py is re-executed), so sqlite3's per-connection
+# prepared statement cache actually gets reused.
+# cached_fetch_all() keeps results of slowly-changing queries across reruns;
+# Large reads can skip the dict per row: fetch_iter() streams tuples,
+# fetch_rows() returns sqlite3.Row/tuples and fetch_columns() NumPy arrays (or
+# a pandas/Arrow frame) per column.
+# every write through run_write()/transaction() bumps a generation counter for
+# the tables it touches (including ones changed by triggers and FK cascades),
+# which retires the cached results that read them.
+# Every statement on a pooled connection is timed (see "Query instrumentation"):
+# per-statement totals, per-view render profiles (profile_view) and a log of
+# slow statements with their EXPLAIN QUERY PLAN, for the Admin page.
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+
+# ---------- CONFIG ----------
+DB = "blood_donation.db"
+POOL_SIZE = 8                      # idle connections kept per database file
+BUSY_TIMEOUT = 10                  # seconds to wait on a locked database
+STATEMENT_CACHE_SIZE = 256         # prepared statements cached per connection
+CACHE_MAX_ENTRIES = 256            # cached_fetch_all results kept (LRU)
+CACHE_MAX_ROWS = 500000            # total rows held by the cache
+CACHE_TTL = 60                     # seconds; bounds staleness from writes made by other processes
+FETCH_SIZE = 5000                  # rows per fetchmany() round trip when streaming
+PROFILE_QUERIES = True             # time every statement (a few microseconds each)
+SLOW_QUERY_MS = 100                # statements slower than this go to the slow log with their plan
+SLOW_LOG_SIZE = 100                # slow log entries kept (newest)
+QUERY_STATS_MAX = 500              # distinct statements tracked; the rest are counted under "(other)"
+
+# PRAGMA profiles. "balanced" is the default: WAL + synchronous=NORMAL is
+# durable against app crashes and only loses the last commits on power loss.
+PROFILES = {
+    "safe":     {"synchronous": "FULL",   "cache_size": -8000,   "mmap_size": 0},
+    "balanced": {"synchronous": "NORMAL", "cache_size": -32000,  "mmap_size": 128 * 1024 * 1024},
+    "fast":     {"synchronous": "OFF",    "cache_size": -128000, "mmap_size": 512 * 1024 * 1024},
+}
+DB_PROFILE = "balanced"
+
+_pools = {}                        # db path -> list of idle connections
+_pool_lock = threading.Lock()
+_local = threading.local()         # connection currently checked out by this thread
+
+
+def configure(path=None, profile=None):
+    """Point the layer at another database file and/or PRAGMA profile."""
+    global DB, DB_PROFILE
+    if profile is not None:
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown DB profile: {profile}")
+        DB_PROFILE = profile
+    if path is not None:
+        DB = path
+    close_all()
+
+
+def _open(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE, factory=_Timed if PROFILE_QUERIES else sqlite3.Connection)
+    prof = PROFILES[DB_PROFILE]
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute(f"PRAGMA synchronous = {prof['synchronous']};")
+    conn.execute(f"PRAGMA cache_size = {int(prof['cache_size'])};")
+    conn.execute(f"PRAGMA mmap_size = {int(prof['mmap_size'])};")
+    conn.execute("PRAGMA temp_store = MEMORY;")
+    conn.execute("PRAGMA foreign_keys = ON;")
+    return conn
+
+
+def _checkout(path):
+    with _pool_lock:
+        idle = _pools.get(path)
+        if idle:
+            return idle.pop()
+    return _open(path)
+
+
+def _checkin(path, conn):
+    if conn.in_transaction:        # never hand a half-done transaction to someone else
+        conn.rollback()
+    with _pool_lock:
+        idle = _pools.setdefault(path, [])
+        if path == DB and len(idle) < POOL_SIZE:
+            idle.append(conn)
+            return
+    conn.close()
+
+
+def close_all():
+    """Close every idle pooled connection (used by reset/restore)."""
+    with _pool_lock:
+        conns = [c for idle in _pools.values() for c in idle]
+        _pools.clear()
+    for c in conns:
+        c.close()
+
+
+@contextmanager
+def get_conn():
+    """Borrow a pooled connection. Nested use on one thread shares the same one."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        yield conn
+        return
+    path = DB
+    conn = _checkout(path)
+    _local.conn = conn
+    try:
+        yield conn
+    finally:
+        _local.conn = None
+        _checkin(path, conn)
+
+
+class _Tracked:
+    # the connection handed out by transaction(): notes which tables each
+    # statement writes so the cache can be invalidated once it commits
+    def __init__(self, conn):
+        self._conn = conn
+
+    def execute(self, sql, params=()):
+        _note_write(sql)
+        return self._conn.execute(sql, params)
+
+    def executemany(self, sql, seq):
+        _note_write(sql)
+        return self._conn.executemany(sql, seq)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+@contextmanager
+def transaction():
+    """BEGIN IMMEDIATE ... COMMIT on a pooled connection; rolls back on error.
+
+    run_write/fetch_* called inside the block run in the same transaction.
+    A nested transaction() simply joins the outer one.
+    """
+    with get_conn() as conn:
+        if conn.in_transaction:
+            yield _Tracked(conn)
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        _local.pending = set()
+        try:
+            yield _Tracked(conn)
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            pending, _local.pending = _local.pending, None
+        conn.commit()
+        _bump(pending)
+
+
+# ---------- Query cache ----------
+_WRITE_RE = re.compile(r"""\b(?:INSERT|REPLACE)\s+(?:OR\s+\w+\s+)?INTO\s+["`\[]?(\w+)
+                           |\bUPDATE\s+(?!OF\b|ON\b)(?:OR\s+\w+\s+)?["`\[]?(\w+)
+                           |\bDELETE\s+FROM\s+["`\[]?(\w+)""", re.I | re.X)
+_READ_RE = re.compile(r"""\b(?:FROM|JOIN)\s+["`\[]?(\w+)""", re.I)
+_PLAIN_RE = re.compile(r"^\s*(SELECT|BEGIN|COMMIT|END|ROLLBACK|SAVEPOINT|RELEASE|ANALYZE|EXPLAIN)\b", re.I)
+ALL = "*"                          # generation bumped by DDL / unknown statements: retires everything
+
+_gens = {}                         # table name (lower case) -> generation
+_cache = OrderedDict()             # (sql, params) -> (tables, gens, expires, cols, rows)
+_cache_rows = [0]
+_cache_stats = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0}
+_cache_lock = threading.Lock()
+_dependents = {"loaded_for": None, "map": {}}
+
+
+def _written_tables(sql):
+    if _PLAIN_RE.match(sql):
+        return set()
+    found = {next(g for g in m.groups() if g).lower() for m in _WRITE_RE.finditer(sql)}
+    stripped = sql.lstrip()[:6].upper()
+    if not found or stripped.startswith(("CREATE", "DROP", "ALTER", "PRAGMA", "WITH")):
+        found.add(ALL)             # schema change or something we can't read: play safe
+    return found
+
+
+def _load_dependents():
+    # table -> tables also changed when it is written: trigger bodies and FK cascades
+    deps = {}
+    with get_conn() as conn:
+        for tbl, body in conn.execute("SELECT tbl_name, sql FROM sqlite_master WHERE type = 'trigger'"):
+            deps.setdefault(tbl.lower(), set()).update(_written_tables(body) - {ALL})
+        tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        for t in tables:
+            for fk in conn.execute(f'PRAGMA foreign_key_list("{t}")'):
+                if fk[6].upper() in ("CASCADE", "SET NULL", "SET DEFAULT"):
+                    deps.setdefault(fk[2].lower(), set()).add(t.lower())
+    # transitive closure (Donor -> Request -> Broadcast -> BroadcastRecipient ...)
+    for t in list(deps):
+        todo, seen = list(deps[t]), set()
+        while todo:
+            d = todo.pop()
+            if d not in seen:
+                seen.add(d)
+                todo.extend(deps.get(d, ()))
+        deps[t] = seen
+    return deps
+
+
+def _bump(tables):
+    if not tables:
+        return
+    if ALL in tables:
+        _dependents["loaded_for"] = None   # the schema (triggers, FKs) may have changed
+    if _dependents["loaded_for"] != DB:
+        _dependents.update(map=_load_dependents(), loaded_for=DB)
+    deps = _dependents["map"]
+    touched = set(tables) | {d for t in tables for d in deps.get(t, ())}
+    with _cache_lock:
+        for t in touched:
+            _gens[t] = _gens.get(t, 0) + 1
+
+
+def _note_write(sql):
+    tables = _written_tables(sql)
+    if not tables:
+        return
+    pending = getattr(_local, "pending", None)
+    if pending is not None:
+        pending.update(tables)     # bumped when the transaction commits
+    else:
+        _bump(tables)
+
+
+def invalidate_cache():
+    """Drop every cached result (after a restore, manual edits, ...)."""
+    _bump({ALL})
+
+
+def cached_fetch_all(sql, params=(), tables=None, ttl=CACHE_TTL):
+    """fetch_all() remembered until a write touches one of `tables`
+    (default: the tables named after FROM/JOIN in `sql`) or ttl runs out."""
+    key = (DB, sql, tuple(params))
+    now = time.monotonic()
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit is not None:
+            deps, gens, expires, cols, rows = hit
+            if expires > now and gens == tuple(_gens.get(t, 0) for t in deps):
+                _cache.move_to_end(key)
+                _cache_stats["hits"] += 1
+                return [dict(zip(cols, r)) for r in rows]
+            _cache_stats["stale"] += 1
+        _cache_stats["misses"] += 1
+        deps = tuple(sorted({t.lower() for t in (tables or _READ_RE.findall(sql))} | {ALL}))
+        gens = tuple(_gens.get(t, 0) for t in deps)
+    with get_conn() as conn:
+        cur = conn.execute(sql, params)
+        rows = cur.fetchall()
+        cols = [d[0] for d in cur.description] if cur.description else []
+    with _cache_lock:
+        # gens were read before the query, so a write racing with it leaves this entry stale, not wrong
+        old = _cache.pop(key, None)
+        if old:
+            _cache_rows[0] -= len(old[4])
+        _cache[key] = (deps, gens, now + ttl, cols, rows)
+        _cache_rows[0] += len(rows)
+        while len(_cache) > CACHE_MAX_ENTRIES or (_cache_rows[0] > CACHE_MAX_ROWS and len(_cache) > 1):
+            _, old = _cache.popitem(last=False)
+            _cache_rows[0] -= len(old[4])
+            _cache_stats["evictions"] += 1
+    return [dict(zip(cols, r)) for r in rows] if cols else []
+
+
+def cache_stats():
+    with _cache_lock:
+        looked = _cache_stats["hits"] + _cache_stats["misses"]
+        return dict(_cache_stats, entries=len(_cache), rows=_cache_rows[0],
+                    hit_rate=round(_cache_stats["hits"] / looked, 3) if looked else None)
+
+
+# ---------- Query instrumentation ----------
+_qstats = {}                       # normalized sql -> {"calls", "ms", "max_ms", "rows", "slow"}
+_slow_log = deque(maxlen=SLOW_LOG_SIZE)
+_renders = {}                      # view -> profile of its latest render
+_view_totals = {}                  # view -> {"renders", "ms", "db_ms", "calls"}
+_qstats_lock = threading.Lock()
+_IN_LIST_RE = re.compile(r"\?(?:\s*,\s*\?)+")
+_EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+@lru_cache(maxsize=2048)
+def _normalize(sql):
+    # one key per statement shape: whitespace collapsed, IN (?,?,...) lists folded
+    return _IN_LIST_RE.sub("?, ...", " ".join(sql.split()))
+
+
+class _Cursor(sqlite3.Cursor):
+    # times execute() and the fetches that follow it, all charged to one statement
+    _entry = None
+
+    def execute(self, sql, params=()):
+        self._sql, self._params, self._ms, self._rows, self._entry = sql, params, 0.0, 0, None
+        t = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            _observe(self, (time.perf_counter() - t) * 1000, max(self.rowcount, 0), 1)
+
+    def executemany(self, sql, seq):
+        self._sql, self._params, self._ms, self._rows, self._entry = sql, None, 0.0, 0, None
+        t = time.perf_counter()
+        try:
+            return super().executemany(sql, seq)
+        finally:
+            _observe(self, (time.perf_counter() - t) * 1000, max(self.rowcount, 0), 1)
+
+    def fetchone(self):
+        t = time.perf_counter()
+        row = super().fetchone()
+        _observe(self, (time.perf_counter() - t) * 1000, row is not None, 0)
+        return row
+
+    def fetchmany(self, size=None):
+        t = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        _observe(self, (time.perf_counter() - t) * 1000, len(rows), 0)
+        return rows
+
+    def fetchall(self):
+        t = time.perf_counter()
+        rows = super().fetchall()
+        _observe(self, (time.perf_counter() - t) * 1000, len(rows), 0)
+        return rows
+
+
+class _Timed(sqlite3.Connection):
+    # Connection.execute() doesn't go through cursor() in C, so route both here
+    def cursor(self, factory=_Cursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq):
+        return self.cursor().executemany(sql, seq)
+
+
+def _plan(cur):
+    if cur._params is None or not cur._sql.lstrip()[:7].upper().startswith(_EXPLAINABLE):
+        return None
+    try:
+        plain = cur.connection.cursor(sqlite3.Cursor)
+        return [r[3] for r in plain.execute("EXPLAIN QUERY PLAN " + cur._sql, cur._params)]
+    except sqlite3.Error:
+        return None
+
+
+def _observe(cur, ms, rows, calls):
+    sql = getattr(cur, "_sql", None)
+    if sql is None:                # fetch on a cursor that never executed
+        return
+    key = _normalize(sql)
+    cur._ms += ms
+    cur._rows += rows
+    view = getattr(_local, "view", None)
+    with _qstats_lock:
+        st = _qstats.get(key)
+        if st is None:
+            if len(_qstats) >= QUERY_STATS_MAX:
+                key = "(other)"
+            st = _qstats.setdefault(key, {"calls": 0, "ms": 0.0, "max_ms": 0.0, "rows": 0, "slow": 0})
+        st["calls"] += calls
+        st["ms"] += ms
+        st["rows"] += rows
+        st["max_ms"] = max(st["max_ms"], cur._ms)
+        if view is not None:
+            v = view["statements"].setdefault(key, [0, 0.0, 0])
+            v[0] += calls
+            v[1] += ms
+            v[2] += rows
+            view["calls"] += calls
+            view["db_ms"] += ms
+            view["rows"] += rows
+        entry = cur._entry
+        if entry is not None:      # already logged: later fetches add to it
+            entry["ms"] = round(cur._ms, 2)
+            entry["rows"] = cur._rows
+            return
+        if cur._ms < SLOW_QUERY_MS:
+            return
+        st["slow"] += 1
+    entry = {"at": datetime.now().isoformat(timespec="seconds"), "view": view and view["view"], "sql": key,
+             "params": repr(cur._params)[:200] if cur._params is not None else None,
+             "ms": round(cur._ms, 2), "rows": cur._rows, "plan": _plan(cur)}
+    cur._entry = entry
+    with _qstats_lock:
+        _slow_log.append(entry)
+
+
+@contextmanager
+def profile_view(name):
+    """Charge the statements run inside the block (on this thread) to a view render."""
+    prof = {"view": name, "at": datetime.now().isoformat(timespec="seconds"),
+            "ms": 0.0, "db_ms": 0.0, "calls": 0, "rows": 0, "statements": {}}
+    outer, _local.view = getattr(_local, "view", None), prof
+    t = time.perf_counter()
+    try:
+        yield prof
+    finally:
+        _local.view = outer
+        prof["ms"] = (time.perf_counter() - t) * 1000
+        with _qstats_lock:
+            _renders[name] = prof
+            tot = _view_totals.setdefault(name, {"renders": 0, "ms": 0.0, "db_ms": 0.0, "calls": 0})
+            tot["renders"] += 1
+            tot["ms"] += prof["ms"]
+            tot["db_ms"] += prof["db_ms"]
+            tot["calls"] += prof["calls"]
+
+
+def last_render(name):
+    """The latest render of a view: wall/DB time, counts and its statements (slowest first)."""
+    with _qstats_lock:
+        prof = _renders.get(name)
+        if prof is None:
+            return None
+        stmts = sorted(prof["statements"].items(), key=lambda kv: -kv[1][1])
+        out = {k: (round(v, 2) if isinstance(v, float) else v) for k, v in prof.items() if k != "statements"}
+    out["statements"] = [{"sql": sql, "calls": c, "ms": round(ms, 2), "rows": rows} for sql, (c, ms, rows) in stmts]
+    return out
+
+
+def query_stats(limit=20, order="ms"):
+    """Hottest statements: [{"sql", "calls", "ms", "avg_ms", "max_ms", "rows", "slow"}], by total time (or `order`)."""
+    with _qstats_lock:
+        rows = [dict(st, sql=sql) for sql, st in _qstats.items()]
+    for r in rows:
+        r["avg_ms"] = r["ms"] / r["calls"] if r["calls"] else 0.0
+        for k in ("ms", "avg_ms", "max_ms"):
+            r[k] = round(r[k], 2)
+    rows.sort(key=lambda r: -r[order])
+    return [{k: r[k] for k in ("sql", "calls", "ms", "avg_ms", "max_ms", "rows", "slow")} for r in rows[:limit]]
+
+
+def view_stats():
+    """Per view: renders, average wall and DB time, average statements per render."""
+    with _qstats_lock:
+        items = [(v, dict(t)) for v, t in _view_totals.items()]
+    return sorted(({"view": v, "renders": t["renders"], "avg_ms": round(t["ms"] / t["renders"], 1),
+                    "avg_db_ms": round(t["db_ms"] / t["renders"], 1), "avg_calls": round(t["calls"] / t["renders"], 1)}
+                   for v, t in items), key=lambda r: -r["avg_db_ms"])
+
+
+def slow_queries():
+    """The slow log, newest first."""
+    with _qstats_lock:
+        return [dict(e) for e in reversed(_slow_log)]
+
+
+def query_report(limit=100):
+    """Everything above as one JSON-ready dict (the Admin page's download)."""
+    return {"at": datetime.now().isoformat(timespec="seconds"), "db": DB, "slow_query_ms": SLOW_QUERY_MS,
+            "queries": query_stats(limit), "views": view_stats(),
+            "renders": [last_render(v) for v in sorted(_renders)], "slow": slow_queries()}
+
+
+def reset_query_stats():
+    with _qstats_lock:
+        _qstats.clear()
+        _slow_log.clear()
+        _renders.clear()
+        _view_totals.clear()
+
+
+# ---------- Query helpers ----------
+def run_write(sql, params=()):
+    with get_conn() as conn:
+        cur = conn.execute(sql, params)
+    _note_write(sql)
+    return cur
+
+
+def fetch_all(sql, params=()):
+    with get_conn() as conn:
+        cur = conn.execute(sql, params)
+        rows = cur.fetchall()
+        cols = [d[0] for d in cur.description] if cur.description else []
+    return [dict(zip(cols, r)) for r in rows] if cols else []
+
+
+def fetch_one(sql, params=()):
+    with get_conn() as conn:
+        return conn.execute(sql, params).fetchone()
+
+
+def fetch_batches(sql, params=(), size=FETCH_SIZE):
+    """Yield lists of up to `size` tuples; only one batch is in memory.
+
+    The connection stays checked out (and its read snapshot open) until the
+    generator is exhausted or closed. Outside get_conn()/transaction() that is
+    a connection of its own, never published to the thread: a transaction()
+    started while the generator is suspended must not share it (or have it
+    checked back in under it). Inside such a block it reads on that connection.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        yield from _stream(conn, sql, params, size)
+        return
+    path = DB
+    conn = _checkout(path)
+    try:
+        yield from _stream(conn, sql, params, size)
+    finally:
+        _checkin(path, conn)
+
+
+def _stream(conn, sql, params, size):
+    cur = conn.execute(sql, params)
+    try:
+        while True:
+            rows = cur.fetchmany(size)
+            if not rows:
+                return
+            yield rows
+    finally:
+        cur.close()
+
+
+def fetch_iter(sql, params=(), size=FETCH_SIZE):
+    """Yield result rows as plain tuples, streamed with fetchmany()."""
+    for rows in fetch_batches(sql, params, size):
+        yield from rows
+
+
+def fetch_rows(sql, params=(), tuples=False):
+    """fetch_all() without a dict per row: sqlite3.Row (r["Name"] and r[0] both
+    work, dict(r) converts) or, with tuples=True, plain tuples."""
+    with get_conn() as conn:
+        cur = conn.cursor()
+        if not tuples:
+            cur.row_factory = sqlite3.Row
+        return cur.execute(sql, params).fetchall()
+
+
+def _np_column(values):
+    import numpy as np
+    kinds = set(map(type, values))
+    if kinds <= {int}:
+        return np.array(values, dtype=np.int64)
+    if kinds <= {int, float, type(None)}:
+        return np.array(values, dtype=np.float64)   # NULL -> NaN
+    return np.array(values, dtype=object)
+
+
+def fetch_columns(sql, params=(), kind="numpy", size=FETCH_SIZE):
+    """The result column by column.
+
+    kind="numpy": {name: array}; integer columns are int64, numeric columns
+    with NULLs or reals float64 (NULL -> NaN), anything else object arrays.
+    kind="pandas": a DataFrame of those arrays. kind="arrow": a pyarrow Table.
+    """
+    if kind not in ("numpy", "pandas", "arrow"):
+        raise ValueError(f"Unknown column kind {kind!r}")
+    with get_conn() as conn:
+        cur = conn.execute(sql, params)
+        names = [d[0] for d in cur.description] if cur.description else []
+        cols = [[] for _ in names]
+        try:
+            while True:
+                rows = cur.fetchmany(size)
+                if not rows:
+                    break
+                for col, values in zip(cols, zip(*rows)):
+                    col.extend(values)
+        finally:
+            cur.close()
+    if kind == "arrow":
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ValueError("Arrow columns need pyarrow (pip install pyarrow)")
+        def arrow(values):
+            try:
+                return pa.array(values)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):      # mixed types in one column: keep them as text
+                return pa.array([None if v is None else str(v) for v in values])
+        return pa.table({n: arrow(c) for n, c in zip(names, cols)})
+    try:
+        arrays = {n: _np_column(c) for n, c in zip(names, cols)}
+    except ImportError:
+        raise ValueError("Column fetch needs numpy (pip install numpy)")
+    if kind == "pandas":
+        try:
+            import pandas as pd
+        except ImportError:
+            raise ValueError("pandas columns need pandas (pip install pandas)")
+        return pd.DataFrame(arrays)
+    return arrays
@@ -0,0 +1,144 @@
+# donations.py
+# Donation logging: one transaction per donation (Donation row, donor's last
+# donation date and the stock movement in InventoryLedger, which updates
+# Inventory), plus a bulk "donation drive" import and deletes that reverse the
+# stock they added.
+import csv
+from datetime import datetime
+from db import transaction
+from ledger import record
+from lots import retire_expired
+
+INSERT_DONATION = "INSERT INTO Donation (DonorID,BankID,Date,Units,Hemoglobin) VALUES (?,?,?,?,?)"
+# keep the most recent date even if donations are logged out of order
+TOUCH_DONOR = """UPDATE Donor SET LastDonationDate = ?1
+                 WHERE DonorID = ?2 AND (LastDonationDate IS NULL OR LastDonationDate < ?1)"""
+# the ledger_ai trigger folds the movement into Inventory (see ledger.py)
+LEDGER_DONATION = """INSERT INTO InventoryLedger (BankID, BloodGroup, Delta, Kind, RefID, At)
+                     SELECT ?1, BloodGroup, ?2, 'donation', ?3, ?4 FROM Donor WHERE DonorID = ?5"""
+
+MIN_UNITS, MAX_UNITS = 1, 5
+MIN_HB, MAX_HB = 0.0, 20.0
+
+
+def log_donation(donor_id, bank_id, ddate, units, hemoglobin):
+    """Record one donation atomically. Returns the new DonationID."""
+    with transaction() as conn:
+        cur = conn.execute(INSERT_DONATION, (donor_id, bank_id, ddate, units, hemoglobin))
+        conn.execute(TOUCH_DONOR, (ddate, donor_id))
+        conn.execute(LEDGER_DONATION, (bank_id, units, cur.lastrowid, ddate, donor_id))
+        return cur.lastrowid
+
+
+def delete_donation(donation_id, note="donation deleted"):
+    """Delete a donation and book a correction taking its units back out of
+    stock. Returns False if there was no such donation; raises ValueError
+    (nothing changed) if the bank no longer holds those units.
+    """
+    with transaction() as conn:
+        d = conn.execute("SELECT DonorID, BankID, Units FROM Donation WHERE DonationID = ?", (donation_id,)).fetchone()
+        if d is None:
+            return False
+        # reverse exactly what was booked; donations from before the ledger went
+        # into the opening balance under the donor's group
+        booked = conn.execute("""SELECT BankID, BloodGroup, SUM(Delta) FROM InventoryLedger
+                                 WHERE RefID = ? AND Kind = 'donation' GROUP BY BankID, BloodGroup""",
+                              (donation_id,)).fetchall()
+        if not booked and d[1] is not None:
+            group = conn.execute("SELECT BloodGroup FROM Donor WHERE DonorID = ?", (d[0],)).fetchone()
+            booked = [(d[1], group[0], d[2])] if group else []
+        for bank_id, group, units in booked:
+            retire_expired(bank_id=bank_id, group=group)   # expired units can't be taken back either
+            # already issued or transferred on: taking them back would leave negative stock
+            have = conn.execute("SELECT UnitsAvailable FROM Inventory WHERE BankID = ? AND BloodGroup = ?",
+                                (bank_id, group)).fetchone()
+            have = (have[0] or 0) if have else 0
+            if have < units:
+                raise ValueError(f"Bank {bank_id} has only {have} units of {group} left, "
+                                 f"can't take back {units}; book a stock count instead")
+        conn.execute("DELETE FROM Donation WHERE DonationID = ?", (donation_id,))
+        for bank_id, group, units in booked:
+            record(conn, bank_id, group, -units, "correction", ref_id=donation_id, note=note)
+        return True
+
+
+def _check_row(row, default_date=None):
+    # returns (donor_id, bank_id, date, units, hemoglobin) or raises ValueError
+    def get(key):
+        v = row.get(key)
+        return v.strip() if isinstance(v, str) else v
+    try:
+        did = int(get("DonorID"))
+        bid = int(get("BankID"))
+    except (TypeError, ValueError):
+        raise ValueError("DonorID and BankID must be integers")
+    dstr = get("Date") or default_date
+    if not dstr:
+        raise ValueError("Date is required")
+    try:
+        dstr = datetime.strptime(str(dstr), "%Y-%m-%d").date().isoformat()
+    except ValueError:
+        raise ValueError(f"Bad date {dstr!r} (use YYYY-MM-DD)")
+    try:
+        units = int(get("Units") or 1)
+        hb = float(get("Hemoglobin")) if get("Hemoglobin") not in (None, "") else None
+    except ValueError:
+        raise ValueError("Units must be an integer and Hemoglobin a number")
+    if not MIN_UNITS <= units <= MAX_UNITS:
+        raise ValueError(f"Units must be {MIN_UNITS}-{MAX_UNITS}")
+    if hb is not None and not MIN_HB <= hb <= MAX_HB:
+        raise ValueError(f"Hemoglobin must be {MIN_HB}-{MAX_HB}")
+    return did, bid, dstr, units, hb
+
+
+def import_donation_drive(rows, default_date=None):
+    """Ingest many donations (dicts with DonorID, BankID, Date, Units, Hemoglobin)
+    in a single transaction.
+
+    Invalid rows and rows pointing at unknown donors/banks are skipped and
+    reported; the rest are written in one transaction.
+    Returns (inserted_count, [(row_number, error), ...]).
+    """
+    good, errors = [], []
+    for n, row in enumerate(rows, start=1):
+        try:
+            good.append((n, _check_row(row, default_date)))
+        except ValueError as e:
+            errors.append((n, str(e)))
+    if not good:
+        return 0, errors
+
+    with transaction() as conn:
+        donor_ids = {r[0] for _, r in good}
+        bank_ids = {r[1] for _, r in good}
+        known_donors = _existing_ids(conn, "Donor", "DonorID", donor_ids)
+        known_banks = _existing_ids(conn, "BloodBank", "BankID", bank_ids)
+        batch = []
+        for n, r in good:
+            if r[0] not in known_donors:
+                errors.append((n, f"Unknown DonorID {r[0]}"))
+            elif r[1] not in known_banks:
+                errors.append((n, f"Unknown BankID {r[1]}"))
+            else:
+                batch.append(r)
+        # one execute per row (still one transaction) to get each DonationID for the ledger
+        ids = [conn.execute(INSERT_DONATION, r).lastrowid for r in batch]
+        conn.executemany(TOUCH_DONOR, [(d, did) for did, _, d, _, _ in batch])
+        conn.executemany(LEDGER_DONATION, [(bid, u, i, d, did) for i, (did, bid, d, u, _) in zip(ids, batch)])
+    errors.sort()
+    return len(batch), errors
+
+
+def _existing_ids(conn, table, key, ids):
+    found = set()
+    ids = list(ids)
+    for i in range(0, len(ids), 500):  # stay under SQLite's bound-parameter limit
+        chunk = ids[i:i + 500]
+        marks = ",".join("?" * len(chunk))
+        found.update(r[0] for r in conn.execute(f"SELECT {key} FROM {table} WHERE {key} IN ({marks})", chunk))
+    return found
+
+
+def read_donation_csv(f):
+    # expects a header row: DonorID,BankID,Date,Units,Hemoglobin (Date/Units/Hemoglobin optional)
+    return list(csv.DictReader(f))
@@ -0,0 +1,144 @@
+# exports.py
+# Streaming table export. Rows are pulled with cursor.fetchmany() and written
+# straight to the output (CSV via the csv module, JSON Lines, or Parquet when
+# pyarrow is installed), optionally gzipped on the fly, so memory stays flat
+# however large the table is (e.g. the full Donation history for an audit).
+import csv
+import gzip
+import io
+import json
+from db import cached_fetch_all, fetch_batches
+
+FETCH_SIZE = 5000                  # rows per fetchmany() round trip
+FORMATS = ("csv", "jsonl", "parquet")
+FILTER_OPS = ("=", "!=", "<", "<=", ">", ">=", "LIKE", "IS NULL", "IS NOT NULL")
+GZIP_LEVEL = 6                     # level 9 is ~2x slower for a few % smaller files
+# never exported: OTP hashes and throttles, and queued mail (bodies carry one-time codes)
+PRIVATE_TABLES = ("Otp", "OtpThrottle", "Outbox")
+MIME = {"csv": "text/csv", "jsonl": "application/x-ndjson", "parquet": "application/octet-stream"}
+
+
+def export_tables():
+    rows = cached_fetch_all("SELECT name, sql FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name")
+    # skip virtual tables (R*Tree) and their shadow tables
+    virtual = [r["name"] for r in rows if r["sql"].upper().startswith("CREATE VIRTUAL")]
+    return [r["name"] for r in rows if r["name"] not in virtual and r["name"] not in PRIVATE_TABLES
+            and not any(r["name"].startswith(v + "_") for v in virtual)]
+
+
+def table_columns(table):
+    """[(name, declared type)] for a table; ValueError if it doesn't exist."""
+    if table not in export_tables():
+        raise ValueError(f"Unknown table {table!r}")
+    return [(r["name"], (r["type"] or "").upper()) for r in cached_fetch_all(f'PRAGMA table_info("{table}")', tables=["sqlite_master"])]
+
+
+def build_query(table, columns=None, filters=None):
+    """SELECT for an export. Table, columns and filter columns are checked
+    against the schema (they can't be bound as parameters); values are bound.
+
+    filters: [(column, op, value)] with op from FILTER_OPS, ANDed together.
+    """
+    known = [c for c, _ in table_columns(table)]
+    columns = list(columns) if columns else known
+    for c in columns + [f[0] for f in filters or []]:
+        if c not in known:
+            raise ValueError(f"{table} has no column {c!r}")
+    conds, params = [], []
+    for col, op, *value in filters or []:
+        op = op.upper()
+        if op not in FILTER_OPS:
+            raise ValueError(f"Unsupported filter operator {op!r}")
+        if op.startswith("IS"):
+            conds.append(f'"{col}" {op}')
+        else:
+            conds.append(f'"{col}" {op} ?')
+            params.append(value[0] if value else None)
+    sql = f'SELECT {", ".join(chr(34) + c + chr(34) for c in columns)} FROM "{table}"'
+    if conds:
+        sql += " WHERE " + " AND ".join(conds)
+    return sql, tuple(params), columns
+
+
+def _write_csv(out, columns, batches):
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    writer.writerow(columns)
+    n = 0
+    for rows in batches:
+        writer.writerows(rows)
+        n += len(rows)
+    text.flush()
+    text.detach()                  # leave `out` open for the caller
+    return n
+
+
+def _write_jsonl(out, columns, batches):
+    n = 0
+    for rows in batches:
+        out.write("".join(json.dumps(dict(zip(columns, r)), default=str) + "\n" for r in rows).encode("utf-8"))
+        n += len(rows)
+    return n
+
+
+def _write_parquet(out, columns, types, batches, compress):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet export needs pyarrow (pip install pyarrow)")
+    # SQLite column affinity -> Arrow type; anything else is written as text
+    def arrow_type(t):
+        if "INT" in t:
+            return pa.int64()
+        if any(k in t for k in ("REAL", "FLOA", "DOUB")):
+            return pa.float64()
+        return pa.string()
+    schema = pa.schema([(c, arrow_type(types[c])) for c in columns])
+    text_cols = {i for i, c in enumerate(columns) if schema.field(c).type == pa.string()}
+    n = 0
+    with pq.ParquetWriter(out, schema, compression="gzip" if compress else "snappy") as writer:
+        for rows in batches:
+            cols = list(zip(*rows))
+            arrays = [pa.array([None if v is None else str(v) for v in col] if i in text_cols else col, type=schema.field(i).type)
+                      for i, col in enumerate(cols)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            n += len(rows)
+    return n
+
+
+def export_table(table, out, fmt="csv", columns=None, filters=None, compress=False, batch=FETCH_SIZE):
+    """Stream `table` into the binary file object `out`. Returns the row count.
+
+    compress gzips CSV/JSONL output; Parquet uses its own gzip codec instead.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; expected one of {FORMATS}")
+    sql, params, columns = build_query(table, columns, filters)
+    batches = fetch_batches(sql, params, batch)
+    if fmt == "parquet":
+        return _write_parquet(out, columns, dict(table_columns(table)), batches, compress)
+    target = gzip.GzipFile(fileobj=out, mode="wb", compresslevel=GZIP_LEVEL) if compress else out
+    try:
+        return (_write_csv if fmt == "csv" else _write_jsonl)(target, columns, batches)
+    finally:
+        if compress:
+            target.close()
+
+
+def export_filename(table, fmt, compress):
+    return f"{table}.{fmt}" + (".gz" if compress and fmt != "parquet" else "")
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    if len(sys.argv) < 3:
+        sys.exit("usage: python exports.py TABLE OUTFILE   (.csv / .jsonl / .parquet, add .gz to compress)")
+    table, path = sys.argv[1], sys.argv[2]
+    compress = path.endswith(".gz")
+    fmt = path[:-3 if compress else None].rsplit(".", 1)[-1]
+    t = time.perf_counter()
+    with open(path, "wb") as f:
+        n = export_table(table, f, fmt, compress=compress)
+    print(f"{n} rows of {table} -> {path} in {time.perf_counter() - t:.2f}s")
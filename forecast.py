@@ -0,0 +1,146 @@
+# forecast.py
+# Which banks will run out of which blood group, and when.
+# DailyStock rolls the inventory ledger up to one row per day, bank and group
+# (units donated, issued to requests, and everything else). A trigger on
+# InventoryLedger keeps it current as movements are booked; the ledger is
+# append-only, so past days never need recomputing however long the history.
+# forecast() reads the last HISTORY_DAYS of rollups into (pair x day) arrays
+# and projects days of supply for every (bank, group) pair in one pass.
+#   python forecast.py              pairs projected to run out within HORIZON_DAYS
+#   python forecast.py rebuild      recompute DailyStock from the ledger
+import time
+from datetime import date, timedelta
+import numpy as np
+import db
+from db import fetch_columns, fetch_one, transaction
+from matching import BLOOD_GROUPS
+
+HISTORY_DAYS = 84                  # days of rollups a forecast looks at
+ALPHA = 0.1                        # exponential smoothing: weight of the newest day
+SHORT_DAYS = 7                     # window of the plain rolling averages shown alongside
+HORIZON_DAYS = 7                   # "runs out next week"
+MEMO_TTL = 300                     # seconds a forecast is reused while no movement is booked
+
+GROUP_INDEX = {g: i for i, g in enumerate(BLOOD_GROUPS)}
+_memo = {}                         # (db, last LedgerID, args) -> (expires, rows)
+
+# a correction that points at a donation is delete_donation() taking it back
+_DONATED = "NEW.Kind = 'donation' OR (NEW.Kind = 'correction' AND NEW.RefID IS NOT NULL)"
+
+
+def _rebuild(conn):
+    donated = _DONATED.replace("NEW.", "")
+    conn.execute("DELETE FROM DailyStock")
+    conn.execute(f"""INSERT INTO DailyStock (Day, BankID, BloodGroup, Donated, Issued, Other)
+                     SELECT substr(At, 1, 10), BankID, BloodGroup,
+                            SUM(CASE WHEN {donated} THEN Delta ELSE 0 END),
+                            SUM(CASE WHEN Kind = 'assignment' THEN -Delta ELSE 0 END),
+                            SUM(CASE WHEN {donated} OR Kind = 'assignment' THEN 0 ELSE Delta END)
+                     FROM InventoryLedger GROUP BY 1, 2, 3""")
+
+
+def rebuild_rollups():
+    """Recompute DailyStock from the ledger (repair after manual DB edits)."""
+    with transaction() as conn:
+        _rebuild(conn)
+
+
+def _weights(days, alpha):
+    # exponential smoothing as one dot product: newest day weighs alpha, the
+    # one before alpha*(1-alpha), ...; normalized over the window
+    w = alpha * (1 - alpha) ** np.arange(days - 1, -1, -1, dtype=float)
+    return w / w.sum()
+
+
+def forecast(days=HISTORY_DAYS, horizon=HORIZON_DAYS, alpha=ALPHA, today=None):
+    """Days of supply for every (bank, group) with an Inventory row, soonest first.
+
+    Returns dicts with BankID, Bank, BloodGroup, Units, IssuedPerDay and
+    DonatedPerDay (smoothed), Issued7d/Donated7d (plain SHORT_DAYS averages),
+    NetPerDay, DaysOfSupply (None when stock isn't falling), RunsOut (date)
+    and InHorizon (runs out within `horizon` days).
+    Stock only moves through the ledger, so a result is reused until the next
+    movement (or MEMO_TTL, for bank renames).
+    """
+    today = today or date.today()
+    key = (db.DB, fetch_one("SELECT MAX(LedgerID) FROM InventoryLedger")[0], days, horizon, alpha, today)
+    hit = _memo.get(key)
+    if hit and hit[0] > time.monotonic():
+        return hit[1]
+    rows = _forecast(days, horizon, alpha, today)
+    _memo.clear()
+    _memo[key] = (time.monotonic() + MEMO_TTL, rows)
+    return rows
+
+
+def _forecast(days, horizon, alpha, today):
+    start = today - timedelta(days=days - 1)
+    stock = fetch_columns("""SELECT i.BankID, b.Name AS Bank, i.BloodGroup, coalesce(i.UnitsAvailable, 0) AS Units
+                             FROM Inventory i JOIN BloodBank b ON b.BankID = i.BankID ORDER BY i.BankID, i.BloodGroup""")
+    hist = fetch_columns("""SELECT CAST(julianday(Day) - julianday(?) AS INTEGER) AS d, BankID, BloodGroup, Donated, Issued
+                            FROM DailyStock WHERE Day BETWEEN ? AND ?""",
+                         (start.isoformat(), start.isoformat(), today.isoformat()))
+    if len(stock["BankID"]) == 0:
+        return []
+
+    def pair_keys(banks, groups):
+        # (bank, group) -> one integer; groups mapped through their few distinct values
+        names, inv = np.unique(np.asarray(groups, dtype=object).astype(str), return_inverse=True)
+        gidx = np.array([GROUP_INDEX.get(g, len(BLOOD_GROUPS)) for g in names], dtype=np.int64)[inv]
+        return np.asarray(banks, dtype=np.int64) * (len(BLOOD_GROUPS) + 1) + gidx
+
+    keys = pair_keys(stock["BankID"], stock["BloodGroup"])
+    order = np.argsort(keys)
+    n_pairs = len(keys)
+    issued = np.zeros((n_pairs, days))
+    donated = np.zeros((n_pairs, days))
+    if len(hist["d"]):
+        hk = pair_keys(hist["BankID"], hist["BloodGroup"])
+        pos = np.minimum(np.searchsorted(keys[order], hk), n_pairs - 1)
+        ok = keys[order][pos] == hk                    # pairs without an Inventory row are ignored
+        rows, cols = order[pos[ok]], hist["d"][ok]
+        np.add.at(issued, (rows, cols), hist["Issued"][ok])
+        np.add.at(donated, (rows, cols), hist["Donated"][ok])
+
+    w = _weights(days, alpha)
+    issued_rate, donated_rate = issued @ w, donated @ w
+    net = issued_rate - donated_rate
+    units = np.maximum(stock["Units"].astype(float), 0)
+    falling = net > 1e-6
+    dos = np.full(n_pairs, np.inf)
+    dos[falling] = units[falling] / net[falling]
+    dos[(units == 0) & (issued_rate > 1e-6)] = 0.0      # already out of a group that is being asked for
+    short = min(SHORT_DAYS, days)
+    issued_7, donated_7 = issued[:, -short:].mean(axis=1), donated[:, -short:].mean(axis=1)
+
+    out = []
+    for i in np.argsort(dos, kind="stable"):
+        d = float(dos[i])
+        out.append({"BankID": int(stock["BankID"][i]), "Bank": stock["Bank"][i], "BloodGroup": stock["BloodGroup"][i],
+                    "Units": int(stock["Units"][i]), "IssuedPerDay": round(float(issued_rate[i]), 2),
+                    "DonatedPerDay": round(float(donated_rate[i]), 2), "Issued7d": round(float(issued_7[i]), 2),
+                    "Donated7d": round(float(donated_7[i]), 2), "NetPerDay": round(float(net[i]), 2),
+                    "DaysOfSupply": None if d == np.inf else round(d, 1),
+                    "RunsOut": None if d == np.inf else (today + timedelta(days=int(d))).isoformat(),
+                    "InHorizon": d <= horizon})
+    return out
+
+
+def shortages(horizon=HORIZON_DAYS, **kw):
+    """The forecast rows projected to run out within `horizon` days."""
+    return [r for r in forecast(horizon=horizon, **kw) if r["InHorizon"]]
+
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:] == ["rebuild"]:
+        rebuild_rollups()
+        print("DailyStock rebuilt")
+        sys.exit()
+    t = time.perf_counter()
+    rows = forecast()
+    soon = [r for r in rows if r["InHorizon"]]
+    print(f"{len(rows)} bank/group pairs forecast in {time.perf_counter() - t:.3f}s; {len(soon)} run out within {HORIZON_DAYS} days")
+    for r in soon[:50]:
+        print(f"  {r['Bank'][:30]:<30} {r['BloodGroup']:<4} {r['Units']:>5} units  "
+              f"-{r['NetPerDay']:.2f}/day  {r['DaysOfSupply']:>6} days  ({r['RunsOut']})")
@@ -0,0 +1,154 @@
+# geo.py
+# Nearest bank / donor search. Donor and BloodBank coordinates are mirrored
+# into R*Tree tables (DonorGeo, BankGeo) by triggers (see migrations.py), so a
+# lookup only touches rows inside a bounding box around the point. The box is
+# grown until k results are found; candidates are ranked by true great-circle
+# distance.
+import heapq
+import math
+import numpy as np
+from db import fetch_all
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG_LAT = 111.2
+START_RADIUS_KM = 5
+MAX_RADIUS_KM = 20016              # half the earth's circumference
+
+
+def has_coords(lat, lon):
+    # the forms default to 0.0/0.0 when nothing is entered
+    return lat is not None and lon is not None and not (lat == 0 and lon == 0)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _unit_vectors(lat, lon):
+    p = np.radians(np.asarray(lat, dtype=float))
+    l = np.radians(np.asarray(lon, dtype=float))
+    return np.stack([np.cos(p) * np.cos(l), np.cos(p) * np.sin(l), np.sin(p)], axis=1)
+
+
+def distance_matrix_km(lat1, lon1, lat2, lon2):
+    """Great-circle distances between two point sets as an (n, m) array.
+    NaN coordinates give NaN distances."""
+    # chord length between unit vectors -> arc length; one matmul instead of n*m trig calls
+    dot = _unit_vectors(lat1, lon1) @ _unit_vectors(lat2, lon2).T
+    half_chord = np.sqrt(np.clip(2.0 - 2.0 * dot, 0.0, 4.0)) / 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(half_chord, 1.0))
+
+
+def bounding_box(lat, lon, radius_km):
+    dlat = radius_km / KM_PER_DEG_LAT
+    lat_lo, lat_hi = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+    coslat = min(math.cos(math.radians(lat_lo)), math.cos(math.radians(lat_hi)))
+    if coslat <= 1e-6 or radius_km / (KM_PER_DEG_LAT * coslat) >= 180:
+        return lat_lo, lat_hi, -180.0, 180.0
+    dlon = radius_km / (KM_PER_DEG_LAT * coslat)
+    lon_lo, lon_hi = lon - dlon, lon + dlon
+    if lon_lo < -180 or lon_hi > 180:   # crosses the antimeridian: just take every longitude
+        return lat_lo, lat_hi, -180.0, 180.0
+    return lat_lo, lat_hi, lon_lo, lon_hi
+
+
+def _groups(group):
+    if group is None:
+        return []
+    return [group] if isinstance(group, str) else list(group)
+
+
+def _knn(sql_for_box, params, lat, lon, k, radius_km):
+    # sql_for_box must end with the R*Tree box condition taking 4 params
+    limit = min(radius_km or MAX_RADIUS_KM, MAX_RADIUS_KM)
+    r = min(START_RADIUS_KM, limit)
+    while True:
+        rows = fetch_all(sql_for_box, tuple(params) + bounding_box(lat, lon, r))
+        for row in rows:
+            row["DistanceKm"] = round(haversine_km(lat, lon, row["Latitude"], row["Longitude"]), 2)
+        # only results inside the circle are final; corners of the box may be farther than r
+        inside = [row for row in rows if row["DistanceKm"] <= r]
+        if len(inside) >= k or r >= limit:
+            return heapq.nsmallest(k, inside, key=lambda x: x["DistanceKm"])
+        r = min(r * 2, limit)
+
+
+def _unranked(sql, params, k):
+    rows = fetch_all(sql, tuple(params) + (k,))
+    for row in rows:
+        row["DistanceKm"] = None
+    return rows
+
+
+BOX = "g.maxLat >= ? AND g.minLat <= ? AND g.maxLon >= ? AND g.minLon <= ?"
+
+
+def nearest_banks(lat, lon, group=None, min_units=1, k=5, radius_km=None):
+    """Closest banks holding at least min_units of group (a group or list of groups).
+
+    Returns dicts with BankID, Name, City, Latitude, Longitude, DistanceKm and,
+    when a group is given, BloodGroup and UnitsAvailable. When distances can't
+    be ranked the banks with the most stock are returned (DistanceKm None).
+    """
+    groups = _groups(group)
+    if groups:
+        marks = ",".join("?" * len(groups))
+        cols = "b.BankID, b.Name, b.City, b.Latitude, b.Longitude, i.BloodGroup, i.UnitsAvailable"
+        join = f"JOIN Inventory i ON i.BankID = b.BankID AND i.BloodGroup IN ({marks}) AND i.UnitsAvailable >= ?"
+        params = groups + [min_units]
+    else:
+        cols = "b.BankID, b.Name, b.City, b.Latitude, b.Longitude"
+        join, params = "", []
+    if has_coords(lat, lon):
+        sql = f"SELECT {cols} FROM BankGeo g JOIN BloodBank b ON b.BankID = g.id {join} WHERE {BOX}"
+        rows = _knn(sql, params, lat, lon, k, radius_km)
+        if rows or radius_km is not None:
+            return rows
+    # no usable point (or no located bank matches): most stock first
+    order = "i.UnitsAvailable DESC" if groups else "b.BankID"
+    return _unranked(f"SELECT {cols} FROM BloodBank b {join} ORDER BY {order} LIMIT ?", params, k)
+
+
+def nearest_donors(lat, lon, group=None, k=5, radius_km=None):
+    """Closest donors of group (a group or list of groups), nearest first.
+
+    Returns dicts with DonorID, Name, BloodGroup, Phone, Email, City, Latitude,
+    Longitude, LastDonationDate and DistanceKm. Donors without coordinates are
+    only returned (DistanceKm None) when nothing located can be ranked.
+    """
+    groups = _groups(group)
+    cols = "d.DonorID, d.Name, d.BloodGroup, d.Phone, d.Email, d.City, d.Latitude, d.Longitude, d.LastDonationDate"
+    cond = f"d.BloodGroup IN ({','.join('?' * len(groups))})" if groups else "1"
+    if has_coords(lat, lon):
+        sql = f"SELECT {cols} FROM DonorGeo g JOIN Donor d ON d.DonorID = g.id WHERE {cond} AND {BOX}"
+        rows = _knn(sql, groups, lat, lon, k, radius_km)
+        if rows or radius_km is not None:
+            return rows
+    return _unranked(f"SELECT {cols} FROM Donor d WHERE {cond} ORDER BY d.DonorID LIMIT ?", groups, k)
+
+
+def donors_within(lat, lon, radius_km, group=None, where="", params=()):
+    """Every located donor of group within radius_km, nearest first.
+
+    `where`/`params` add extra conditions on the Donor alias d.
+    """
+    if not has_coords(lat, lon):
+        return []
+    groups = _groups(group)
+    cols = "d.DonorID, d.Name, d.BloodGroup, d.Phone, d.Email, d.City, d.Latitude, d.Longitude, d.LastDonationDate"
+    cond = f"d.BloodGroup IN ({','.join('?' * len(groups))})" if groups else "1"
+    if where:
+        cond += f" AND ({where})"
+    rows = fetch_all(f"SELECT {cols} FROM DonorGeo g JOIN Donor d ON d.DonorID = g.id WHERE {cond} AND {BOX}",
+                     tuple(groups) + tuple(params) + bounding_box(lat, lon, radius_km))
+    out = []
+    for row in rows:
+        row["DistanceKm"] = round(haversine_km(lat, lon, row["Latitude"], row["Longitude"]), 2)
+        if row["DistanceKm"] <= radius_km:
+            out.append(row)
+    out.sort(key=lambda x: x["DistanceKm"])
+    return out
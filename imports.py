@@ -0,0 +1,296 @@
+# imports.py
+# Bulk registry import for onboarding partner banks: donors, banks and
+# inventory counts from CSV or JSON Lines (optionally gzipped). Rows are
+# streamed, checked with the same rules as the forms (validation.py),
+# de-duplicated against the file and the database, and written CHUNK_ROWS at a
+# time, one transaction per chunk. Bad rows are reported with their row number
+# and never stop the import.
+#   python imports.py donor donors.csv
+#   python imports.py inventory stock.jsonl.gz
+import csv
+import gzip
+import io
+import json
+import re
+from db import get_conn, transaction
+from ledger import INSERT_MOVEMENT
+from lots import retire_expired
+from matching import BLOOD_GROUPS
+from validation import valid_phone, valid_email, normalize_phone, parse_date, GENDERS
+
+CHUNK_ROWS = 5000                  # rows per transaction
+IN_LIMIT = 500                     # values per IN (...) lookup (SQLite's bound-parameter limit)
+FORMATS = ("csv", "jsonl")
+KINDS = ("donor", "bank", "inventory")
+# columns read per kind; * = required
+COLUMNS = {
+    "donor": ["Name*", "BloodGroup*", "Phone*", "Email*", "City*", "Gender", "DOB", "Latitude", "Longitude", "LastDonationDate"],
+    "bank": ["Name*", "Address*", "Phone*", "City*", "Latitude", "Longitude"],
+    "inventory": ["BankID or BankName*", "BloodGroup*", "Units*", "City (with BankName)"],
+}
+
+
+def read_rows(f, fmt="csv", compressed=False):
+    """Yield dicts from a binary file object, one row at a time."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; expected one of {FORMATS}")
+    if compressed:
+        f = gzip.GzipFile(fileobj=f, mode="rb")
+    text = io.TextIOWrapper(f, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        yield from csv.DictReader(text)
+        return
+    for line in text:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            row = {"__error__": f"Bad JSON: {e.msg}"}
+        yield row if isinstance(row, dict) else {"__error__": "Expected a JSON object per line"}
+
+
+def format_of(filename):
+    """(fmt, compressed) from a file name like donors.csv.gz."""
+    name = filename.lower()
+    compressed = name.endswith(".gz")
+    fmt = name[:-3 if compressed else None].rsplit(".", 1)[-1]
+    return ("jsonl" if fmt in ("json", "ndjson") else fmt), compressed
+
+
+# ---------- row checks: return the values to write or raise ValueError ----------
+def _get(row, key):
+    v = row.get(key)
+    if isinstance(v, str):
+        v = v.strip()
+    return None if v in ("", None) else v
+
+
+def _required(row, *keys):
+    missing = [k for k in keys if _get(row, k) is None]
+    if missing:
+        raise ValueError(f"Missing {', '.join(missing)}")
+
+
+def _group(row, key="BloodGroup"):
+    # spreadsheet spellings: "o+ve", "B POS", "AB Negative"
+    g = re.sub(r"\s+", "", str(_get(row, key) or "")).upper()
+    g = re.sub(r"(\+VE|POS(ITIVE)?)$", "+", re.sub(r"(-VE|NEG(ATIVE)?)$", "-", g))
+    if g not in BLOOD_GROUPS:
+        raise ValueError(f"Unknown blood group {_get(row, key)!r}")
+    return g
+
+
+def _phone(row):
+    p = normalize_phone(_get(row, "Phone"))
+    if not valid_phone(p):
+        raise ValueError("Phone must be 10 digits")
+    return p
+
+
+def _coords(row):
+    try:
+        lat = float(_get(row, "Latitude")) if _get(row, "Latitude") is not None else None
+        lon = float(_get(row, "Longitude")) if _get(row, "Longitude") is not None else None
+    except (TypeError, ValueError):
+        raise ValueError("Latitude and Longitude must be numbers")
+    if (lat is not None and not -90 <= lat <= 90) or (lon is not None and not -180 <= lon <= 180):
+        raise ValueError("Latitude/Longitude out of range")
+    return lat, lon
+
+
+def _donor(row):
+    _required(row, "Name", "BloodGroup", "Phone", "Email", "City")
+    email = str(_get(row, "Email")).lower()
+    if not valid_email(email):
+        raise ValueError("Invalid email")
+    gender = _get(row, "Gender")
+    if gender is not None:
+        gender = {"MALE": "M", "FEMALE": "F", "OTHER": "Other"}.get(str(gender).upper(), str(gender).upper())
+        if gender not in GENDERS:
+            raise ValueError(f"Gender must be one of {', '.join(GENDERS)}")
+    dob = parse_date(_get(row, "DOB"), "DOB") if _get(row, "DOB") else None
+    last = parse_date(_get(row, "LastDonationDate"), "LastDonationDate") if _get(row, "LastDonationDate") else None
+    lat, lon = _coords(row)
+    return (str(_get(row, "Name")), gender, dob, _group(row), _phone(row), email, lat, lon, str(_get(row, "City")), last)
+
+
+def _bank(row):
+    _required(row, "Name", "Address", "Phone", "City")
+    lat, lon = _coords(row)
+    return (str(_get(row, "Name")), str(_get(row, "Address")), _phone(row), lat, lon, str(_get(row, "City")))
+
+
+def _inventory(row):
+    _required(row, "BloodGroup", "Units")
+    try:
+        units = int(float(_get(row, "Units")))
+    except (TypeError, ValueError):
+        raise ValueError("Units must be a whole number")
+    if units < 0:
+        raise ValueError("Units can't be negative")
+    if _get(row, "BankID") is not None:
+        try:
+            bank = int(_get(row, "BankID"))
+        except (TypeError, ValueError):
+            raise ValueError("BankID must be an integer")
+    elif _get(row, "BankName") is not None:
+        bank = (str(_get(row, "BankName")).lower(), str(_get(row, "City") or "").lower())
+    else:
+        raise ValueError("Missing BankID or BankName")
+    return bank, _group(row), units
+
+
+# ---------- writers: one chunk inside one transaction ----------
+def _lookup(conn, sql, values):
+    # sql has one {marks} placeholder for the IN list
+    found = set()
+    values = list(values)
+    for i in range(0, len(values), IN_LIMIT):
+        part = values[i:i + IN_LIMIT]
+        found.update(r[0] for r in conn.execute(sql.format(marks=",".join("?" * len(part))), part))
+    return found
+
+
+def _write_donors(conn, chunk, report):
+    # INDEXED BY: right after a big import the table statistics still describe a
+    # tiny table and the planner would scan it for every chunk
+    emails = _lookup(conn, "SELECT lower(Email) FROM Donor INDEXED BY ix_donor_email WHERE lower(Email) IN ({marks})",
+                     {r[5] for _, r in chunk})
+    phones = _lookup(conn, "SELECT Phone FROM Donor INDEXED BY ix_donor_phone WHERE Phone IN ({marks})", {r[4] for _, r in chunk})
+    batch = []
+    for n, r in chunk:
+        if r[5] in emails or r[4] in phones:
+            report(n, f"Duplicate: a donor with this {'email' if r[5] in emails else 'phone'} already exists")
+        else:
+            batch.append(r)
+    conn.executemany("""INSERT INTO Donor (Name, Gender, DOB, BloodGroup, Phone, Email, Latitude, Longitude, City, LastDonationDate)
+                        VALUES (?,?,?,?,?,?,?,?,?,?)""", batch)
+    return len(batch)
+
+
+def _write_banks(conn, chunk, report):
+    names = list({r[0].lower() for _, r in chunk})
+    existing = set()
+    for i in range(0, len(names), IN_LIMIT):
+        part = names[i:i + IN_LIMIT]
+        existing.update(conn.execute(f"""SELECT lower(Name), lower(City) FROM BloodBank INDEXED BY ix_bank_name_city
+                                         WHERE lower(Name) IN ({",".join("?" * len(part))})""", part).fetchall())
+    batch = []
+    for n, r in chunk:
+        if (r[0].lower(), r[5].lower()) in existing:
+            report(n, "Duplicate: a bank with this name already exists in this city")
+        else:
+            batch.append(r)
+    conn.executemany("INSERT INTO BloodBank (Name, Address, Phone, Latitude, Longitude, City) VALUES (?,?,?,?,?,?)", batch)
+    return len(batch)
+
+
+def _write_inventory(conn, chunk, report):
+    # counts become corrections in the ledger, like a stock count (ledger.correct),
+    # against balances with the expired lots already written off
+    retire_expired()
+    ids = _lookup(conn, "SELECT BankID FROM BloodBank WHERE BankID IN ({marks})", {b for _, (b, _, _) in chunk if isinstance(b, int)})
+    names = {}
+    named = list({b[0] for _, (b, _, _) in chunk if isinstance(b, tuple)})
+    for i in range(0, len(named), IN_LIMIT):
+        part = named[i:i + IN_LIMIT]
+        for bid, name, city in conn.execute(f"""SELECT BankID, lower(Name), lower(coalesce(City, '')) FROM BloodBank
+                                                INDEXED BY ix_bank_name_city WHERE lower(Name) IN ({",".join("?" * len(part))})""", part):
+            names.setdefault((name, city), bid)
+            names.setdefault((name, ""), bid)
+    at = conn.execute("SELECT datetime('now', 'localtime')").fetchone()[0]
+    moves = []
+    for n, (bank, group, units) in chunk:
+        bid = bank if isinstance(bank, int) else names.get(bank)
+        if bid is None or (isinstance(bank, int) and bank not in ids):
+            report(n, f"Unknown bank {bank if isinstance(bank, int) else bank[0]!r}")
+            continue
+        row = conn.execute("SELECT UnitsAvailable FROM Inventory WHERE BankID = ? AND BloodGroup = ?", (bid, group)).fetchone()
+        delta = units - ((row[0] or 0) if row else 0)
+        if delta:
+            moves.append((bid, group, delta, "correction", None, at, "registry import"))
+    conn.executemany(INSERT_MOVEMENT, moves)
+    return len(moves)
+
+
+CHECKS = {"donor": _donor, "bank": _bank, "inventory": _inventory}
+WRITERS = {"donor": _write_donors, "bank": _write_banks, "inventory": _write_inventory}
+
+
+def _file_key(kind, r):
+    # what makes two rows of one file the same record
+    if kind == "donor":
+        return [("email", r[5]), ("phone", r[4])]
+    if kind == "bank":
+        return [("bank", r[0].lower(), r[5].lower())]
+    return [("stock", r[0], r[1])]
+
+
+def import_rows(kind, rows, chunk_rows=CHUNK_ROWS, progress=None):
+    """Validate and write an iterable of dicts. Returns (written, errors) where
+    errors is [(row_number, message), ...] including skipped duplicates.
+
+    progress(rows_read, written) is called after every chunk.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown import kind {kind!r}; expected one of {KINDS}")
+    check, write = CHECKS[kind], WRITERS[kind]
+    errors, seen, chunk = [], set(), []
+    written = read = 0
+
+    def report(n, msg):
+        errors.append((n, msg))
+
+    def flush():
+        nonlocal written
+        if chunk:
+            with transaction() as conn:
+                written += write(conn, chunk, report)
+            chunk.clear()
+        if progress:
+            progress(read, written)
+
+    for n, row in enumerate(rows, start=1):
+        read = n
+        try:
+            if "__error__" in row:
+                raise ValueError(row["__error__"])
+            r = check(row)
+        except ValueError as e:
+            report(n, str(e))
+            continue
+        keys = _file_key(kind, r)
+        if any(k in seen for k in keys):
+            report(n, "Duplicate of an earlier row in this file")
+            continue
+        seen.update(keys)
+        chunk.append((n, r))
+        if len(chunk) >= chunk_rows:
+            flush()
+    flush()
+    if written:
+        with get_conn() as conn:
+            conn.execute("PRAGMA optimize")    # refresh planner statistics the import made stale
+    errors.sort()
+    return written, errors
+
+
+def import_file(kind, f, filename, progress=None):
+    """Import a binary file object; the format comes from the file name."""
+    fmt, compressed = format_of(filename)
+    return import_rows(kind, read_rows(f, fmt, compressed), progress=progress)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    if len(sys.argv) < 3 or sys.argv[1] not in KINDS:
+        sys.exit(f"usage: python imports.py {{{'|'.join(KINDS)}}} FILE   (.csv / .jsonl, add .gz if compressed)")
+    t = time.perf_counter()
+    with open(sys.argv[2], "rb") as f:
+        n, errs = import_file(sys.argv[1], f, sys.argv[2], progress=lambda r, w: print(f"\r{r} read, {w} written", end="", flush=True))
+    print(f"\n{n} written, {len(errs)} rows skipped in {time.perf_counter() - t:.2f}s")
+    for row, msg in errs[:50]:
+        print(f"  row {row}: {msg}")
@@ -0,0 +1,255 @@
+# ledger.py
+# Append-only inventory ledger. Every change to stock is a signed movement in
+# InventoryLedger (donation, assignment, correction, transfer, expiry; "opening"
+# rows carry the balances that existed before the ledger), and an AFTER INSERT
+# trigger folds it into Inventory, which is now just the materialized current
+# balance. UPDATE/DELETE on the ledger are refused.
+# Point-in-time stock is the nearest InventorySnapshot at or before the date
+# plus the movements since, so a report never replays the whole ledger.
+# Movements are dated by when they happened (a donation's date), not when they
+# were typed in; a snapshot remembers the last LedgerID it saw, so back-dated
+# rows logged after it are still counted.
+#   python ledger.py                   stock now
+#   python ledger.py 2025-06-30        stock at the end of that day
+#   python ledger.py snapshot | reconcile
+import threading
+import time
+from datetime import date, datetime
+from db import get_conn, transaction, fetch_all, fetch_one
+
+KINDS = ("opening", "donation", "assignment", "correction", "transfer", "expiry")
+SNAPSHOT_INTERVAL_HOURS = 24       # background snapshots (start_snapshotter)
+SNAPSHOT_MIN_ROWS = 1              # skip a scheduled snapshot when fewer movements came in
+SNAPSHOT_KEEP_DAYS = 90            # older snapshots are thinned to one per month
+
+INSERT_MOVEMENT = """INSERT INTO InventoryLedger (BankID, BloodGroup, Delta, Kind, RefID, At, Note)
+                     VALUES (?, ?, ?, ?, ?, ?, ?)"""
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _ts(when):
+    # date (or 'YYYY-MM-DD') -> end of that day; datetime -> to the second; None -> now
+    if when is None:
+        return _now()
+    if isinstance(when, datetime):
+        return when.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(when, date):
+        return f"{when.isoformat()} 23:59:59"
+    when = str(when).strip()
+    return f"{when} 23:59:59" if len(when) == 10 else when
+
+
+def record(conn, bank_id, group, delta, kind, ref_id=None, at=None, note=None):
+    """Append one movement inside the caller's transaction. Returns its LedgerID."""
+    if kind not in KINDS:
+        raise ValueError(f"Unknown movement kind {kind!r}")
+    if not delta:
+        raise ValueError("A movement needs a non-zero number of units")
+    cur = conn.execute(INSERT_MOVEMENT, (bank_id, group, int(delta), kind, ref_id, at or _now(), note))
+    return cur.lastrowid
+
+
+def _units(conn, bank_id, group):
+    row = conn.execute("SELECT UnitsAvailable FROM Inventory WHERE BankID = ? AND BloodGroup = ?", (bank_id, group)).fetchone()
+    return (row[0] or 0) if row else 0
+
+
+def transfer(from_bank, to_bank, group, units, note=None):
+    """Move units between banks as two linked movements. Returns the debit's LedgerID.
+
+    Expired lots at the sending bank are written off first, so they are never shipped.
+    """
+    from lots import retire_expired              # lots.py builds on this module
+    if units <= 0:
+        raise ValueError("Transfer at least one unit")
+    if from_bank == to_bank:
+        raise ValueError("Pick two different banks")
+    with transaction() as conn:
+        retire_expired(bank_id=from_bank, group=group)
+        have = _units(conn, from_bank, group)
+        if have < units:
+            raise ValueError(f"Bank {from_bank} has only {have} units of {group}")
+        at = _now()
+        out_id = record(conn, from_bank, group, -units, "transfer", at=at, note=note)
+        # the credit points back at the debit (ix_ledger_ref finds the pair from either side)
+        record(conn, to_bank, group, units, "transfer", ref_id=out_id, at=at, note=note)
+        return out_id
+
+
+def correct(bank_id, group, counted, note=None):
+    """Book a physical count: records the difference to the current balance
+    (expired lots written off first, they aren't on the shelf). Returns it."""
+    from lots import retire_expired
+    if counted < 0:
+        raise ValueError("Counted units can't be negative")
+    with transaction() as conn:
+        retire_expired(bank_id=bank_id, group=group)
+        delta = counted - _units(conn, bank_id, group)
+        if delta:
+            record(conn, bank_id, group, delta, "correction", note=note or "stock count")
+        return delta
+
+
+# ---------- point-in-time stock ----------
+def _base_snapshot(conn, ts):
+    return conn.execute("""SELECT SnapshotID, AsOf, LedgerID FROM InventorySnapshot
+                           WHERE AsOf <= ? ORDER BY AsOf DESC, SnapshotID DESC LIMIT 1""", (ts,)).fetchone()
+
+
+def _stock(conn, ts, upto=None):
+    # {(bank, group): units} counting movements dated <= ts (and LedgerID <= upto):
+    # the snapshot, then rows logged after it, then older rows dated after its AsOf
+    snap = _base_snapshot(conn, ts)
+    sid, as_of, hw = snap if snap else (None, "", 0)
+    upto = upto if upto is not None else (1 << 62)
+    stock = {}
+    if sid is not None:
+        for b, g, u in conn.execute("SELECT BankID, BloodGroup, Units FROM InventorySnapshotUnits WHERE SnapshotID = ?", (sid,)):
+            stock[(b, g)] = u
+    rows = conn.execute("""SELECT BankID, BloodGroup, SUM(Delta) FROM (
+                               SELECT BankID, BloodGroup, Delta FROM InventoryLedger
+                               WHERE LedgerID > ?1 AND LedgerID <= ?2 AND At <= ?3
+                               UNION ALL
+                               SELECT BankID, BloodGroup, Delta FROM InventoryLedger
+                               WHERE At > ?4 AND At <= ?3 AND LedgerID <= ?1)
+                           GROUP BY BankID, BloodGroup""", (hw, upto, ts, as_of))
+    for b, g, d in rows:
+        stock[(b, g)] = stock.get((b, g), 0) + d
+    return stock
+
+
+def stock_as_of(when=None, bank_id=None):
+    """Units per bank and blood group at `when` (a date means the end of that day).
+
+    Returns dicts with BankID, Bank, BloodGroup and Units, skipping zero rows.
+    """
+    with get_conn() as conn:
+        conn.execute("BEGIN")      # one read snapshot for both queries
+        try:
+            stock = _stock(conn, _ts(when))
+            names = dict(conn.execute("SELECT BankID, Name FROM BloodBank").fetchall())
+        finally:
+            conn.rollback()
+    out = [{"BankID": b, "Bank": names.get(b, f"(deleted bank {b})"), "BloodGroup": g, "Units": u}
+           for (b, g), u in stock.items() if u and (bank_id is None or b == bank_id)]
+    return sorted(out, key=lambda r: (r["Bank"], r["BloodGroup"]))
+
+
+def movements(bank_id=None, group=None, since=None, until=None, limit=200):
+    """Ledger rows, newest first."""
+    conds, params = [], []
+    if bank_id is not None:
+        conds.append("l.BankID = ?"); params.append(bank_id)
+    if group:
+        conds.append("l.BloodGroup = ?"); params.append(group)
+    if since:
+        conds.append("l.At >= ?"); params.append(str(since))
+    if until:
+        conds.append("l.At <= ?"); params.append(_ts(until))
+    where = " WHERE " + " AND ".join(conds) if conds else ""
+    return fetch_all(f"""SELECT l.LedgerID, l.At, b.Name AS Bank, l.BloodGroup, l.Delta, l.Kind, l.RefID, l.Note
+                         FROM InventoryLedger l LEFT JOIN BloodBank b ON b.BankID = l.BankID{where}
+                         ORDER BY l.At DESC, l.LedgerID DESC LIMIT ?""", tuple(params) + (limit,))
+
+
+# ---------- snapshots ----------
+def take_snapshot(when=None):
+    """Store the stock at `when` (default now), built from the previous snapshot.
+
+    Returns the new SnapshotID.
+    """
+    ts = _ts(when)
+    with transaction() as conn:
+        hw = conn.execute("SELECT coalesce(MAX(LedgerID), 0) FROM InventoryLedger").fetchone()[0]
+        stock = _stock(conn, ts, hw)
+        sid = conn.execute("INSERT INTO InventorySnapshot (AsOf, LedgerID, TakenAt) VALUES (?, ?, ?)",
+                           (ts, hw, time.time())).lastrowid
+        conn.executemany("INSERT INTO InventorySnapshotUnits (SnapshotID, BankID, BloodGroup, Units) VALUES (?, ?, ?, ?)",
+                         [(sid, b, g, u) for (b, g), u in stock.items() if u])
+        return sid
+
+
+def compact_snapshots(keep_days=SNAPSHOT_KEEP_DAYS):
+    """Keep every snapshot from the last `keep_days`, and the latest of each
+    month before that. Returns the number deleted. The ledger itself is never touched.
+    """
+    with transaction() as conn:
+        cur = conn.execute("""DELETE FROM InventorySnapshot
+                              WHERE AsOf < datetime('now', 'localtime', ?)
+                                AND SnapshotID NOT IN (SELECT MAX(SnapshotID) FROM InventorySnapshot
+                                                       GROUP BY substr(AsOf, 1, 7))""", (f"-{int(keep_days)} days",))
+        return cur.rowcount
+
+
+def snapshot_due(interval_hours=SNAPSHOT_INTERVAL_HOURS, min_rows=SNAPSHOT_MIN_ROWS):
+    last = fetch_one("SELECT TakenAt, LedgerID FROM InventorySnapshot ORDER BY SnapshotID DESC LIMIT 1")
+    if last and time.time() - last[0] < interval_hours * 3600:
+        return False
+    new_rows = fetch_one("SELECT COUNT(*) FROM InventoryLedger WHERE LedgerID > ?", (last[1] if last else 0,))[0]
+    return new_rows >= min_rows
+
+
+def reconcile():
+    """Inventory rows that disagree with the ledger (should always be empty)."""
+    return fetch_all("""SELECT i.BankID, i.BloodGroup, coalesce(i.UnitsAvailable, 0) AS Inventory, coalesce(l.Units, 0) AS Ledger
+                        FROM Inventory i LEFT JOIN (SELECT BankID, BloodGroup, SUM(Delta) AS Units FROM InventoryLedger
+                                                    GROUP BY BankID, BloodGroup) l
+                             ON l.BankID = i.BankID AND l.BloodGroup = i.BloodGroup
+                        WHERE coalesce(i.UnitsAvailable, 0) != coalesce(l.Units, 0)""")
+
+
+# ---------- scheduled snapshots ----------
+_snapshotter = {"thread": None, "stop": threading.Event()}
+_snapshotter_lock = threading.Lock()
+
+
+def _run(interval_hours):
+    stop = _snapshotter["stop"]
+    while not stop.is_set():
+        try:
+            if snapshot_due(interval_hours):
+                take_snapshot()
+                compact_snapshots()
+        except Exception:
+            pass                   # try again next round (db locked, ...)
+        stop.wait(min(3600, interval_hours * 3600 / 4))
+
+
+def start_snapshotter(interval_hours=SNAPSHOT_INTERVAL_HOURS):
+    """Take inventory snapshots in a background thread (once per process)."""
+    with _snapshotter_lock:
+        t = _snapshotter["thread"]
+        if t and t.is_alive():
+            return t
+        _snapshotter["stop"].clear()
+        t = threading.Thread(target=_run, args=(interval_hours,), name="ledger-snapshotter", daemon=True)
+        t.start()
+        _snapshotter["thread"] = t
+        return t
+
+
+def stop_snapshotter(timeout=10):
+    _snapshotter["stop"].set()
+    if _snapshotter["thread"]:
+        _snapshotter["thread"].join(timeout)
+    _snapshotter["thread"] = None
+
+
+if __name__ == "__main__":
+    import sys
+    arg = sys.argv[1] if len(sys.argv) > 1 else None
+    if arg == "snapshot":
+        print("snapshot", take_snapshot(), "- compacted", compact_snapshots())
+    elif arg == "reconcile":
+        bad = reconcile()
+        print("ok" if not bad else "\n".join(str(r) for r in bad))
+        sys.exit(1 if bad else 0)
+    else:
+        t = time.perf_counter()
+        rows = stock_as_of(arg)
+        for r in rows:
+            print(f"{r['Bank']:<30} {r['BloodGroup']:<4} {r['Units']:>6}")
+        print(f"{len(rows)} rows as of {_ts(arg)} in {(time.perf_counter() - t) * 1000:.1f} ms")
@@ -0,0 +1,163 @@
+# lots.py
+# Blood expires: red cells keep about SHELF_LIFE_DAYS after collection. Stock
+# is tracked per lot (one row per donation or other batch that came in, with
+# collection and expiry dates) next to the per-(bank, group) totals.
+# Lots are maintained by a trigger on InventoryLedger, like Inventory itself,
+# so every way of booking stock keeps them current:
+#   - units coming in become a new lot (donations, counts, opening stock)
+#   - units going out are taken first-expiry-first-out (FEFO) from the lots of
+#     that bank and group, unexpired lots first; a donation taken back
+#     (delete_donation) comes out of its own lot
+#   - a released reservation goes back to the lots it was taken from, and a
+#     transfer arrives as lots with the expiry dates of the ones it left
+#   - an "expiry" movement writes off expired lots only
+# retire_expired() books those expiry movements in bulk; start_sweeper() runs
+# it in the background. Inventory stays the sum of the ledger, and therefore
+# of Lot.Remaining (reconcile()).
+#   python lots.py                     lots expiring within EXPIRING_DAYS
+#   python lots.py retire | reconcile
+#   python lots.py plan BANK GROUP UNITS   which lots a request would get
+import threading
+import time
+from datetime import date, datetime
+from db import transaction, fetch_all
+from ledger import INSERT_MOVEMENT
+
+SHELF_LIFE_DAYS = 42               # red cells; a lot expires this many days after collection
+EXPIRING_DAYS = 7                  # "expiring soon" on the Inventory page
+SWEEP_INTERVAL_HOURS = 6           # background retirement of expired lots (start_sweeper)
+
+# The lots one movement takes, in order, with a running total: everything up
+# to the lot where the total reaches the units wanted. Candidates are read in
+# index order (ix_lot_fefo) and each pass stops after {units} lots, so the cost
+# depends on the units taken, not on how many lots the bank holds. Passes: the
+# donation's own lot when a donation is taken back, unexpired lots, then
+# expired ones (only those for an 'expiry' write-off).
+# {bank} {group} {units} {day} {kind} {ref} are SQL expressions: NEW.* columns
+# in the lot_ai trigger (created by migrations.py), parameters in plan().
+_OWN = "{kind} = 'correction' AND {ref} IS NOT NULL AND DonationID = {ref}"
+_FEFO = f"""SELECT LotID, ExpiresOn, min(Remaining, {{units}} - (Taken - Remaining)) AS Units
+            FROM (SELECT LotID, ExpiresOn, Remaining, SUM(Remaining) OVER (ORDER BY Pass, ExpiresOn, LotID) AS Taken
+                  FROM (SELECT 0 AS Pass, LotID, ExpiresOn, Remaining FROM Lot INDEXED BY ix_lot_donation
+                        WHERE {_OWN} AND BankID = {{bank}} AND BloodGroup = {{group}} AND Remaining > 0
+                        UNION ALL
+                        SELECT * FROM (SELECT 1, LotID, ExpiresOn, Remaining FROM Lot INDEXED BY ix_lot_fefo
+                                       WHERE BankID = {{bank}} AND BloodGroup = {{group}} AND Remaining > 0
+                                         AND ExpiresOn > {{day}} AND {{kind}} != 'expiry' AND NOT coalesce({_OWN}, 0)
+                                       ORDER BY ExpiresOn, LotID LIMIT {{units}})
+                        UNION ALL
+                        SELECT * FROM (SELECT 2, LotID, ExpiresOn, Remaining FROM Lot INDEXED BY ix_lot_fefo
+                                       WHERE BankID = {{bank}} AND BloodGroup = {{group}} AND Remaining > 0
+                                         AND ExpiresOn <= {{day}} AND {{kind}} = 'expiry' AND NOT coalesce({_OWN}, 0)
+                                       ORDER BY ExpiresOn, LotID LIMIT {{units}})))
+            WHERE Taken - Remaining < {{units}}"""
+
+
+def _today(today):
+    return (today or date.today()).isoformat() if not isinstance(today, str) else today
+
+
+def retire_expired(today=None, bank_id=None, group=None):
+    """Write off every lot expired by `today`: one 'expiry' movement per bank and
+    group. Returns the number of units retired.
+
+    Runs inside the caller's transaction when there is one (reserve_bank).
+    """
+    day = _today(today)
+    at = datetime.now().strftime("%Y-%m-%d %H:%M:%S") if today is None else f"{day} 00:00:00"
+    where, params = ["ExpiresOn <= ?", "Remaining > 0"], [day]
+    if bank_id is not None:
+        where.append("BankID = ?")
+        params.append(bank_id)
+    if group is not None:
+        where.append("BloodGroup = ?")
+        params.append(group)
+    with transaction() as conn:
+        expired = conn.execute(f"""SELECT BankID, BloodGroup, SUM(Remaining) FROM Lot
+                                   WHERE {" AND ".join(where)} GROUP BY BankID, BloodGroup""", params).fetchall()
+        conn.executemany(INSERT_MOVEMENT, [(b, g, -n, "expiry", None, at, "expired lots") for b, g, n in expired])
+    return sum(n for _, _, n in expired)
+
+
+def plan(bank_id, group, units, today=None):
+    """The lots `units` of `group` at a bank would be served from, in FEFO order:
+    dicts with LotID, ExpiresOn and Units. Fewer units than asked when short."""
+    day = _today(today)
+    return fetch_all(_FEFO.format(bank=":bank", group=":group", units=":units", day=":day", kind="''", ref="NULL"),
+                     {"bank": bank_id, "group": group, "units": units, "day": day})
+
+
+def expiring(days=EXPIRING_DAYS, today=None, bank_id=None, limit=200):
+    """Lots with units left that expire within `days` (or already have), soonest first."""
+    day = _today(today)
+    sql = f"""SELECT l.LotID, b.Name AS Bank, l.BloodGroup, l.Remaining AS Units, l.CollectedOn, l.ExpiresOn,
+                     CAST(julianday(l.ExpiresOn) - julianday(:day) AS INTEGER) AS DaysLeft
+              FROM Lot l INDEXED BY ix_lot_expiry JOIN BloodBank b ON b.BankID = l.BankID
+              WHERE l.Remaining > 0 AND l.ExpiresOn <= date(:day, '+' || :days || ' days')
+                    {"AND l.BankID = :bank" if bank_id is not None else ""}
+              ORDER BY l.ExpiresOn, l.LotID LIMIT :limit"""
+    return fetch_all(sql, {"day": day, "days": int(days), "bank": bank_id, "limit": limit})
+
+
+def reconcile():
+    """(bank, group) pairs whose lots don't add up to Inventory (should always be empty)."""
+    return fetch_all("""SELECT i.BankID, i.BloodGroup, coalesce(i.UnitsAvailable, 0) AS Inventory, coalesce(l.Units, 0) AS Lots
+                        FROM Inventory i LEFT JOIN (SELECT BankID, BloodGroup, SUM(Remaining) AS Units FROM Lot
+                                                    GROUP BY BankID, BloodGroup) l
+                             ON l.BankID = i.BankID AND l.BloodGroup = i.BloodGroup
+                        WHERE coalesce(i.UnitsAvailable, 0) != coalesce(l.Units, 0)""")
+
+
+# ---------- scheduled retirement ----------
+_sweeper = {"thread": None, "stop": threading.Event()}
+_sweeper_lock = threading.Lock()
+
+
+def _run(interval_hours):
+    stop = _sweeper["stop"]
+    while not stop.is_set():
+        try:
+            retire_expired()
+        except Exception:
+            pass                   # try again next round (db locked, ...)
+        stop.wait(interval_hours * 3600)
+
+
+def start_sweeper(interval_hours=SWEEP_INTERVAL_HOURS):
+    """Retire expired lots in a background thread (once per process)."""
+    with _sweeper_lock:
+        t = _sweeper["thread"]
+        if t and t.is_alive():
+            return t
+        _sweeper["stop"].clear()
+        t = threading.Thread(target=_run, args=(interval_hours,), name="lot-sweeper", daemon=True)
+        t.start()
+        _sweeper["thread"] = t
+        return t
+
+
+def stop_sweeper(timeout=10):
+    _sweeper["stop"].set()
+    if _sweeper["thread"]:
+        _sweeper["thread"].join(timeout)
+    _sweeper["thread"] = None
+
+
+if __name__ == "__main__":
+    import sys
+    arg = sys.argv[1] if len(sys.argv) > 1 else None
+    if arg == "retire":
+        print(retire_expired(), "expired units retired")
+    elif arg == "reconcile":
+        bad = reconcile()
+        print("ok" if not bad else "\n".join(str(r) for r in bad))
+        sys.exit(1 if bad else 0)
+    elif arg == "plan" and len(sys.argv) == 5:
+        t = time.perf_counter()
+        rows = plan(int(sys.argv[2]), sys.argv[3], int(sys.argv[4]))
+        for r in rows:
+            print(f"lot {r['LotID']:>8}  expires {r['ExpiresOn']}  {r['Units']:>4} units")
+        print(f"{sum(r['Units'] for r in rows)} units from {len(rows)} lots in {(time.perf_counter() - t) * 1000:.1f} ms")
+    else:
+        for r in expiring():
+            print(f"{r['Bank'][:30]:<30} {r['BloodGroup']:<4} {r['Units']:>5} units  expires {r['ExpiresOn']} ({r['DaysLeft']:+d} days)")
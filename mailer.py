@@ -0,0 +1,266 @@
+# mailer.py
+# Outbound email queue. enqueue_email() writes a row to the Outbox table and
+# returns at once; background sender threads claim queued rows in batches,
+# send them over long-lived authenticated SMTP sessions, retry failures with
+# exponential backoff and record status and latency per message.
+# Several sender threads (each with its own session) share a token-bucket rate
+# limit. Claiming happens in a write transaction, so threads and other app
+# processes never send the same message twice. Bodies are blanked once a
+# message is sent or has failed for good (OTP mails carry the code in clear).
+import json
+import os
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+from db import transaction, fetch_all, fetch_one, run_write
+
+EMAIL_CONFIG_FILE = "email_config.json"
+BATCH_SIZE = 50                    # messages claimed per round
+SENDER_THREADS = 4                 # parallel SMTP sessions per process
+MAX_PER_SECOND = 20                # across all sender threads of this process; 0 = no limit
+POLL_SECONDS = 5                   # wake up at least this often (retries, other processes)
+MAX_ATTEMPTS = 5
+BACKOFF_SECONDS = 30               # 30s, 60s, 120s, ... between attempts
+CLAIM_TIMEOUT = 300                # a 'sending' row older than this was lost by a dead worker
+SMTP_TIMEOUT = 10
+SMTP_IDLE_CLOSE = 120              # drop the session after this long with nothing to send
+SMTP_NOOP_AFTER = 30               # check a reused session is still alive after this long idle
+
+
+# ---------- config ----------
+_cfg_cache = {"path": None, "mtime": None, "cfg": None}
+
+
+def load_email_config(path=None):
+    # cached; re-read only when the file changes
+    path = path or EMAIL_CONFIG_FILE
+    if not os.path.exists(path):
+        return None
+    mtime = os.path.getmtime(path)
+    if _cfg_cache["path"] != path or _cfg_cache["mtime"] != mtime:
+        with open(path, "r") as f:
+            _cfg_cache.update(path=path, mtime=mtime, cfg=json.load(f))
+    return _cfg_cache["cfg"]
+
+
+# ---------- SMTP session ----------
+class SmtpSession:
+    """One authenticated SMTP connection, reopened when it drops."""
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.server = None
+        self.last_used = 0.0
+
+    def _connect(self):
+        cfg = self.cfg
+        host, port = cfg.get("email_host"), cfg.get("email_port")
+        use_tls = cfg.get("use_tls", True)
+        if cfg.get("use_ssl", not use_tls):
+            server = smtplib.SMTP_SSL(host, port, timeout=SMTP_TIMEOUT)
+        else:
+            server = smtplib.SMTP(host, port, timeout=SMTP_TIMEOUT)
+            if use_tls:
+                server.starttls()
+        if cfg.get("email_password"):
+            server.login(cfg.get("email_address"), cfg.get("email_password"))
+        self.server = server
+
+    def _alive(self):
+        if self.server is None:
+            return False
+        if time.time() - self.last_used < SMTP_NOOP_AFTER:
+            return True
+        try:
+            return self.server.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+        except OSError:
+            return False
+
+    def send(self, msg):
+        if not self._alive():
+            self.close()
+            self._connect()
+        try:
+            self.server.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # server dropped us between messages: reconnect once and retry
+            self.close()
+            self._connect()
+            self.server.send_message(msg)
+        self.last_used = time.time()
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+        self.server = None
+
+
+class RateLimiter:
+    """Token bucket shared by the sender threads."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = float(rate)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def build_message(cfg, recipient, subject, body):
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["From"] = f"Blood Donation System <{cfg.get('email_address')}>"
+    msg["To"] = recipient
+    msg.set_content(body)
+    return msg
+
+
+# ---------- queue ----------
+def enqueue_email(recipient, subject, body):
+    """Queue a message for the worker. Returns the OutboxID."""
+    cur = run_write("INSERT INTO Outbox (Recipient, Subject, Body, CreatedAt, NextAttemptAt) VALUES (?,?,?,?,?)",
+                    (recipient, subject, body, time.time(), time.time()))
+    _wake.set()
+    return cur.lastrowid
+
+
+def enqueue_many(messages):
+    """Queue many (recipient, subject, body) tuples in one transaction. Returns the count."""
+    now = time.time()
+    with transaction() as conn:
+        conn.executemany("INSERT INTO Outbox (Recipient, Subject, Body, CreatedAt, NextAttemptAt) VALUES (?,?,?,?,?)",
+                         [(r, s, b, now, now) for r, s, b in messages])
+    _wake.set()
+    return len(messages)
+
+
+def _claim(limit):
+    now = time.time()
+    with transaction() as conn:
+        rows = conn.execute("""SELECT OutboxID, Recipient, Subject, Body, Attempts, CreatedAt FROM Outbox
+                               WHERE (Status = 'queued' AND NextAttemptAt <= ?)
+                                  OR (Status = 'sending' AND ClaimedAt < ?)
+                               ORDER BY NextAttemptAt LIMIT ?""", (now, now - CLAIM_TIMEOUT, limit)).fetchall()
+        conn.executemany("UPDATE Outbox SET Status = 'sending', ClaimedAt = ? WHERE OutboxID = ?",
+                         [(now, r[0]) for r in rows])
+    return rows
+
+
+def _record(sent, failed):
+    # a message done with (sent, or failed for good) loses its body: it may hold a one-time code
+    with transaction() as conn:
+        conn.executemany("""UPDATE Outbox SET Status = 'sent', Attempts = Attempts + 1, SentAt = ?,
+                                   LatencyMs = ?, SendMs = ?, LastError = NULL, Body = '' WHERE OutboxID = ?""", sent)
+        conn.executemany("""UPDATE Outbox SET Attempts = Attempts + 1, LastError = ?1,
+                                   Status = CASE WHEN Attempts + 1 >= ?2 THEN 'failed' ELSE 'queued' END,
+                                   Body = CASE WHEN Attempts + 1 >= ?2 THEN '' ELSE Body END,
+                                   NextAttemptAt = ?3 + ?4 * (1 << Attempts)
+                            WHERE OutboxID = ?5""", failed)
+
+
+def process_batch(session, cfg, limit=BATCH_SIZE, limiter=None):
+    """Send one batch of due messages. Returns how many were claimed."""
+    rows = _claim(limit)
+    sent, failed = [], []
+    for oid, recipient, subject, body, attempts, created in rows:
+        if limiter:
+            limiter.acquire()
+        try:
+            msg = build_message(cfg, recipient, subject, body)
+        except Exception as e:
+            # bad address/headers: retrying won't help, fail this one right away
+            failed.append((f"bad message: {e}"[:500], 0, time.time(), BACKOFF_SECONDS, oid))
+            continue
+        t0 = time.time()
+        try:
+            session.send(msg)
+            t1 = time.time()
+            sent.append((t1, int((t1 - created) * 1000), int((t1 - t0) * 1000), oid))
+        except Exception as e:
+            session.close()
+            failed.append((str(e)[:500], MAX_ATTEMPTS, time.time(), BACKOFF_SECONDS, oid))
+    if rows:
+        _record(sent, failed)
+    return len(rows)
+
+
+# ---------- worker ----------
+_wake = threading.Event()
+_worker = {"threads": [], "stop": threading.Event()}
+_worker_lock = threading.Lock()
+
+
+def _run(config_path, limiter):
+    session, cfg = None, None
+    stop = _worker["stop"]
+    while not stop.is_set():
+        try:
+            new_cfg = load_email_config(config_path)
+            if new_cfg is not cfg:
+                if session:
+                    session.close()
+                cfg, session = new_cfg, (SmtpSession(new_cfg) if new_cfg else None)
+            if session and process_batch(session, cfg, limiter=limiter):
+                continue               # more may be waiting
+            if session and session.server and time.time() - session.last_used > SMTP_IDLE_CLOSE:
+                session.close()
+        except Exception:
+            # keep the worker alive whatever happens (db locked, bad config, ...)
+            time.sleep(1)
+        _wake.wait(POLL_SECONDS)
+        _wake.clear()
+    if session:
+        session.close()
+
+
+def start_worker(config_path=None, threads=SENDER_THREADS, max_per_second=MAX_PER_SECOND):
+    """Start the background senders once per process (safe to call on every rerun)."""
+    with _worker_lock:
+        alive = [t for t in _worker["threads"] if t.is_alive()]
+        if alive:
+            return alive
+        _worker["stop"].clear()
+        limiter = RateLimiter(max_per_second)
+        _worker["threads"] = [threading.Thread(target=_run, args=(config_path, limiter),
+                                               name=f"outbox-worker-{i}", daemon=True) for i in range(threads)]
+        for t in _worker["threads"]:
+            t.start()
+        return _worker["threads"]
+
+
+def stop_worker(timeout=10):
+    _worker["stop"].set()
+    _wake.set()
+    for t in _worker["threads"]:
+        t.join(timeout)
+    _worker["threads"] = []
+
+
+def outbox_status(outbox_id):
+    row = fetch_one("SELECT Status, Attempts, LastError FROM Outbox WHERE OutboxID = ?", (outbox_id,))
+    return {"Status": row[0], "Attempts": row[1], "LastError": row[2]} if row else None
+
+
+def outbox_summary():
+    return fetch_all("""SELECT Status, COUNT(*) AS Messages, CAST(AVG(LatencyMs) AS INTEGER) AS AvgLatencyMs,
+                               CAST(AVG(SendMs) AS INTEGER) AS AvgSendMs
+                        FROM Outbox GROUP BY Status ORDER BY Status""")
@@ -0,0 +1,191 @@
+# matching.py
+# Batch matching of pending requests to bank stock.
+# All pending requests and all stock are loaded in two queries, distances come
+# from NumPy request x bank blocks (CHUNK requests at a time, so memory stays
+# bounded), and requests are served in "regret" order (those that lose the most
+# by not getting their best option go first), decrementing a working copy of
+# stock so the same units are never offered twice.
+# The default inputs are fetched column-wise straight into arrays (no dict per row).
+import numpy as np
+from db import fetch_all, fetch_columns
+from geo import distance_matrix_km, has_coords, haversine_km
+
+BLOOD_GROUPS = ["A+", "A-", "B+", "B-", "O+", "O-", "AB+", "AB-"]
+
+# red cell compatibility: recipient group -> donor groups, preferred first
+CAN_RECEIVE = {
+    "O-":  ["O-"],
+    "O+":  ["O+", "O-"],
+    "A-":  ["A-", "O-"],
+    "A+":  ["A+", "A-", "O+", "O-"],
+    "B-":  ["B-", "O-"],
+    "B+":  ["B+", "B-", "O+", "O-"],
+    "AB-": ["AB-", "A-", "B-", "O-"],
+    "AB+": ["AB+", "AB-", "A+", "A-", "B+", "B-", "O+", "O-"],
+}
+
+SUBSTITUTE_PENALTY_KM = 100        # an exact group match wins unless it is this much farther
+UNIVERSAL_PENALTY_KM = 100         # extra cost on O- so it is kept for patients who need it
+UNLOCATED_KM = 5000                # distance used when either side has no coordinates
+CHUNK = 2048                       # requests per block when scoring (bounds memory)
+NEAR_BANKS = 64                    # closest banks considered when shortlisting
+TOP_K = 8                          # options shortlisted per request before falling back to a full scan
+
+GROUP_INDEX = {g: i for i, g in enumerate(BLOOD_GROUPS)}
+
+# PENALTY[r, d]: extra cost (km) of giving group d to a recipient of group r; inf = incompatible
+PENALTY = np.full((len(BLOOD_GROUPS), len(BLOOD_GROUPS)), np.inf)
+for _r, _ds in CAN_RECEIVE.items():
+    for _d in _ds:
+        PENALTY[GROUP_INDEX[_r], GROUP_INDEX[_d]] = 0.0 if _d == _r else \
+            SUBSTITUTE_PENALTY_KM + (UNIVERSAL_PENALTY_KM if _d == "O-" else 0)
+
+
+def compatible_groups(recipient_group):
+    return CAN_RECEIVE.get(recipient_group, [recipient_group])
+
+
+PENDING_SQL = """SELECT RequestID, PatientName, RequiredBloodGroup, UnitsRequired, City, Latitude, Longitude, RequestDate
+                 FROM Request WHERE Status='Pending' ORDER BY RequestDate, RequestID"""
+STOCK_SQL = """SELECT i.BankID, b.Name, b.Latitude, b.Longitude, i.BloodGroup, i.UnitsAvailable
+               FROM Inventory i JOIN BloodBank b ON b.BankID = i.BankID WHERE i.UnitsAvailable > 0"""
+
+
+def load_pending_requests():
+    return fetch_all(PENDING_SQL)
+
+
+def load_stock():
+    return fetch_all(STOCK_SQL)
+
+
+REQUEST_COLS = ("RequestID", "RequiredBloodGroup", "UnitsRequired", "Latitude", "Longitude")
+STOCK_COLS = ("BankID", "Name", "Latitude", "Longitude", "BloodGroup", "UnitsAvailable")
+
+
+def _columns(rows, names):
+    # list of dicts (callers' own rows) -> the same {name: values} shape fetch_columns gives
+    return {n: [r[n] for r in rows] for n in names}
+
+
+def _coords(lat, lon):
+    # None, NaN and the forms' 0.0/0.0 default all mean "no coordinates"
+    lat = np.array(lat, dtype=float)
+    lon = np.array(lon, dtype=float)
+    missing = np.isnan(lat) | np.isnan(lon) | ((lat == 0) & (lon == 0))
+    lat[missing] = np.nan
+    lon[missing] = np.nan
+    return lat, lon
+
+
+def match_requests(requests=None, stock=None):
+    """Assign pending requests to (bank, blood group) stock without double-booking.
+
+    requests/stock default to the pending Request rows and positive Inventory
+    rows. Returns one dict per request (input order) with RequestID, BankID,
+    Bank, BloodGroup (group supplied), UnitsAvailable (bank's stock of it),
+    Units, DistanceKm and Exact; BankID is None when nothing compatible has
+    enough units.
+    """
+    req = fetch_columns(PENDING_SQL) if requests is None else _columns(list(requests), REQUEST_COLS)
+    stk = fetch_columns(STOCK_SQL) if stock is None else _columns(list(stock), STOCK_COLS)
+    n_req = len(req["RequestID"])
+    if n_req == 0:
+        return []
+
+    # one row per bank (sorted ids), stock summed into a bank x group matrix
+    stock_bank = np.asarray(stk["BankID"], dtype=np.int64)
+    bank_ids, first = np.unique(stock_bank, return_index=True)
+    bank_names = [stk["Name"][j] for j in first]
+    sgroup = np.array([GROUP_INDEX.get(g, -1) for g in stk["BloodGroup"]], dtype=np.int64)
+    ok = sgroup >= 0
+    units = np.zeros((len(bank_ids), len(BLOOD_GROUPS)), dtype=np.int64)
+    np.add.at(units, (np.searchsorted(bank_ids, stock_bank[ok]), sgroup[ok]),
+              np.asarray(stk["UnitsAvailable"], dtype=np.int64)[ok])
+    bank_ids = bank_ids.tolist()
+
+    available = units.copy()
+    need = np.asarray(req["UnitsRequired"], dtype=np.int64)
+    rgroup = np.array([GROUP_INDEX.get(g, -1) for g in req["RequiredBloodGroup"]], dtype=np.int64)
+    request_ids = np.asarray(req["RequestID"]).tolist()
+
+    rlat, rlon = _coords(req["Latitude"], req["Longitude"])
+    blat, blon = _coords(np.asarray(stk["Latitude"], dtype=float)[first], np.asarray(stk["Longitude"], dtype=float)[first])
+
+    def dist(lo, hi):
+        # (hi - lo, B) km from requests lo..hi to every bank
+        d = distance_matrix_km(rlat[lo:hi], rlon[lo:hi], blat, blon)
+        d[np.isnan(d)] = UNLOCATED_KM
+        return d
+
+    # shortlist against the initial stock: each request's TOP_K cheapest (bank, group)
+    # options among its NEAR_BANKS closest banks, and its regret = 2nd best - best cost
+    n_bank, n_grp = len(bank_ids), len(BLOOD_GROUPS)
+    penalty = np.full((n_req, n_grp), np.inf)
+    known = rgroup >= 0
+    penalty[known] = PENALTY[rgroup[known]]
+    top_cost = np.full((n_req, TOP_K), np.inf)
+    top_bank = np.zeros((n_req, TOP_K), dtype=np.int64)
+    top_group = np.zeros((n_req, TOP_K), dtype=np.int64)
+    for lo in range(0, n_req if n_bank else 0, CHUNK):
+        hi = min(lo + CHUNK, n_req)
+        block = dist(lo, hi)
+        if n_bank > NEAR_BANKS:
+            near = np.argpartition(block, NEAR_BANKS - 1, axis=1)[:, :NEAR_BANKS]
+        else:
+            near = np.broadcast_to(np.arange(n_bank), (hi - lo, n_bank))
+        cost = np.take_along_axis(block, near, axis=1)[:, :, None] + penalty[lo:hi, None, :]
+        cost[units[near] < need[lo:hi, None, None]] = np.inf
+        cost = cost.reshape(hi - lo, -1)
+        kk = min(TOP_K, cost.shape[1])
+        part = np.argpartition(cost, kk - 1, axis=1)[:, :kk]
+        part = np.take_along_axis(part, np.argsort(np.take_along_axis(cost, part, axis=1), axis=1), axis=1)
+        top_cost[lo:hi, :kk] = np.take_along_axis(cost, part, axis=1)
+        top_bank[lo:hi, :kk] = np.take_along_axis(near, part // n_grp, axis=1)
+        top_group[lo:hi, :kk] = part % n_grp
+    with np.errstate(invalid="ignore"):
+        regret = top_cost[:, 1] - top_cost[:, 0]
+    regret[np.isinf(top_cost[:, 0])] = -1.0
+    # highest regret first; stable sort keeps oldest-first among ties
+    order = np.argsort(-regret, kind="stable")
+
+    result = [None] * n_req
+    for i in order:
+        row = {"RequestID": request_ids[i], "BankID": None, "Bank": None, "BloodGroup": None,
+               "UnitsAvailable": 0, "Units": int(need[i]), "DistanceKm": None, "Exact": False}
+        result[i] = row
+        if not known[i] or not n_bank:
+            continue
+        pick = None
+        for c, b, d in zip(top_cost[i].tolist(), top_bank[i].tolist(), top_group[i].tolist()):
+            if c == np.inf:
+                break
+            if units[b, d] >= need[i]:
+                pick = b, d
+                break
+        if pick is None:
+            # shortlist used up by earlier requests (or nothing near fits): scan every bank
+            donors = np.flatnonzero(np.isfinite(penalty[i]))
+            km = dist(i, i + 1)[0]
+            cost = np.where(units[:, donors] >= need[i], km[:, None] + penalty[i, donors], np.inf)
+            b, k = divmod(int(np.argmin(cost)), len(donors))
+            if np.isinf(cost[b, k]):
+                continue
+            pick = b, donors[k]
+        b, d = pick
+        units[b, d] -= need[i]
+        row.update(BankID=bank_ids[b], Bank=bank_names[b], BloodGroup=BLOOD_GROUPS[d],
+                   UnitsAvailable=int(available[b, d]), Exact=bool(d == rgroup[i]),
+                   DistanceKm=None if np.isnan(rlat[i]) or np.isnan(blat[b]) else
+                   round(haversine_km(rlat[i], rlon[i], blat[b], blon[b]), 2))
+    return result
+
+
+if __name__ == "__main__":
+    import time
+    t = time.perf_counter()
+    plan = match_requests()
+    matched = sum(1 for p in plan if p["BankID"] is not None)
+    print(f"{matched}/{len(plan)} pending requests matched in {time.perf_counter() - t:.3f}s")
+    for p in plan:
+        print(p)
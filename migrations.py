@@ -0,0 +1,682 @@
+# migrations.py
+# Versioned schema migrations keyed on PRAGMA user_version.
+# Each migration runs once, in order, inside its own transaction. When the
+# database is already at the latest version migrate() does a single PRAGMA
+# read and no DDL at all.
+#
+# To change the schema append a new (version, description, function) entry to
+# MIGRATIONS - never edit one that has already shipped. Each migration carries
+# its own DDL and SQL, frozen as shipped, rather than calling into the modules
+# that use the tables: editing those must not change what an old migration does.
+from db import get_conn, fetch_one, fetch_all, run_write, invalidate_cache
+
+
+def _m1_base_tables(conn):
+    # original app.py schema (CREATE IF NOT EXISTS so pre-migration databases are adopted)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS Donor (
+        DonorID INTEGER PRIMARY KEY AUTOINCREMENT,
+        Name TEXT NOT NULL,
+        Gender TEXT,
+        DOB TEXT,
+        BloodGroup TEXT NOT NULL,
+        Phone TEXT,
+        Email TEXT,
+        Latitude REAL,
+        Longitude REAL,
+        City TEXT,
+        LastDonationDate TEXT
+    );""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS BloodBank (
+        BankID INTEGER PRIMARY KEY AUTOINCREMENT,
+        Name TEXT NOT NULL,
+        Address TEXT,
+        Phone TEXT,
+        Latitude REAL,
+        Longitude REAL,
+        City TEXT
+    );""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS Inventory (
+        InventoryID INTEGER PRIMARY KEY AUTOINCREMENT,
+        BankID INTEGER NOT NULL,
+        BloodGroup TEXT NOT NULL,
+        UnitsAvailable INTEGER DEFAULT 0,
+        LastUpdated TEXT,
+        FOREIGN KEY (BankID) REFERENCES BloodBank(BankID) ON DELETE CASCADE
+    );""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS Donation (
+        DonationID INTEGER PRIMARY KEY AUTOINCREMENT,
+        DonorID INTEGER NOT NULL,
+        BankID INTEGER,
+        Date TEXT NOT NULL,
+        Units INTEGER NOT NULL,
+        Hemoglobin REAL,
+        FOREIGN KEY (DonorID) REFERENCES Donor(DonorID) ON DELETE CASCADE,
+        FOREIGN KEY (BankID) REFERENCES BloodBank(BankID) ON DELETE SET NULL
+    );""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS Request (
+        RequestID INTEGER PRIMARY KEY AUTOINCREMENT,
+        PatientName TEXT,
+        RequiredBloodGroup TEXT NOT NULL,
+        UnitsRequired INTEGER NOT NULL,
+        City TEXT,
+        Email TEXT,
+        Latitude REAL,
+        Longitude REAL,
+        RequestDate TEXT NOT NULL,
+        Status TEXT DEFAULT 'Pending',
+        AssignedBankID INTEGER,
+        AssignedDonorID INTEGER,
+        FOREIGN KEY (AssignedBankID) REFERENCES BloodBank(BankID),
+        FOREIGN KEY (AssignedDonorID) REFERENCES Donor(DonorID)
+    );""")
+
+
+def _m2_inventory_unique(conn):
+    # one Inventory row per (bank, group) so donations can UPSERT;
+    # fold any duplicates into the lowest InventoryID first
+    conn.execute("""UPDATE Inventory SET
+                       UnitsAvailable = (SELECT SUM(UnitsAvailable) FROM Inventory i2
+                                         WHERE i2.BankID = Inventory.BankID AND i2.BloodGroup = Inventory.BloodGroup),
+                       LastUpdated = (SELECT MAX(LastUpdated) FROM Inventory i2
+                                      WHERE i2.BankID = Inventory.BankID AND i2.BloodGroup = Inventory.BloodGroup)
+                   WHERE InventoryID IN (SELECT MIN(InventoryID) FROM Inventory
+                                         GROUP BY BankID, BloodGroup HAVING COUNT(*) > 1)""")
+    conn.execute("""DELETE FROM Inventory WHERE InventoryID NOT IN
+                    (SELECT MIN(InventoryID) FROM Inventory GROUP BY BankID, BloodGroup)""")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_inventory_bank_group ON Inventory(BankID, BloodGroup)")
+
+
+def _columns(conn, table):
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _rebuild(conn, table, create_sql):
+    # SQLite can't add CHECK constraints in place: copy into a new table and swap.
+    # Runs with foreign_keys OFF (see migrate) so the DROP doesn't cascade.
+    # The DROP takes the table's indexes and triggers with it; they are recreated.
+    keep = [r[0] for r in conn.execute("""SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger')
+                                          AND sql IS NOT NULL ORDER BY type, rowid""", (table,))]
+    conn.execute(create_sql.format(table=f"{table}__new"))
+    cols = ", ".join(c for c in _columns(conn, f"{table}__new") if c in _columns(conn, table))
+    conn.execute(f"INSERT INTO {table}__new ({cols}) SELECT {cols} FROM {table}")
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {table}__new RENAME TO {table}")
+    for sql in keep:
+        conn.execute(sql)
+
+
+def _m3_schema_drift(conn):
+    # bring databases made by create_tables.py / older app.py to one shape:
+    # Request.Email plus the CHECK constraints create_tables.py had
+    if "Email" not in _columns(conn, "Request"):
+        conn.execute("ALTER TABLE Request ADD COLUMN Email TEXT")
+    conn.execute("UPDATE Donor SET Gender = NULL WHERE Gender NOT IN ('M','F','Other')")
+    conn.execute("UPDATE Request SET Status = 'Pending' WHERE Status IS NULL OR Status NOT IN ('Pending','Assigned','Fulfilled','Cancelled')")
+    _rebuild(conn, "Donor", """
+    CREATE TABLE {table} (
+        DonorID INTEGER PRIMARY KEY AUTOINCREMENT,
+        Name TEXT NOT NULL,
+        Gender TEXT CHECK(Gender IN ('M','F','Other')),
+        DOB TEXT,
+        BloodGroup TEXT NOT NULL,
+        Phone TEXT,
+        Email TEXT,
+        Latitude REAL,
+        Longitude REAL,
+        City TEXT,
+        LastDonationDate TEXT
+    );""")
+    _rebuild(conn, "Request", """
+    CREATE TABLE {table} (
+        RequestID INTEGER PRIMARY KEY AUTOINCREMENT,
+        PatientName TEXT,
+        RequiredBloodGroup TEXT NOT NULL,
+        UnitsRequired INTEGER NOT NULL,
+        City TEXT,
+        Email TEXT,
+        Latitude REAL,
+        Longitude REAL,
+        RequestDate TEXT NOT NULL,
+        Status TEXT CHECK(Status IN ('Pending','Assigned','Fulfilled','Cancelled')) DEFAULT 'Pending',
+        AssignedBankID INTEGER,
+        AssignedDonorID INTEGER,
+        FOREIGN KEY (AssignedBankID) REFERENCES BloodBank(BankID),
+        FOREIGN KEY (AssignedDonorID) REFERENCES Donor(DonorID)
+    );""")
+
+
+def _m4_hot_path_indexes(conn):
+    # pending requests list (WHERE Status='Pending' ORDER BY RequestDate DESC)
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_request_status_date ON Request(Status, RequestDate)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_request_date ON Request(RequestDate)")
+    # bank suggestions: WHERE BloodGroup=? AND UnitsAvailable>=? (covering, BankID for the join)
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_inventory_group_units ON Inventory(BloodGroup, UnitsAvailable, BankID)")
+    # low stock alert: WHERE UnitsAvailable < ?
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_inventory_units ON Inventory(UnitsAvailable)")
+    # donor suggestions and filters
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_donor_group ON Donor(BloodGroup)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_donor_city ON Donor(City)")
+    # foreign keys: joins, cascades and parent deletes
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_donation_donor ON Donation(DonorID)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_donation_bank ON Donation(BankID)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_request_bank ON Request(AssignedBankID)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_request_donor ON Request(AssignedDonorID)")
+    conn.execute("ANALYZE")
+
+
+def _geo_index(conn, rtree, table, key):
+    # R*Tree mirror of table's coordinates; rows without usable coordinates
+    # (NULL or the forms' 0.0/0.0 default) are left out
+    usable = "{0}Latitude IS NOT NULL AND {0}Longitude IS NOT NULL AND NOT ({0}Latitude = 0 AND {0}Longitude = 0)"
+    put = f"""INSERT OR REPLACE INTO {rtree} SELECT NEW.{key}, NEW.Latitude, NEW.Latitude, NEW.Longitude, NEW.Longitude
+              WHERE {usable.format('NEW.')};"""
+    conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {rtree} USING rtree(id, minLat, maxLat, minLon, maxLon)")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS {rtree}_ai AFTER INSERT ON {table} BEGIN {put} END")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {rtree}_au AFTER UPDATE OF {key}, Latitude, Longitude ON {table}
+                     BEGIN DELETE FROM {rtree} WHERE id = OLD.{key}; {put} END""")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS {rtree}_ad AFTER DELETE ON {table} BEGIN DELETE FROM {rtree} WHERE id = OLD.{key}; END")
+    conn.execute(f"DELETE FROM {rtree}")
+    conn.execute(f"""INSERT INTO {rtree} SELECT {key}, Latitude, Latitude, Longitude, Longitude FROM {table}
+                     WHERE {usable.format('')}""")
+
+
+def _m5_spatial_index(conn):
+    _geo_index(conn, "DonorGeo", "Donor", "DonorID")
+    _geo_index(conn, "BankGeo", "BloodBank", "BankID")
+
+
+def _m6_dashboard_stats(conn):
+    # dashboard counters and the low-stock list, kept by triggers (stats.py reads them)
+    conn.execute("CREATE TABLE IF NOT EXISTS DashboardStats (Name TEXT PRIMARY KEY, Value INTEGER NOT NULL DEFAULT 0)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS LowStock (
+                        BankID INTEGER NOT NULL,
+                        BloodGroup TEXT NOT NULL,
+                        UnitsAvailable INTEGER NOT NULL,
+                        PRIMARY KEY (BankID, BloodGroup)
+                    ) WITHOUT ROWID""")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_lowstock_units ON LowStock(UnitsAvailable)")
+
+    def bump(name, delta):
+        return f"UPDATE DashboardStats SET Value = Value + ({delta}) WHERE Name = '{name}';"
+    threshold = "(SELECT Value FROM DashboardStats WHERE Name = 'low_threshold')"
+    new_pending = bump("pending", "NEW.Status = 'Pending'")
+    old_pending = bump("pending", "-(OLD.Status = 'Pending')")
+    triggers = {
+        "stats_donor_ai": f"AFTER INSERT ON Donor BEGIN {bump('donors', 1)} END",
+        "stats_donor_ad": f"AFTER DELETE ON Donor BEGIN {bump('donors', -1)} END",
+        "stats_bank_ai": f"AFTER INSERT ON BloodBank BEGIN {bump('banks', 1)} END",
+        "stats_bank_ad": f"AFTER DELETE ON BloodBank BEGIN {bump('banks', -1)} END",
+        "stats_request_ai": f"AFTER INSERT ON Request BEGIN {new_pending} END",
+        "stats_request_au": f"AFTER UPDATE OF Status ON Request BEGIN {new_pending} {old_pending} END",
+        "stats_request_ad": f"AFTER DELETE ON Request BEGIN {old_pending} END",
+        "stats_inventory_ai": f"""AFTER INSERT ON Inventory BEGIN
+                                      {bump('units', 'coalesce(NEW.UnitsAvailable, 0)')}
+                                      INSERT OR REPLACE INTO LowStock SELECT NEW.BankID, NEW.BloodGroup, coalesce(NEW.UnitsAvailable, 0)
+                                          WHERE coalesce(NEW.UnitsAvailable, 0) < {threshold};
+                                  END""",
+        "stats_inventory_au": f"""AFTER UPDATE OF UnitsAvailable, BankID, BloodGroup ON Inventory BEGIN
+                                      {bump('units', 'coalesce(NEW.UnitsAvailable, 0) - coalesce(OLD.UnitsAvailable, 0)')}
+                                      DELETE FROM LowStock WHERE BankID = OLD.BankID AND BloodGroup = OLD.BloodGroup;
+                                      INSERT OR REPLACE INTO LowStock SELECT NEW.BankID, NEW.BloodGroup, coalesce(NEW.UnitsAvailable, 0)
+                                          WHERE coalesce(NEW.UnitsAvailable, 0) < {threshold};
+                                  END""",
+        "stats_inventory_ad": f"""AFTER DELETE ON Inventory BEGIN
+                                      {bump('units', '-coalesce(OLD.UnitsAvailable, 0)')}
+                                      DELETE FROM LowStock WHERE BankID = OLD.BankID AND BloodGroup = OLD.BloodGroup;
+                                  END""",
+    }
+    for name, body in triggers.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+
+    # starting values, with the default low-stock threshold of 5 units
+    conn.execute("""INSERT INTO DashboardStats (Name, Value)
+                    SELECT 'donors', COUNT(*) FROM Donor
+                    UNION ALL SELECT 'banks', COUNT(*) FROM BloodBank
+                    UNION ALL SELECT 'units', coalesce(SUM(UnitsAvailable), 0) FROM Inventory
+                    UNION ALL SELECT 'pending', COUNT(*) FROM Request WHERE Status = 'Pending'
+                    UNION ALL SELECT 'low_threshold', 5""")
+    conn.execute("""INSERT OR REPLACE INTO LowStock SELECT BankID, BloodGroup, coalesce(UnitsAvailable, 0)
+                    FROM Inventory WHERE coalesce(UnitsAvailable, 0) < 5""")
+
+
+def _m7_last_donation_index(conn):
+    # inactive donor report (see reports.py): filter + keyset order on one index
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_donor_lastdonation ON Donor(coalesce(LastDonationDate, ''), DonorID)")
+
+
+def _m8_outbox(conn):
+    # durable email queue drained by mailer.py's worker
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS Outbox (
+        OutboxID INTEGER PRIMARY KEY AUTOINCREMENT,
+        Recipient TEXT NOT NULL,
+        Subject TEXT NOT NULL,
+        Body TEXT NOT NULL,
+        Status TEXT NOT NULL DEFAULT 'queued' CHECK(Status IN ('queued','sending','sent','failed')),
+        Attempts INTEGER NOT NULL DEFAULT 0,
+        CreatedAt REAL NOT NULL,
+        NextAttemptAt REAL NOT NULL,
+        ClaimedAt REAL,
+        SentAt REAL,
+        LatencyMs INTEGER,
+        SendMs INTEGER,
+        LastError TEXT
+    );""")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_outbox_due ON Outbox(Status, NextAttemptAt)")
+
+
+def _m9_broadcasts(conn):
+    # emergency donor alerts (broadcast.py): who was notified for which request, and their answer
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS Broadcast (
+        BroadcastID INTEGER PRIMARY KEY AUTOINCREMENT,
+        RequestID INTEGER NOT NULL,
+        RadiusKm REAL NOT NULL,
+        CreatedAt REAL NOT NULL,
+        Notified INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (RequestID) REFERENCES Request(RequestID) ON DELETE CASCADE
+    );""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS BroadcastRecipient (
+        BroadcastID INTEGER NOT NULL,
+        DonorID INTEGER NOT NULL,
+        DistanceKm REAL,
+        Response TEXT NOT NULL DEFAULT 'none' CHECK(Response IN ('none','yes','no')),
+        RespondedAt REAL,
+        PRIMARY KEY (BroadcastID, DonorID),
+        FOREIGN KEY (BroadcastID) REFERENCES Broadcast(BroadcastID) ON DELETE CASCADE,
+        FOREIGN KEY (DonorID) REFERENCES Donor(DonorID) ON DELETE CASCADE
+    ) WITHOUT ROWID;""")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_broadcast_request ON Broadcast(RequestID)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_broadcast_created ON Broadcast(CreatedAt)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_broadcastrecipient_donor ON BroadcastRecipient(DonorID)")
+
+
+def _m10_otp(conn):
+    # server-side OTPs (otp.py), shared by every app process
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS Otp (
+        Purpose TEXT NOT NULL,
+        Email TEXT NOT NULL,
+        Salt TEXT NOT NULL,
+        CodeHash TEXT NOT NULL,
+        ExpiresAt REAL NOT NULL,
+        Attempts INTEGER NOT NULL DEFAULT 0,
+        VerifiedAt REAL,
+        PRIMARY KEY (Purpose, Email)
+    ) WITHOUT ROWID;""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS OtpThrottle (
+        Email TEXT PRIMARY KEY,
+        WindowStart REAL NOT NULL,
+        Sends INTEGER NOT NULL DEFAULT 0,
+        LastSentAt REAL NOT NULL
+    ) WITHOUT ROWID;""")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_otp_expires ON Otp(ExpiresAt)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_otpthrottle_window ON OtpThrottle(WindowStart)")
+
+
+def _m11_name_indexes(conn):
+    # type-ahead pickers: prefix range scans on Name (browse.py)
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_donor_name ON Donor(Name COLLATE NOCASE)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_bank_name ON BloodBank(Name COLLATE NOCASE)")
+
+
+def _m12_search(conn):
+    # external-content FTS5 index per table, kept in sync by triggers (search.py)
+    for idx, table, key, cols in (("DonorSearch", "Donor", "DonorID", ["Name", "City", "Email", "Phone"]),
+                                  ("BankSearch", "BloodBank", "BankID", ["Name", "Address", "City"]),
+                                  ("RequestSearch", "Request", "RequestID", ["PatientName", "City"])):
+        col_list = ", ".join(cols)
+        new_vals = ", ".join(f"NEW.{c}" for c in cols)
+        old_vals = ", ".join(f"OLD.{c}" for c in cols)
+        conn.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS {idx} USING fts5(
+                             {col_list}, content='{table}', content_rowid='{key}', prefix='2 3')""")
+        insert = f"INSERT INTO {idx} (rowid, {col_list}) VALUES (NEW.{key}, {new_vals});"
+        delete = f"INSERT INTO {idx} ({idx}, rowid, {col_list}) VALUES ('delete', OLD.{key}, {old_vals});"
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {idx.lower()}_ai AFTER INSERT ON {table} BEGIN {insert} END")
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {idx.lower()}_ad AFTER DELETE ON {table} BEGIN {delete} END")
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {idx.lower()}_au AFTER UPDATE OF {col_list} ON {table} "
+                     f"BEGIN {delete} {insert} END")
+        conn.execute(f"INSERT INTO {idx} ({idx}) VALUES ('rebuild')")
+    # the pickers search through FTS now; no need to maintain these on every write
+    conn.execute("DROP INDEX IF EXISTS ix_donor_name")
+    conn.execute("DROP INDEX IF EXISTS ix_bank_name")
+
+
+def _m13_inventory_ledger(conn):
+    # stock movements become the source of truth; Inventory is maintained from them (ledger.py)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS InventoryLedger (
+        LedgerID INTEGER PRIMARY KEY AUTOINCREMENT,
+        BankID INTEGER NOT NULL,
+        BloodGroup TEXT NOT NULL,
+        Delta INTEGER NOT NULL,
+        Kind TEXT NOT NULL CHECK(Kind IN ('opening', 'donation', 'assignment', 'correction', 'transfer')),
+        RefID INTEGER,
+        At TEXT NOT NULL,
+        Note TEXT,
+        RecordedAt REAL NOT NULL DEFAULT (strftime('%s', 'now'))
+    );""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS InventorySnapshot (
+        SnapshotID INTEGER PRIMARY KEY AUTOINCREMENT,
+        AsOf TEXT NOT NULL,
+        LedgerID INTEGER NOT NULL,
+        TakenAt REAL NOT NULL
+    );""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS InventorySnapshotUnits (
+        SnapshotID INTEGER NOT NULL,
+        BankID INTEGER NOT NULL,
+        BloodGroup TEXT NOT NULL,
+        Units INTEGER NOT NULL,
+        PRIMARY KEY (SnapshotID, BankID, BloodGroup),
+        FOREIGN KEY (SnapshotID) REFERENCES InventorySnapshot(SnapshotID) ON DELETE CASCADE
+    ) WITHOUT ROWID;""")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_ledger_at ON InventoryLedger(At)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_ledger_stock ON InventoryLedger(BankID, BloodGroup, LedgerID)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_ledger_ref ON InventoryLedger(RefID, Kind)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_snapshot_asof ON InventorySnapshot(AsOf)")
+
+    # whatever Inventory holds today becomes the opening balance (before the trigger exists)
+    conn.execute("""INSERT INTO InventoryLedger (BankID, BloodGroup, Delta, Kind, At, Note)
+                    SELECT BankID, BloodGroup, UnitsAvailable, 'opening', coalesce(LastUpdated, date('now', 'localtime')),
+                           'balance before the ledger'
+                    FROM Inventory WHERE coalesce(UnitsAvailable, 0) != 0 ORDER BY InventoryID""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS ledger_ai AFTER INSERT ON InventoryLedger BEGIN
+                        INSERT INTO Inventory (BankID, BloodGroup, UnitsAvailable, LastUpdated)
+                        VALUES (NEW.BankID, NEW.BloodGroup, NEW.Delta, substr(NEW.At, 1, 10))
+                        ON CONFLICT (BankID, BloodGroup) DO UPDATE SET
+                            UnitsAvailable = coalesce(UnitsAvailable, 0) + excluded.UnitsAvailable,
+                            LastUpdated = max(coalesce(LastUpdated, ''), excluded.LastUpdated);
+                    END""")
+    for op in ("UPDATE", "DELETE"):
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS ledger_no_{op.lower()} BEFORE {op} ON InventoryLedger BEGIN
+                             SELECT RAISE(ABORT, 'InventoryLedger is append-only; record a correction instead');
+                         END""")
+
+
+def _m14_import_dedupe_indexes(conn):
+    # bulk import (imports.py) checks every incoming donor/bank against these
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_donor_email ON Donor(lower(Email))")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_donor_phone ON Donor(Phone)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_bank_name_city ON BloodBank(lower(Name), lower(City))")
+
+
+def _m15_donor_map_cells(conn):
+    # donors per ~10 km grid cell (zoom 12) and blood group for the map (browse.py);
+    # SumLat/SumLon give the centroid
+    conn.execute("""CREATE TABLE IF NOT EXISTS DonorMapCell (
+        Y INTEGER NOT NULL, X INTEGER NOT NULL, BloodGroup TEXT NOT NULL,
+        N INTEGER NOT NULL, SumLat REAL NOT NULL, SumLon REAL NOT NULL,
+        PRIMARY KEY (Y, X, BloodGroup)) WITHOUT ROWID""")
+
+    def cell(prefix=""):
+        s = repr(2 ** 12 / 360)
+        return f"CAST(({prefix}Latitude + 90) * {s} AS INTEGER), CAST(({prefix}Longitude + 180) * {s} AS INTEGER)"
+    located = "Latitude IS NOT NULL AND Longitude IS NOT NULL AND NOT (Latitude = 0 AND Longitude = 0)"
+    row = {p: located.replace("Latitude", f"{p}.Latitude").replace("Longitude", f"{p}.Longitude") for p in ("NEW", "OLD")}
+    add = f"""INSERT INTO DonorMapCell SELECT {cell("NEW.")}, NEW.BloodGroup, 1, NEW.Latitude, NEW.Longitude WHERE {row["NEW"]}
+              ON CONFLICT DO UPDATE SET N = N + 1, SumLat = SumLat + excluded.SumLat, SumLon = SumLon + excluded.SumLon;"""
+    key = f"(Y, X, BloodGroup) = ({cell('OLD.')}, OLD.BloodGroup)"
+    remove = f"""UPDATE DonorMapCell SET N = N - 1, SumLat = SumLat - OLD.Latitude, SumLon = SumLon - OLD.Longitude
+                 WHERE {key} AND {row["OLD"]};
+                 DELETE FROM DonorMapCell WHERE {key} AND N <= 0;"""
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS DonorMapCell_ai AFTER INSERT ON Donor BEGIN {add} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS DonorMapCell_ad AFTER DELETE ON Donor BEGIN {remove} END")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS DonorMapCell_au AFTER UPDATE OF Latitude, Longitude, BloodGroup ON Donor
+                     BEGIN {remove} {add} END""")
+    conn.execute("DELETE FROM DonorMapCell")
+    conn.execute(f"""INSERT INTO DonorMapCell SELECT {cell()}, BloodGroup, COUNT(*), SUM(Latitude), SUM(Longitude)
+                     FROM Donor WHERE {located} GROUP BY 1, 2, 3""")
+
+
+def _m16_daily_rollups(conn):
+    # donated/issued/other units per day, bank and group (forecast.py); a
+    # correction pointing at a donation is a deleted donation taken back
+    donated = "NEW.Kind = 'donation' OR (NEW.Kind = 'correction' AND NEW.RefID IS NOT NULL)"
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS DailyStock (
+        Day TEXT NOT NULL,
+        BankID INTEGER NOT NULL,
+        BloodGroup TEXT NOT NULL,
+        Donated INTEGER NOT NULL DEFAULT 0,
+        Issued INTEGER NOT NULL DEFAULT 0,
+        Other INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (Day, BankID, BloodGroup)
+    ) WITHOUT ROWID;""")
+    conn.execute(f"""CREATE TRIGGER IF NOT EXISTS dailystock_ai AFTER INSERT ON InventoryLedger BEGIN
+                        INSERT INTO DailyStock (Day, BankID, BloodGroup, Donated, Issued, Other)
+                        VALUES (substr(NEW.At, 1, 10), NEW.BankID, NEW.BloodGroup,
+                                CASE WHEN {donated} THEN NEW.Delta ELSE 0 END,
+                                CASE WHEN NEW.Kind = 'assignment' THEN -NEW.Delta ELSE 0 END,
+                                CASE WHEN {donated} OR NEW.Kind = 'assignment' THEN 0 ELSE NEW.Delta END)
+                        ON CONFLICT DO UPDATE SET Donated = Donated + excluded.Donated,
+                            Issued = Issued + excluded.Issued, Other = Other + excluded.Other;
+                    END""")
+    donated = donated.replace("NEW.", "")
+    conn.execute("DELETE FROM DailyStock")
+    conn.execute(f"""INSERT INTO DailyStock (Day, BankID, BloodGroup, Donated, Issued, Other)
+                     SELECT substr(At, 1, 10), BankID, BloodGroup,
+                            SUM(CASE WHEN {donated} THEN Delta ELSE 0 END),
+                            SUM(CASE WHEN Kind = 'assignment' THEN -Delta ELSE 0 END),
+                            SUM(CASE WHEN {donated} OR Kind = 'assignment' THEN 0 ELSE Delta END)
+                     FROM InventoryLedger GROUP BY 1, 2, 3""")
+
+
+# lot_ai as of versions 17 and 18 (lots.py): which lots a movement takes, FEFO
+# with a running total (see lots._FEFO, the same query for plan()), and how it
+# books them. {expired} is version 18's extra condition on the expired-lot pass.
+_OWN = "NEW.Kind = 'correction' AND NEW.RefID IS NOT NULL AND DonationID = NEW.RefID"
+_LOT_TRIGGER = f"""CREATE TRIGGER IF NOT EXISTS lot_ai AFTER INSERT ON InventoryLedger BEGIN
+                        INSERT INTO LotMovement (LedgerID, LotID, Units)
+                        SELECT NEW.LedgerID, LotID, -Units FROM (SELECT LotID, ExpiresOn, min(Remaining, -NEW.Delta - (Taken - Remaining)) AS Units
+            FROM (SELECT LotID, ExpiresOn, Remaining, SUM(Remaining) OVER (ORDER BY Pass, ExpiresOn, LotID) AS Taken
+                  FROM (SELECT 0 AS Pass, LotID, ExpiresOn, Remaining FROM Lot INDEXED BY ix_lot_donation
+                        WHERE {_OWN} AND BankID = NEW.BankID AND BloodGroup = NEW.BloodGroup AND Remaining > 0
+                        UNION ALL
+                        SELECT * FROM (SELECT 1, LotID, ExpiresOn, Remaining FROM Lot INDEXED BY ix_lot_fefo
+                                       WHERE BankID = NEW.BankID AND BloodGroup = NEW.BloodGroup AND Remaining > 0
+                                         AND ExpiresOn > substr(NEW.At, 1, 10) AND NEW.Kind != 'expiry' AND NOT coalesce({_OWN}, 0)
+                                       ORDER BY ExpiresOn, LotID LIMIT -NEW.Delta)
+                        UNION ALL
+                        SELECT * FROM (SELECT 2, LotID, ExpiresOn, Remaining FROM Lot INDEXED BY ix_lot_fefo
+                                       WHERE BankID = NEW.BankID AND BloodGroup = NEW.BloodGroup AND Remaining > 0
+                                         AND ExpiresOn <= substr(NEW.At, 1, 10){{expired}} AND NOT coalesce({_OWN}, 0)
+                                       ORDER BY ExpiresOn, LotID LIMIT -NEW.Delta)))
+            WHERE Taken - Remaining < -NEW.Delta) WHERE NEW.Delta < 0;
+
+                        INSERT INTO LotMovement (LedgerID, LotID, Units)
+                        SELECT NEW.LedgerID, m.LotID, -SUM(m.Units)
+                        FROM InventoryLedger l JOIN LotMovement m ON m.LedgerID = l.LedgerID
+                        WHERE NEW.Delta > 0 AND NEW.Kind = 'assignment' AND l.RefID = NEW.RefID AND l.Kind = 'assignment'
+                          AND l.BankID = NEW.BankID AND l.BloodGroup = NEW.BloodGroup
+                        GROUP BY m.LotID HAVING SUM(m.Units) < 0;
+
+                        UPDATE Lot SET Remaining = Remaining + m.Units
+                        FROM (SELECT LotID, Units FROM LotMovement WHERE LedgerID = NEW.LedgerID) AS m
+                        WHERE Lot.LotID = m.LotID;
+
+                        INSERT INTO Lot (BankID, BloodGroup, DonationID, CollectedOn, ExpiresOn, Units, Remaining, LedgerID)
+                        SELECT NEW.BankID, NEW.BloodGroup, l.DonationID, l.CollectedOn, l.ExpiresOn, -m.Units, -m.Units, NEW.LedgerID
+                        FROM LotMovement m JOIN Lot l ON l.LotID = m.LotID
+                        WHERE NEW.Delta > 0 AND NEW.Kind = 'transfer' AND m.LedgerID = NEW.RefID;
+
+                        INSERT INTO Lot (BankID, BloodGroup, DonationID, CollectedOn, ExpiresOn, Units, Remaining, LedgerID)
+                        SELECT NEW.BankID, NEW.BloodGroup, CASE WHEN NEW.Kind = 'donation' THEN NEW.RefID END,
+                               substr(NEW.At, 1, 10), date(NEW.At, '+42 days'), n, n, NEW.LedgerID
+                        FROM (SELECT NEW.Delta
+                                     - (SELECT coalesce(SUM(Units), 0) FROM LotMovement WHERE LedgerID = NEW.LedgerID)
+                                     - (SELECT coalesce(SUM(Units), 0) FROM Lot WHERE LedgerID = NEW.LedgerID) AS n)
+                        WHERE NEW.Delta > 0 AND n > 0;
+                    END"""
+
+
+def _m17_blood_lots(conn):
+    # new ledger kind 'expiry' (CHECK constraint), then per-lot stock with
+    # expiry dates, 42 days after collection (lots.py)
+    _rebuild(conn, "InventoryLedger", """
+    CREATE TABLE IF NOT EXISTS {table} (
+        LedgerID INTEGER PRIMARY KEY AUTOINCREMENT,
+        BankID INTEGER NOT NULL,
+        BloodGroup TEXT NOT NULL,
+        Delta INTEGER NOT NULL,
+        Kind TEXT NOT NULL CHECK(Kind IN ('opening', 'donation', 'assignment', 'correction', 'transfer', 'expiry')),
+        RefID INTEGER,
+        At TEXT NOT NULL,
+        Note TEXT,
+        RecordedAt REAL NOT NULL DEFAULT (strftime('%s', 'now'))
+    );""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS Lot (
+        LotID INTEGER PRIMARY KEY AUTOINCREMENT,
+        BankID INTEGER NOT NULL,
+        BloodGroup TEXT NOT NULL,
+        DonationID INTEGER,
+        CollectedOn TEXT NOT NULL,
+        ExpiresOn TEXT NOT NULL,
+        Units INTEGER NOT NULL,
+        Remaining INTEGER NOT NULL CHECK(Remaining >= 0),
+        LedgerID INTEGER,
+        FOREIGN KEY (BankID) REFERENCES BloodBank(BankID) ON DELETE CASCADE
+    );""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS LotMovement (
+        LedgerID INTEGER NOT NULL,
+        LotID INTEGER NOT NULL,
+        Units INTEGER NOT NULL,
+        PRIMARY KEY (LedgerID, LotID)
+    ) WITHOUT ROWID;""")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_lot_fefo ON Lot(BankID, BloodGroup, ExpiresOn, LotID) WHERE Remaining > 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_lot_expiry ON Lot(ExpiresOn) WHERE Remaining > 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_lot_donation ON Lot(DonationID) WHERE DonationID IS NOT NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_lot_ledger ON Lot(LedgerID)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_lot_bank ON Lot(BankID)")
+
+    # stock that predates lot tracking: with FEFO the units on the shelf are the
+    # latest ones in, so each pair's stock is matched to its newest donations
+    # (at most one per unit, read backwards through ix_ledger_stock); whatever
+    # they don't cover becomes one lot dated by Inventory.LastUpdated
+    if not conn.execute("SELECT 1 FROM Lot LIMIT 1").fetchone():
+        stock = conn.execute("""SELECT i.BankID, i.BloodGroup, i.UnitsAvailable, coalesce(substr(i.LastUpdated, 1, 10), date('now', 'localtime'))
+                                FROM Inventory i JOIN BloodBank b ON b.BankID = i.BankID WHERE i.UnitsAvailable > 0""").fetchall()
+        out = []
+        for bank, group, units, updated in stock:
+            for ref, day, delta in conn.execute("""SELECT RefID, substr(At, 1, 10), Delta FROM InventoryLedger INDEXED BY ix_ledger_stock
+                                                   WHERE BankID = ? AND BloodGroup = ? AND Kind = 'donation' AND Delta > 0
+                                                   ORDER BY LedgerID DESC LIMIT ?""", (bank, group, units)):
+                n = min(delta, units)
+                out.append((bank, group, ref, day, day, delta, n))
+                units -= n
+                if not units:
+                    break
+            if units:
+                out.append((bank, group, None, updated, updated, units, units))
+        out.reverse()              # oldest first, so LotIDs follow collection order
+        conn.executemany("""INSERT INTO Lot (BankID, BloodGroup, DonationID, CollectedOn, ExpiresOn, Units, Remaining)
+                            VALUES (?, ?, ?, ?, date(?, '+42 days'), ?, ?)""", out)
+    # LotMovement holds what a movement took from (or gave back to) existing lots;
+    # lots it created carry its LedgerID
+    conn.execute(_LOT_TRIGGER.format(expired=""))
+
+
+def _m18_lot_trigger_expiry_only(conn):
+    # lot_ai drew on expired lots for any movement short of unexpired stock;
+    # they are now used only by 'expiry' write-offs
+    conn.execute("DROP TRIGGER IF EXISTS lot_ai")
+    conn.execute(_LOT_TRIGGER.format(expired=" AND NEW.Kind = 'expiry'"))
+
+
+def _m19_blank_sent_mail(conn):
+    # mailer.py now blanks a message's body once it is sent or failed; clear
+    # the ones already done (OTP mails hold the code in clear)
+    conn.execute("UPDATE Outbox SET Body = '' WHERE Status IN ('sent', 'failed')")
+
+
+def _m20_drop_name_indexes(conn):
+    # the NOCASE name indexes of version 11 have no reader: the pickers search
+    # through FTS and the name-ordered lists use the default collation. Version
+    # 12 already drops them; kept as its own step so the end state doesn't
+    # depend on that
+    conn.execute("DROP INDEX IF EXISTS ix_donor_name")
+    conn.execute("DROP INDEX IF EXISTS ix_bank_name")
+
+
+MIGRATIONS = [
+    (1, "base tables", _m1_base_tables),
+    (2, "unique Inventory (BankID, BloodGroup)", _m2_inventory_unique),
+    (3, "Request.Email and CHECK constraints", _m3_schema_drift),
+    (4, "hot-path indexes", _m4_hot_path_indexes),
+    (5, "R*Tree spatial index for donors and banks", _m5_spatial_index),
+    (6, "trigger-maintained dashboard stats", _m6_dashboard_stats),
+    (7, "index for the inactive donor report", _m7_last_donation_index),
+    (8, "Outbox email queue", _m8_outbox),
+    (9, "emergency broadcast recipients", _m9_broadcasts),
+    (10, "server-side OTP store", _m10_otp),
+    (11, "name indexes for the donor/bank pickers", _m11_name_indexes),
+    (12, "FTS5 search over donors, banks and requests", _m12_search),
+    (13, "append-only inventory ledger and snapshots", _m13_inventory_ledger),
+    (14, "donor email/phone and bank name indexes for imports", _m14_import_dedupe_indexes),
+    (15, "per-cell donor counts for the map", _m15_donor_map_cells),
+    (16, "daily donated/issued rollups for forecasting", _m16_daily_rollups),
+    (17, "blood lots with expiry dates (FEFO)", _m17_blood_lots),
+    (18, "expired lots only for write-offs", _m18_lot_trigger_expiry_only),
+    (19, "blank the bodies of sent and failed mail", _m19_blank_sent_mail),
+    (20, "drop the unused name indexes", _m20_drop_name_indexes),
+]
+LATEST = MIGRATIONS[-1][0]
+
+
+def schema_version():
+    return fetch_one("PRAGMA user_version")[0]
+
+
+def migrate():
+    """Apply pending migrations. Returns the schema version afterwards."""
+    start = schema_version()
+    if start >= LATEST:
+        return start
+    with get_conn() as conn:
+        # table rebuilds need FK enforcement off; it can only change outside a transaction
+        conn.execute("PRAGMA foreign_keys = OFF")
+        try:
+            for version, _desc, fn in MIGRATIONS:
+                if version <= start:
+                    continue
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    # re-read under the write lock: another process may have migrated already
+                    if conn.execute("PRAGMA user_version").fetchone()[0] < version:
+                        fn(conn)
+                        conn.execute(f"PRAGMA user_version = {version}")
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+        finally:
+            conn.execute("PRAGMA foreign_keys = ON")
+    invalidate_cache()             # new tables, triggers and cascades
+    return LATEST
+
+
+def reset_schema():
+    """Drop every table and re-run all migrations (Admin reset)."""
+    with get_conn() as conn:
+        conn.execute("PRAGMA foreign_keys = OFF")
+        try:
+            names = [r["name"] for r in fetch_all(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")]
+            for t in names:
+                # virtual tables' shadow tables go away with their parent
+                if fetch_one("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (t,)):
+                    run_write(f"DROP TABLE IF EXISTS {t}")
+            run_write("PRAGMA user_version = 0")
+        finally:
+            conn.execute("PRAGMA foreign_keys = ON")
+    return migrate()
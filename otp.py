@@ -0,0 +1,190 @@
+# otp.py
+# One-time passcodes shared by every app process. Codes live in the Otp table
+# (see migrations.py) as salted HMAC-SHA256 hashes, one row per (purpose,
+# email), so a user can request a code on one replica and verify it on
+# another. Each process keeps a small TTL cache of the codes it issued to skip
+# the lookup on the common path; the table stays the source of truth.
+# Sends are throttled per email and wrong guesses are capped per code.
+# A correct code is swapped for a one-time token (its hash replaces the code's
+# in the row); the session that verified keeps the token, so nobody else can
+# ride on an email verified in another browser.
+import hashlib
+import heapq
+import hmac
+import secrets
+import threading
+import time
+from db import transaction, run_write, fetch_one
+
+OTP_DIGITS = 6
+OTP_TTL_SECONDS = 300
+VERIFIED_TTL_SECONDS = 900         # a verified email stays usable for this long
+MAX_ATTEMPTS = 5                   # wrong guesses before the code is burned
+RESEND_COOLDOWN_SECONDS = 60       # minimum gap between codes to one email
+MAX_SENDS_PER_HOUR = 5             # per email, across purposes and processes
+SWEEP_SECONDS = 60                 # delete expired rows at most this often
+
+
+class TTLCache:
+    """dict with per-key expiry; expired keys are dropped from a heap, oldest first."""
+
+    def __init__(self, max_items=10000):
+        self.max_items = max_items
+        self.items = {}
+        self.heap = []
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None or item[0] <= time.time():
+                return None
+            return item[1]
+
+    def set(self, key, value, ttl):
+        expires = time.time() + ttl
+        with self.lock:
+            self.items[key] = (expires, value)
+            heapq.heappush(self.heap, (expires, key))
+            self._sweep()
+
+    def pop(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def _sweep(self):
+        # each heap entry is popped once, so sweeping is O(1) amortised per set()
+        now = time.time()
+        while self.heap and (self.heap[0][0] <= now or len(self.items) > self.max_items):
+            expires, key = heapq.heappop(self.heap)
+            item = self.items.get(key)
+            if item is not None and item[0] == expires:
+                del self.items[key]
+        if len(self.heap) > 2 * len(self.items) + 64:
+            # drop entries superseded by a later set() of the same key
+            self.heap = [(e, k) for e, k in self.heap if self.items.get(k, (None,))[0] == e]
+            heapq.heapify(self.heap)
+
+
+_cache = TTLCache()
+_last_sweep = [0.0]
+
+
+def _norm(email):
+    return (email or "").strip().lower()
+
+
+def _hash(salt, code):
+    return hmac.new(salt.encode(), code.encode(), hashlib.sha256).hexdigest()
+
+
+def generate_otp():
+    return f"{secrets.randbelow(10 ** OTP_DIGITS):0{OTP_DIGITS}d}"
+
+
+def sweep_expired():
+    """Delete expired codes and stale throttle rows (uses the ExpiresAt / WindowStart indexes)."""
+    now = time.time()
+    _last_sweep[0] = now
+    with transaction() as conn:
+        conn.execute("DELETE FROM Otp WHERE ExpiresAt < ?", (now,))
+        conn.execute("DELETE FROM OtpThrottle WHERE WindowStart < ?", (now - 3600,))
+
+
+def issue_otp(purpose, email, ttl=OTP_TTL_SECONDS):
+    """Create (or replace) the code for purpose/email.
+
+    Returns (ok, msg, code); code is None when the email is throttled.
+    """
+    email = _norm(email)
+    now = time.time()
+    if now - _last_sweep[0] > SWEEP_SECONDS:
+        sweep_expired()
+    code = generate_otp()
+    salt = secrets.token_hex(8)
+    with transaction() as conn:
+        row = conn.execute("SELECT WindowStart, Sends, LastSentAt FROM OtpThrottle WHERE Email = ?", (email,)).fetchone()
+        if row:
+            window, sends, last = row
+            if now - last < RESEND_COOLDOWN_SECONDS:
+                return False, f"Please wait {int(RESEND_COOLDOWN_SECONDS - (now - last)) + 1}s before requesting another code", None
+            if now - window < 3600 and sends >= MAX_SENDS_PER_HOUR:
+                return False, "Too many codes requested for this email; try again later", None
+            if now - window >= 3600:
+                window, sends = now, 0
+        else:
+            window, sends = now, 0
+        conn.execute("""INSERT INTO OtpThrottle (Email, WindowStart, Sends, LastSentAt) VALUES (?,?,?,?)
+                        ON CONFLICT (Email) DO UPDATE SET WindowStart = excluded.WindowStart,
+                            Sends = excluded.Sends, LastSentAt = excluded.LastSentAt""", (email, window, sends + 1, now))
+        conn.execute("""INSERT OR REPLACE INTO Otp (Purpose, Email, Salt, CodeHash, ExpiresAt, Attempts, VerifiedAt)
+                        VALUES (?,?,?,?,?,0,NULL)""", (purpose, email, salt, _hash(salt, code), now + ttl))
+    _cache.set((purpose, email), (salt, _hash(salt, code)), ttl)
+    return True, "OTP created", code
+
+
+def verify_otp(purpose, email, code):
+    """Check a code. Returns (ok, msg, token); on success the email counts as
+    verified for VERIFIED_TTL_SECONDS, for whoever holds the token (see
+    is_verified / consume_verification). token is None on failure."""
+    email = _norm(email)
+    code = (code or "").strip()
+    now = time.time()
+    key = (purpose, email)
+    token = secrets.token_urlsafe(16)
+    cached = _cache.get(key)
+    if cached and hmac.compare_digest(_hash(cached[0], code), cached[1]):
+        # fast path: our own code matched; the WHERE makes sure it's still the live, unburned one
+        cur = run_write("""UPDATE Otp SET VerifiedAt = ?, ExpiresAt = ?, CodeHash = ? WHERE Purpose = ? AND Email = ?
+                           AND CodeHash = ? AND VerifiedAt IS NULL AND ExpiresAt >= ? AND Attempts < ?""",
+                        (now, now + VERIFIED_TTL_SECONDS, _hash(cached[0], token), purpose, email, cached[1], now, MAX_ATTEMPTS))
+        if cur.rowcount:
+            _cache.pop(key)
+            return True, "OTP verified", token
+    with transaction() as conn:
+        row = conn.execute("""SELECT Salt, CodeHash, ExpiresAt, Attempts, VerifiedAt FROM Otp
+                              WHERE Purpose = ? AND Email = ?""", (purpose, email)).fetchone()
+        if not row:
+            return False, "No OTP requested for this email", None
+        if row[4] is not None:
+            return False, "OTP already used", None
+        salt, code_hash, expires, attempts, _ = row
+        if expires < now:
+            conn.execute("DELETE FROM Otp WHERE Purpose = ? AND Email = ?", (purpose, email))
+            _cache.pop(key)
+            return False, "OTP expired", None
+        if attempts >= MAX_ATTEMPTS:
+            conn.execute("DELETE FROM Otp WHERE Purpose = ? AND Email = ?", (purpose, email))
+            _cache.pop(key)
+            return False, "Too many wrong attempts; request a new OTP", None
+        if hmac.compare_digest(_hash(salt, code), code_hash):
+            conn.execute("UPDATE Otp SET VerifiedAt = ?, ExpiresAt = ?, CodeHash = ? WHERE Purpose = ? AND Email = ?",
+                         (now, now + VERIFIED_TTL_SECONDS, _hash(salt, token), purpose, email))
+            _cache.pop(key)
+            return True, "OTP verified", token
+        conn.execute("UPDATE Otp SET Attempts = Attempts + 1 WHERE Purpose = ? AND Email = ?", (purpose, email))
+    left = MAX_ATTEMPTS - attempts - 1
+    return False, f"Incorrect OTP ({left} attempt{'s' if left != 1 else ''} left)", None
+
+
+def _verified_hash(purpose, email, token):
+    # the row's hash when `token` is the one verify_otp handed out for it, else None
+    if not token:
+        return None
+    row = fetch_one("""SELECT Salt, CodeHash FROM Otp WHERE Purpose = ? AND Email = ?
+                       AND VerifiedAt IS NOT NULL AND ExpiresAt >= ?""", (purpose, _norm(email), time.time()))
+    if row and hmac.compare_digest(_hash(row[0], token), row[1]):
+        return row[1]
+    return None
+
+
+def is_verified(purpose, email, token):
+    """True if `token` (from verify_otp) still vouches for purpose/email."""
+    return _verified_hash(purpose, email, token) is not None
+
+
+def consume_verification(purpose, email, token):
+    """Use up a verification (call after the guarded action succeeds)."""
+    code_hash = _verified_hash(purpose, email, token)
+    if code_hash:
+        run_write("DELETE FROM Otp WHERE Purpose = ? AND Email = ? AND CodeHash = ?", (purpose, _norm(email), code_hash))
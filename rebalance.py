@@ -0,0 +1,294 @@
+# rebalance.py
+# Which bank should ship what to whom, so that banks below their target stock
+# are topped up from banks with units to spare.
+# Every (bank, group) with an Inventory row has a target: the dashboard's
+# low-stock threshold, or COVER_DAYS of its forecast issue rate (forecast.py)
+# when that is higher. Units above target are surplus, units below it are a
+# shortfall. A shortfall can be covered by any compatible group, at the same
+# km penalty the request matcher charges for substitutes (matching.PENALTY),
+# and a unit shipped costs the distance it travels. A bank's own surplus of a
+# compatible group is the cheapest cover of all (0 km, no transfer), so units
+# shipped as a substitute aren't shipped on again by the next plan.
+# That is a min-cost transport problem, solved with a forward auction
+# (Bertsekas): the units on the scarcer side (short or surplus) bid for units
+# on the other, each raising its best option's price by how much better it is
+# than its second best, until nobody is outbid. Every short unit is offered
+# the ARCS cheapest (bank, group) options among its NEAR_BANKS closest surplus
+# banks; shortfalls whose options all run dry then scan every surplus bank in
+# range. plan() writes off expired lots first (lots.retire_expired) so they
+# never count as surplus; apply() books the moves as ledger transfers in one
+# transaction.
+#   python rebalance.py              print the plan
+#   python rebalance.py apply        ...and book it
+import math
+import time
+import numpy as np
+from db import fetch_columns, fetch_one, transaction
+from forecast import forecast
+from geo import distance_matrix_km
+from ledger import transfer
+from lots import retire_expired
+from matching import BLOOD_GROUPS, GROUP_INDEX, PENALTY
+from stats import DEFAULT_LOW_THRESHOLD
+
+COVER_DAYS = 7                     # target stock: this many days of forecast issues (at least the low threshold)
+MAX_KM = 1000                      # never ship farther than this
+NEAR_BANKS = 32                    # closest surplus banks considered per short bank
+ARCS = 32                          # cheapest (bank, group) options offered per shortfall
+CHUNK = 1024                       # short banks per distance block (bounds memory)
+EPS_KM = 1.0                       # smallest bid raise; each unit placed is within this of its cheapest cover
+PATIENCE = 200                     # auction rounds before the bid raise starts doubling...
+DOUBLE_EVERY = 50                  # ...every this many rounds (ends price wars over the last few units)
+
+
+def _auction(bidder, item, value, count, size):
+    """Forward auction on a bipartite graph of identical units.
+
+    One entry per arc in bidder/item/value: a unit of node bidder[a] gains
+    value[a] by taking a unit of node item[a] (staying out gains 0). count[b]
+    units bid at node b, size[i] units are on offer at node i. Returns the
+    number of units that end up on each arc.
+    """
+    order = np.argsort(bidder, kind="stable")
+    bidder, item, value = bidder[order], item[order], value[order]
+    start = np.searchsorted(bidder, np.arange(len(count) + 1))
+    # a node can't win more units than its arcs reach; the rest stay out without a fight
+    count = np.minimum(count, np.bincount(bidder, size[item], minlength=len(count)).astype(np.int64))
+    who = np.repeat(np.arange(len(count)), count)
+    first = np.concatenate([[0], np.cumsum(size)])      # units of item node i: first[i]:first[i+1], cheapest first
+    unit_node = np.repeat(np.arange(len(size)), size)
+    price = np.zeros(len(unit_node))
+    owner = np.full(len(unit_node), -1)
+    held = np.full(len(who), -1)                        # unit held by each bidder, -1 free, -2 out
+    arc = np.zeros(len(who), dtype=np.int64)
+
+    def spans(starts, ends):
+        n = ends - starts
+        base = np.cumsum(n) - n
+        return np.arange(n.sum()) - np.repeat(base, n) + np.repeat(starts, n), base, n
+
+    rounds = 0
+    while True:
+        free = np.flatnonzero(held == -1)
+        if not len(free):
+            break
+        step = EPS_KM * 2.0 ** max(0, (rounds - PATIENCE) // DOUBLE_EVERY)
+        rounds += 1
+        cheapest = price[first[:-1]]
+        a, base, n = spans(start[who[free]], start[who[free] + 1])
+        seg = np.repeat(np.arange(len(free)), n)
+        gain = value[a] - cheapest[item[a]]
+        best = np.maximum.reduceat(gain, base)
+        top = np.flatnonzero(gain == best[seg])
+        top = top[np.r_[True, seg[top[1:]] != seg[top[:-1]]]]
+        pick = a[top]
+        gain[top] = -np.inf
+        second = np.maximum(np.maximum.reduceat(gain, base), 0.0)
+        out = best < 0
+        held[free[out]] = -2
+        free, pick = free[~out], pick[~out]
+        node = item[pick]
+        bid = cheapest[node] + (best - second)[~out] + step
+
+        # the k highest bids on a node take its k cheapest units, at one clearing price
+        o = np.lexsort((-bid, node))
+        free, pick, node, bid = free[o], pick[o], node[o], bid[o]
+        grp = np.flatnonzero(np.r_[True, node[1:] != node[:-1]])
+        rank = np.arange(len(node)) - np.repeat(grp, np.diff(np.r_[grp, len(node)]))
+        unit = first[node] + np.minimum(rank, size[node] - 1)
+        ok = (rank < size[node]) & (bid >= price[unit] + step / 2)
+        free, pick, node, bid, unit = free[ok], pick[ok], node[ok], bid[ok], unit[ok]
+        k = np.bincount(node, minlength=len(size))
+        untaken = np.where(k < size, price[np.minimum(first[:-1] + k, len(price) - 1)], np.inf)
+        low = np.full(len(size), np.inf)
+        np.minimum.at(low, node, bid)
+        lost = owner[unit]
+        held[lost[lost >= 0]] = -1
+        owner[unit], held[free], arc[free] = free, unit, pick
+        price[unit] = np.minimum(low, untaken + step)[node]
+
+        touched = np.unique(node)
+        u, _, _ = spans(first[touched], first[touched + 1])
+        o = u[np.lexsort((price[u], unit_node[u]))]
+        price[u], owner[u] = price[o], owner[o]
+        mine = owner[u] >= 0
+        held[owner[u][mine]] = u[mine]
+    return np.bincount(order[arc[held >= 0]], minlength=len(order))
+
+
+def _solve(lat, lon, units, target, max_km=MAX_KM):
+    """Transport plan on (bank x group) arrays.
+
+    lat/lon: (B,) with NaN for unknown coordinates (such banks are skipped);
+    units/target: (B, G) stock and target stock, target 0 where the bank
+    doesn't carry the group.
+    Returns (moves, unmet): moves is [(from, to, group shipped, group short,
+    units, km)] with bank and group indexes (from == to: covered from the
+    bank's own surplus), unmet is short minus what the plan covers.
+    """
+    n_grp = units.shape[1]
+    left = np.maximum(units - target, 0).astype(np.int64)
+    unmet = np.maximum(target - units, 0).astype(np.int64)
+    left[np.isnan(lat) | np.isnan(lon)] = 0
+    supply = np.flatnonzero(left.any(axis=1))
+    node_bank, node_grp = np.nonzero(unmet)
+    if not len(supply) or not len(node_bank):
+        return [], unmet
+    short_banks, node_row = np.unique(node_bank, return_inverse=True)
+    # substitutes only arrive as a group the bank carries and isn't short of
+    # itself; otherwise they would just count as that group's stock
+    blocked = (unmet[node_bank] > 0) | (target[node_bank] == 0)
+    blocked[np.arange(len(node_bank)), node_grp] = False
+
+    # nearest surplus banks of every short bank, one block of rows at a time
+    k = min(NEAR_BANKS, len(supply))
+    near = np.zeros((len(short_banks), k), dtype=np.int64)
+    near_km = np.full((len(short_banks), k), np.inf)
+    for lo in range(0, len(short_banks), CHUNK):
+        rows = short_banks[lo:lo + CHUNK]
+        d = distance_matrix_km(lat[rows], lon[rows], lat[supply], lon[supply])
+        d[np.isnan(d) | (d > max_km)] = np.inf
+        idx = np.argpartition(d, k - 1, axis=1)[:, :k] if k < len(supply) else \
+            np.broadcast_to(np.arange(k), (len(rows), k))
+        near[lo:lo + len(rows)] = supply[idx]
+        near_km[lo:lo + len(rows)] = np.take_along_axis(d, idx, axis=1)
+
+    # arcs: each shortfall's ARCS cheapest surplus (bank, group) nodes
+    src_bank, src_grp = np.nonzero(left)
+    src = np.full(left.shape, -1)
+    src[src_bank, src_grp] = np.arange(len(src_bank))
+    n_node = len(node_bank)
+    kk = min(ARCS, k * n_grp)
+    arc_node, arc_src, arc_cost = [], [], []
+    for lo in range(0, n_node, CHUNK):
+        hi = min(lo + CHUNK, n_node)
+        nb, r = near[node_row[lo:hi]], node_row[lo:hi]
+        cost = near_km[r][:, :, None] + PENALTY[node_grp[lo:hi]][:, None, :]
+        cost[(left[nb] == 0) | blocked[lo:hi, None, :]] = np.inf
+        cost = cost.reshape(hi - lo, -1)
+        part = np.argpartition(cost, kk - 1, axis=1)[:, :kk]
+        c = np.take_along_axis(cost, part, axis=1)
+        rows, cols = np.nonzero(np.isfinite(c))
+        part = part[rows, cols]
+        arc_node.append(rows + lo)
+        arc_src.append(src[nb[rows, part // n_grp], part % n_grp])
+        arc_cost.append(c[rows, cols])
+    arc_node, arc_src, arc_cost = np.concatenate(arc_node), np.concatenate(arc_src), np.concatenate(arc_cost)
+
+    # a shortfall left open costs more than any one shipment, so covering comes first
+    value = max_km + PENALTY[np.isfinite(PENALTY)].max() + 1 - arc_cost
+    need, have = unmet[node_bank, node_grp], left[src_bank, src_grp]
+    if need.sum() <= have.sum():
+        flow = _auction(arc_node, arc_src, value, need, have)
+    else:
+        flow = _auction(arc_src, arc_node, value, have, need)
+
+    moves = []
+    for a in np.flatnonzero(flow).tolist():
+        n, s, i = int(flow[a]), arc_src[a], arc_node[a]
+        b, g, to, h = int(src_bank[s]), int(src_grp[s]), int(node_bank[i]), int(node_grp[i])
+        left[b, g] -= n
+        unmet[to, h] -= n
+        moves.append((b, to, g, h, n, float(arc_cost[a] - PENALTY[h, g])))
+
+    # shortfalls whose options all went to others: every bank in range with units left
+    left_by_group = left.sum(axis=0)
+    for i in np.flatnonzero(unmet[node_bank, node_grp]).tolist():
+        to, h = int(node_bank[i]), int(node_grp[i])
+        donors = np.flatnonzero(np.isfinite(PENALTY[h]) & ~blocked[i])
+        if not left_by_group[donors].sum():
+            continue
+        live = supply[left[supply][:, donors].any(axis=1)]
+        d = distance_matrix_km(lat[[to]], lon[[to]], lat[live], lon[live])[0]
+        d[np.isnan(d) | (d > max_km)] = np.inf
+        cost = d[:, None] + PENALTY[h, donors][None, :]
+        cost[left[live][:, donors] == 0] = np.inf
+        cand = np.flatnonzero(np.isfinite(cost))
+        for j in cand[np.argsort(cost.flat[cand], kind="stable")].tolist():
+            b, g = live[j // len(donors)], donors[j % len(donors)]
+            n = min(int(unmet[to, h]), int(left[b, g]))
+            left[b, g] -= n
+            left_by_group[g] -= n
+            unmet[to, h] -= n
+            moves.append((int(b), to, int(g), h, n, float(d[j // len(donors)])))
+            if not unmet[to, h]:
+                break
+    moves.sort(key=lambda m: (m[1], m[3], m[5]))
+    return moves, unmet
+
+
+def _low_threshold():
+    row = fetch_one("SELECT Value FROM DashboardStats WHERE Name = 'low_threshold'")
+    return row[0] if row else DEFAULT_LOW_THRESHOLD
+
+
+def plan(min_units=None, cover_days=COVER_DAYS, max_km=MAX_KM):
+    """Transfers that bring short banks up to target from surplus banks.
+
+    Returns (moves, unmet). moves: dicts with FromBankID, From, ToBankID, To,
+    BloodGroup (shipped), ForGroup (the shortfall it covers), Units and
+    DistanceKm, cheapest first per shortfall; shortfalls a bank covers from
+    its own surplus of a compatible group need no move. unmet: dicts with BankID, Bank,
+    BloodGroup, Target, Units and Short for shortfalls the plan can't cover.
+    """
+    min_units = _low_threshold() if min_units is None else min_units
+    retire_expired()
+    rows = forecast()
+    banks = fetch_columns("SELECT BankID, Name, Latitude, Longitude FROM BloodBank ORDER BY BankID")
+    if not rows or not len(banks["BankID"]):
+        return [], []
+    bank_ids = np.asarray(banks["BankID"], dtype=np.int64)
+    lat = np.array(banks["Latitude"], dtype=float)
+    lon = np.array(banks["Longitude"], dtype=float)
+    missing = (lat == 0) & (lon == 0)                    # the forms' 0.0/0.0 default
+    lat[missing] = lon[missing] = np.nan
+
+    units = np.zeros((len(bank_ids), len(BLOOD_GROUPS)), dtype=np.int64)
+    target = np.zeros_like(units)
+    for r in rows:
+        g = GROUP_INDEX.get(r["BloodGroup"])
+        if g is None:
+            continue
+        b = int(np.searchsorted(bank_ids, r["BankID"]))
+        units[b, g] = r["Units"]
+        target[b, g] = max(min_units, math.ceil(r["IssuedPerDay"] * cover_days))
+    moves, unmet = _solve(lat, lon, units, target, max_km)
+
+    names = banks["Name"]
+    out = [{"FromBankID": int(bank_ids[b]), "From": names[b], "ToBankID": int(bank_ids[t]), "To": names[t],
+            "BloodGroup": BLOOD_GROUPS[g], "ForGroup": BLOOD_GROUPS[h], "Units": n, "DistanceKm": round(km, 1)}
+           for b, t, g, h, n, km in moves if b != t]
+    short = [{"BankID": int(bank_ids[b]), "Bank": names[b], "BloodGroup": BLOOD_GROUPS[g], "Target": int(target[b, g]),
+              "Units": int(units[b, g]), "Short": int(unmet[b, g])} for b, g in zip(*np.nonzero(unmet))]
+    return out, short
+
+
+def apply(moves, note="rebalancing"):
+    """Book a plan's moves as ledger transfers, all or nothing.
+
+    Moves between the same banks in the same group are booked as one transfer.
+    Raises ValueError (and books nothing) when a bank no longer has the units;
+    plan again in that case. Returns the number of transfers booked.
+    """
+    merged = {}
+    for m in moves:
+        key = (m["FromBankID"], m["ToBankID"], m["BloodGroup"])
+        merged[key] = merged.get(key, 0) + m["Units"]
+    with transaction():
+        for (src, dst, group), units in merged.items():
+            transfer(src, dst, group, units, note=note)
+    return len(merged)
+
+
+if __name__ == "__main__":
+    import sys
+    t = time.perf_counter()
+    moves, unmet = plan()
+    km = sum(m["Units"] * m["DistanceKm"] for m in moves)
+    print(f"{len(moves)} moves, {sum(m['Units'] for m in moves)} units, {km:,.0f} unit-km; "
+          f"{sum(u['Short'] for u in unmet)} units short at {len(unmet)} bank/groups; planned in {time.perf_counter() - t:.2f}s")
+    for m in moves[:50]:
+        print(f"  {m['From'][:28]:<28} -> {m['To'][:28]:<28} {m['Units']:>4} x {m['BloodGroup']:<3} "
+              f"(for {m['ForGroup']:<3}) {m['DistanceKm']:>7} km")
+    if sys.argv[1:] == ["apply"]:
+        print(apply(moves), "transfers booked")
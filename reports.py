@@ -0,0 +1,50 @@
+# reports.py
+# Reusable report queries (dashboard + re-engagement campaigns).
+from db import fetch_all, fetch_one
+
+INACTIVE_DAYS = 180
+
+# NULL (never donated) sorts first as ''; matches the ix_donor_lastdonation
+# expression index, so filter, order and count all stay on the index
+LAST_DONATION = "coalesce(LastDonationDate, '')"
+
+
+def _cutoff(days):
+    return fetch_one("SELECT date('now', 'localtime', ?)", (f"-{int(days)} days",))[0]
+
+
+def count_inactive_donors(days=INACTIVE_DAYS):
+    return fetch_one(f"SELECT COUNT(*) FROM Donor WHERE {LAST_DONATION} < ?", (_cutoff(days),))[0]
+
+
+def inactive_donors(days=INACTIVE_DAYS, after=None, limit=50):
+    """One page of donors who haven't donated for more than `days` days (or never),
+    longest-inactive first.
+
+    `after` is the cursor returned with the previous page (None for the first).
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    params = [_cutoff(days)]
+    cond = f"{LAST_DONATION} < ?"
+    if after is not None:
+        # (date, id) > cursor, spelled so the date part bounds the index range
+        cond += f" AND {LAST_DONATION} >= ? AND ({LAST_DONATION} > ? OR DonorID > ?)"
+        params += [after[0], after[0], after[1]]
+    rows = fetch_all(f"""SELECT DonorID, Name, BloodGroup, Phone, Email, City, LastDonationDate,
+                                CAST(julianday('now', 'localtime', 'start of day') - julianday(LastDonationDate) AS INTEGER) AS DaysSince
+                         FROM Donor WHERE {cond}
+                         ORDER BY {LAST_DONATION}, DonorID LIMIT ?""", tuple(params) + (limit + 1,))
+    more = len(rows) > limit
+    rows = rows[:limit]
+    nxt = (rows[-1]["LastDonationDate"] or "", rows[-1]["DonorID"]) if more else None
+    return rows, nxt
+
+
+def iter_inactive_donors(days=INACTIVE_DAYS, batch=1000):
+    # walk every inactive donor page by page (e.g. for a re-engagement mailing)
+    after = None
+    while True:
+        rows, after = inactive_donors(days, after, batch)
+        yield from rows
+        if after is None:
+            return
@@ -0,0 +1,93 @@
+# reservations.py
+# Assigning a request to a bank or donor, safe against concurrent sessions.
+# A reservation is one BEGIN IMMEDIATE transaction: the request must still be
+# Pending, the bank must still hold enough units of a compatible group, and
+# then the status changes and an "assignment" movement takes the units out of
+# stock (ledger.py), first-expiry-first-out from the bank's lots (lots.py);
+# expired units of that group are written off first so they never count.
+# Two operators clicking at once get one success and one conflict, never
+# negative stock or a double assignment.
+# release() puts reserved units back (cancel, or re-open the request).
+# tests/test_reservations.py races many threads against one bank to check it.
+from db import transaction
+from ledger import record
+from lots import retire_expired
+from matching import compatible_groups
+
+
+def _request(conn, request_id):
+    return conn.execute("SELECT Status, RequiredBloodGroup, UnitsRequired FROM Request WHERE RequestID = ?",
+                        (request_id,)).fetchone()
+
+
+def reserve_bank(request_id, bank_id, group, expected_status="Pending"):
+    """Assign a request to a bank and take its units out of stock.
+
+    group is the blood group issued (a compatible substitute is fine).
+    Returns (ok, msg); ok is False on a conflict, with nothing changed.
+    """
+    with transaction() as conn:
+        req = _request(conn, request_id)
+        if req is None:
+            return False, f"Request {request_id} not found"
+        status, needed_group, units = req
+        if status != expected_status:
+            return False, f"Request {request_id} is already {status}"
+        if group not in compatible_groups(needed_group):
+            return False, f"{group} can't be given for a {needed_group} request"
+        retire_expired(bank_id=bank_id, group=group)
+        row = conn.execute("SELECT UnitsAvailable FROM Inventory WHERE BankID = ? AND BloodGroup = ?",
+                           (bank_id, group)).fetchone()
+        have = (row[0] or 0) if row else 0
+        if have < units:
+            return False, f"Bank {bank_id} now has only {have} units of {group} (needs {units})"
+        # conditional transition: the status check above holds because we own the write lock,
+        # the WHERE keeps it safe even for writers that skip this function
+        cur = conn.execute("UPDATE Request SET AssignedBankID = ?, Status = 'Assigned' WHERE RequestID = ? AND Status = ?",
+                           (bank_id, request_id, expected_status))
+        if cur.rowcount != 1:
+            return False, f"Request {request_id} changed meanwhile"
+        record(conn, bank_id, group, -units, "assignment", ref_id=request_id, note=f"request {request_id}")
+        return True, f"Reserved {units} units of {group} at bank {bank_id}"
+
+
+def assign_donor(request_id, donor_id):
+    """Assign a pending request to a donor. Returns (ok, msg)."""
+    with transaction() as conn:
+        cur = conn.execute("UPDATE Request SET AssignedDonorID = ?, Status = 'Assigned' WHERE RequestID = ? AND Status = 'Pending'",
+                           (donor_id, request_id))
+        if cur.rowcount != 1:
+            req = _request(conn, request_id)
+            return False, f"Request {request_id} is already {req[0]}" if req else f"Request {request_id} not found"
+        return True, "Donor assigned"
+
+
+def reserved_units(conn, request_id):
+    # net units held for a request: [(bank, group, units)]
+    return conn.execute("""SELECT BankID, BloodGroup, -SUM(Delta) FROM InventoryLedger
+                           WHERE RefID = ? AND Kind = 'assignment'
+                           GROUP BY BankID, BloodGroup HAVING SUM(Delta) < 0""", (request_id,)).fetchall()
+
+
+def release(request_id, cancel=False):
+    """Undo an assignment: reserved units go back to their bank and the
+    request returns to Pending (or becomes Cancelled). Returns (ok, msg).
+
+    Fulfilled requests keep their units.
+    """
+    with transaction() as conn:
+        req = _request(conn, request_id)
+        if req is None:
+            return False, f"Request {request_id} not found"
+        status = req[0]
+        if status == "Fulfilled":
+            return False, f"Request {request_id} is already fulfilled"
+        if status != "Assigned" and not (cancel and status == "Pending"):
+            return False, f"Request {request_id} is {status}; nothing to release"
+        held = reserved_units(conn, request_id)
+        conn.execute("""UPDATE Request SET Status = ?, AssignedBankID = NULL, AssignedDonorID = NULL
+                        WHERE RequestID = ?""", ("Cancelled" if cancel else "Pending", request_id))
+        for bank_id, group, units in held:
+            record(conn, bank_id, group, units, "assignment", ref_id=request_id, note=f"released request {request_id}")
+        returned = sum(u for _, _, u in held)
+        return True, (f"Released {returned} units" if returned else "Assignment released") + (" and cancelled" if cancel else "")
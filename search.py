@@ -0,0 +1,102 @@
+# search.py
+# Full-text search over donors, banks and requests. Each table has an
+# external-content FTS5 index (DonorSearch, BankSearch, RequestSearch) kept in
+# sync by triggers (created by migrations.py; create_search_schema() puts them
+# back after a bulk load), so a lookup is an index probe ranked by bm25 instead
+# of a LIKE '%x%' scan of one column.
+# What the user types is turned into prefix terms: "asha pun" finds
+# "Asha Kulkarni, Pune".
+import re
+from db import transaction, fetch_all
+
+SEARCH_LIMIT = 20
+RANK_CAP = 1000                    # rank by bm25 only when a query matches at most this many rows
+
+# index name -> (base table, key column, indexed columns, label expression, detail expression)
+INDEXES = {
+    "DonorSearch": ("Donor", "DonorID", ["Name", "City", "Email", "Phone"],
+                    "t.Name", "t.BloodGroup || ' · ' || coalesce(t.City, '') || ' · ' || coalesce(t.Phone, '')"),
+    "BankSearch": ("BloodBank", "BankID", ["Name", "Address", "City"],
+                   "t.Name", "coalesce(t.Address, '') || ' · ' || coalesce(t.City, '')"),
+    "RequestSearch": ("Request", "RequestID", ["PatientName", "City"],
+                      "t.PatientName", "t.RequiredBloodGroup || ' x ' || t.UnitsRequired || ' · ' || coalesce(t.City, '') || ' · ' || t.Status"),
+}
+KINDS = {"donor": "DonorSearch", "bank": "BankSearch", "request": "RequestSearch"}
+
+
+def create_search_schema(conn):
+    for idx, (table, key, cols, _, _) in INDEXES.items():
+        col_list = ", ".join(cols)
+        new_vals = ", ".join(f"NEW.{c}" for c in cols)
+        old_vals = ", ".join(f"OLD.{c}" for c in cols)
+        conn.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS {idx} USING fts5(
+                             {col_list}, content='{table}', content_rowid='{key}', prefix='2 3')""")
+        insert = f"INSERT INTO {idx} (rowid, {col_list}) VALUES (NEW.{key}, {new_vals});"
+        delete = f"INSERT INTO {idx} ({idx}, rowid, {col_list}) VALUES ('delete', OLD.{key}, {old_vals});"
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {idx.lower()}_ai AFTER INSERT ON {table} BEGIN {insert} END")
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {idx.lower()}_ad AFTER DELETE ON {table} BEGIN {delete} END")
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {idx.lower()}_au AFTER UPDATE OF {col_list} ON {table} "
+                     f"BEGIN {delete} {insert} END")
+        conn.execute(f"INSERT INTO {idx} ({idx}) VALUES ('rebuild')")
+
+
+def match_query(text):
+    """User text -> FTS5 query: every word as a quoted prefix term, ANDed. None if nothing to search."""
+    words = re.findall(r"\w+", text or "")
+    return " ".join(f'"{w}"*' for w in words) or None
+
+
+def _matches(kind, q, limit):
+    idx = KINDS[kind]
+    table, key, _, label, detail = INDEXES[idx]
+    cols = f"'{kind}' AS Kind, t.{key} AS ID, {label} AS Label, {detail} AS Detail"
+    # bm25 has to score every match before the LIMIT applies, so only rank
+    # selective queries; a short prefix matching half the table comes back in key order
+    n = fetch_all(f"SELECT COUNT(*) AS n FROM (SELECT 1 FROM {idx} WHERE {idx} MATCH ? LIMIT ?)", (q, RANK_CAP + 1))[0]["n"]
+    order = "s.rank" if n <= RANK_CAP else "s.rowid"
+    rows = fetch_all(f"""SELECT {cols}, {order} AS Rank FROM {idx} s JOIN {table} t ON t.{key} = s.rowid
+                         WHERE {idx} MATCH ? ORDER BY {order} LIMIT ?""", (q, limit))
+    return rows, n <= RANK_CAP
+
+
+def search(text, kind=None, limit=SEARCH_LIMIT):
+    """Best matches for `text`: bm25-ranked when the query is selective.
+
+    kind is "donor", "bank", "request" or None for all three. Returns dicts
+    with Kind, ID, Label and Detail.
+    """
+    q = match_query(text)
+    if q is None:
+        return []
+    ranked, unranked = [], []
+    for k in ([kind] if kind else list(KINDS)):
+        rows, is_ranked = _matches(k, q, limit)
+        (ranked if is_ranked else unranked).extend(rows)
+    ranked.sort(key=lambda r: r["Rank"])
+    rows = (ranked + unranked)[:limit]
+    for r in rows:
+        del r["Rank"]
+    return rows
+
+
+def matching_ids(kind):
+    """SQL fragment selecting the keys matching one search (bind match_query(text))."""
+    idx = KINDS[kind]
+    return f"{INDEXES[idx][1]} IN (SELECT rowid FROM {idx} WHERE {idx} MATCH ?)"
+
+
+def rebuild_search_indexes():
+    """Re-index everything from the base tables (repair)."""
+    with transaction() as conn:
+        for idx in INDEXES:
+            conn.execute(f"INSERT INTO {idx} ({idx}) VALUES ('rebuild')")
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    t = time.perf_counter()
+    rows = search(" ".join(sys.argv[1:]))
+    print(f"{len(rows)} results in {(time.perf_counter() - t) * 1000:.1f} ms")
+    for r in rows:
+        print(r)
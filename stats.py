@@ -0,0 +1,53 @@
+# stats.py
+# Dashboard numbers kept current by triggers (see migrations.py) so the
+# dashboard reads a handful of rows instead of counting whole tables:
+#   DashboardStats(Name, Value): donors, banks, units, pending, low_threshold
+#   LowStock(BankID, BloodGroup, UnitsAvailable): Inventory rows below low_threshold
+# rebuild_dashboard_stats() recomputes everything from the base tables (repair).
+from db import transaction, fetch_all, fetch_one
+
+DEFAULT_LOW_THRESHOLD = 5
+
+def _rebuild(conn, low_threshold):
+    conn.execute("DELETE FROM DashboardStats")
+    conn.execute("""INSERT INTO DashboardStats (Name, Value)
+                    SELECT 'donors', COUNT(*) FROM Donor
+                    UNION ALL SELECT 'banks', COUNT(*) FROM BloodBank
+                    UNION ALL SELECT 'units', coalesce(SUM(UnitsAvailable), 0) FROM Inventory
+                    UNION ALL SELECT 'pending', COUNT(*) FROM Request WHERE Status = 'Pending'
+                    UNION ALL SELECT 'low_threshold', ?""", (low_threshold,))
+    conn.execute("DELETE FROM LowStock")
+    conn.execute("""INSERT OR REPLACE INTO LowStock SELECT BankID, BloodGroup, coalesce(UnitsAvailable, 0)
+                    FROM Inventory WHERE coalesce(UnitsAvailable, 0) < ?""", (low_threshold,))
+
+
+def rebuild_dashboard_stats(low_threshold=None):
+    """Recompute DashboardStats and LowStock from the base tables."""
+    with transaction() as conn:
+        if low_threshold is None:
+            row = conn.execute("SELECT Value FROM DashboardStats WHERE Name = 'low_threshold'").fetchone()
+            low_threshold = row[0] if row else DEFAULT_LOW_THRESHOLD
+        _rebuild(conn, low_threshold)
+
+
+def set_low_threshold(low_threshold):
+    # LowStock depends on the threshold, so changing it means a rebuild
+    row = fetch_one("SELECT Value FROM DashboardStats WHERE Name = 'low_threshold'")
+    if not row or row[0] != low_threshold:
+        rebuild_dashboard_stats(low_threshold)
+
+
+def dashboard_stats():
+    stats = {r["Name"]: r["Value"] for r in fetch_all("SELECT Name, Value FROM DashboardStats")}
+    return {k: stats.get(k, 0) for k in ("donors", "banks", "units", "pending")}
+
+
+def low_stock():
+    return fetch_all("""SELECT BloodBank.Name AS Bank, LowStock.BloodGroup, LowStock.UnitsAvailable
+                        FROM LowStock JOIN BloodBank ON LowStock.BankID = BloodBank.BankID
+                        ORDER BY LowStock.UnitsAvailable ASC""")
+
+
+if __name__ == "__main__":
+    rebuild_dashboard_stats()
+    print("Dashboard stats rebuilt:", dashboard_stats())
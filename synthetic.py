@@ -0,0 +1,262 @@
+# synthetic.py
+# Deterministic synthetic data for load testing and benchmarks (bench.py).
+# Writes a fresh, fully migrated database: donors and banks spread over Indian
+# cities by population, then day by day for `years` donations (respecting the
+# 90-day gap) and requests, served from a bank in the patient's city when it
+# has compatible stock. Stock moves through InventoryLedger like in the app
+# (expired units are written off before a bank's stock is used), so Inventory,
+# the lots, the dashboard stats and the search indexes all line up.
+# The same seed, sizes and --end date always give the same data.
+#   python synthetic.py bench.db --donors 1000000 --banks 2000 --years 3
+import argparse
+import itertools
+import math
+import os
+import random
+import time
+from collections import deque
+from datetime import date, timedelta
+import db
+import search
+from db import transaction
+from lots import SHELF_LIFE_DAYS
+from matching import compatible_groups
+from migrations import migrate
+
+# name, latitude, longitude, metro population (millions) used as the weight
+CITIES = [
+    ("Delhi", 28.7041, 77.1025, 31.2), ("Mumbai", 19.0760, 72.8777, 20.7), ("Kolkata", 22.5726, 88.3639, 14.9),
+    ("Bengaluru", 12.9716, 77.5946, 12.8), ("Chennai", 13.0827, 80.2707, 11.2), ("Hyderabad", 17.3850, 78.4867, 10.5),
+    ("Ahmedabad", 23.0225, 72.5714, 8.4), ("Surat", 21.1702, 72.8311, 7.5), ("Pune", 18.5204, 73.8567, 6.8),
+    ("Jaipur", 26.9124, 75.7873, 4.1), ("Lucknow", 26.8467, 80.9462, 3.9), ("Indore", 22.7196, 75.8577, 3.3),
+    ("Kanpur", 26.4499, 80.3319, 3.2), ("Nagpur", 21.1458, 79.0882, 2.9), ("Coimbatore", 11.0168, 76.9558, 2.9),
+    ("Bhopal", 23.2599, 77.4126, 2.5), ("Patna", 25.5941, 85.1376, 2.5), ("Ghaziabad", 28.6692, 77.4538, 2.4),
+    ("Visakhapatnam", 17.6868, 83.2185, 2.2), ("Vadodara", 22.3072, 73.1812, 2.2), ("Kochi", 9.9312, 76.2673, 2.2),
+    ("Nashik", 19.9975, 73.7898, 2.1), ("Ludhiana", 30.9010, 75.8573, 1.9), ("Agra", 27.1767, 78.0081, 1.9),
+    ("Vijayawada", 16.5062, 80.6480, 1.7), ("Trivandrum", 8.5241, 76.9366, 1.7), ("Varanasi", 25.3176, 82.9739, 1.6),
+    ("Madurai", 9.9252, 78.1198, 1.6), ("Ranchi", 23.3441, 85.3096, 1.5), ("Srinagar", 34.0837, 74.7973, 1.5),
+    ("Raipur", 21.2514, 81.6296, 1.4), ("Jodhpur", 26.2389, 73.0243, 1.4), ("Amritsar", 31.6340, 74.8723, 1.3),
+    ("Guwahati", 26.1445, 91.7362, 1.2), ("Bhubaneswar", 20.2961, 85.8245, 1.2), ("Chandigarh", 30.7333, 76.7794, 1.2),
+    ("Mysuru", 12.2958, 76.6394, 1.2), ("Dehradun", 30.3165, 78.0322, 0.8), ("Jammu", 32.7266, 74.8570, 0.7),
+    ("Panaji", 15.4909, 73.8278, 0.2),
+]
+# approximate distribution of ABO/Rh groups in India
+GROUPS = {"O+": 36.5, "B+": 32.1, "A+": 22.9, "AB+": 6.4, "O-": 0.8, "B-": 0.7, "A-": 0.4, "AB-": 0.2}
+FIRST = ["Aarav", "Aditi", "Akash", "Ananya", "Arjun", "Asha", "Deepak", "Divya", "Farhan", "Gaurav", "Isha", "Kabir",
+         "Kavya", "Manoj", "Meera", "Naveen", "Neha", "Nikhil", "Pooja", "Pradeep", "Priya", "Rahul", "Rajesh", "Riya",
+         "Rohan", "Sana", "Sanjay", "Shreya", "Suresh", "Tanvi", "Vikram", "Vijay", "Yash", "Zoya", "Harpreet", "Lakshmi",
+         "Arun", "Fatima", "Joseph", "Anjali"]
+LAST = ["Sharma", "Verma", "Gupta", "Singh", "Kumar", "Patel", "Shah", "Reddy", "Rao", "Iyer", "Nair", "Menon", "Das",
+        "Banerjee", "Chatterjee", "Mukherjee", "Joshi", "Kulkarni", "Deshpande", "Khan", "Ahmed", "Fernandes", "Pillai",
+        "Mehta", "Kapoor", "Malhotra", "Chopra", "Yadav", "Mishra", "Pandey", "Tiwari", "Naidu", "Gill", "Bhat"]
+BANK_NAMES = ["Red Cross", "LifeCare", "City", "Rotary", "Lions", "Government", "Apollo", "Sankalp", "Jeevan", "Prathama"]
+
+MIN_GAP_DAYS = 90                  # same rule as broadcast.py
+PENDING_DAYS = 7                   # requests newer than this are left Pending
+CANCEL_SHARE = 0.15                # old requests that couldn't be served: Cancelled (else Fulfilled elsewhere)
+NO_COORDS_SHARE = 0.01             # donors without a location, as in real data
+BATCH_DAYS = 30                    # days written per transaction
+
+
+class _Gen:
+    def __init__(self, seed, end):
+        self.rnd = random.Random(seed)
+        self.end = end
+        self.city_cum = list(itertools.accumulate(c[3] for c in CITIES))
+        self.group_names, self.group_cum = list(GROUPS), list(itertools.accumulate(GROUPS.values()))
+
+    def city(self):
+        return self.rnd.choices(range(len(CITIES)), cum_weights=self.city_cum)[0]
+
+    def near(self, ci):
+        # larger metros sprawl further
+        _, lat, lon, w = CITIES[ci]
+        spread = 0.03 + 0.02 * math.sqrt(w)
+        return round(lat + self.rnd.gauss(0, spread), 5), round(lon + self.rnd.gauss(0, spread), 5)
+
+    def group(self):
+        return self.rnd.choices(range(len(self.group_names)), cum_weights=self.group_cum)[0]
+
+    def name(self):
+        return f"{self.rnd.choice(FIRST)} {self.rnd.choice(LAST)}"
+
+    def phone(self):
+        return str(self.rnd.randrange(6_000_000_000, 10_000_000_000))
+
+
+def _banks(g, n):
+    # every city gets one bank before the rest are handed out by population
+    cities = list(range(len(CITIES)))[:n] + [g.city() for _ in range(max(0, n - len(CITIES)))]
+    rows, seen = [], {}
+    for bid, ci in enumerate(cities, start=1):
+        city = CITIES[ci][0]
+        brand = g.rnd.choice(BANK_NAMES)
+        seen[(brand, city)] = seen.get((brand, city), 0) + 1
+        suffix = f" {seen[(brand, city)]}" if seen[(brand, city)] > 1 else ""
+        lat, lon = g.near(ci)
+        rows.append((bid, f"{brand} Blood Bank {city}{suffix}", f"{g.rnd.randint(1, 250)}, Sector {g.rnd.randint(1, 60)}, {city}",
+                     g.phone(), lat, lon, city))
+    return rows, cities
+
+
+def _donors(g, n, batch=50000):
+    # yields row batches; the caller keeps each donor's city and group
+    for start in range(1, n + 1, batch):
+        rows = []
+        for did in range(start, min(n, start + batch - 1) + 1):
+            ci, gi = g.city(), g.group()
+            name = g.name()
+            lat, lon = g.near(ci) if g.rnd.random() >= NO_COORDS_SHARE else (None, None)
+            dob = g.end - timedelta(days=g.rnd.randint(18 * 365, 60 * 365))
+            email = f"{name.lower().replace(' ', '.')}{did}@example.com"
+            rows.append((did, name, "M" if g.rnd.random() < 0.7 else "F", dob.isoformat(), g.group_names[gi],
+                         g.phone(), email, lat, lon, CITIES[ci][0], ci, gi))
+        yield rows
+
+
+def _in_date(stock, lots_in, key, day, d, moves):
+    # units of a (bank, group) usable on `day`; lots past their shelf life are
+    # written off first with an 'expiry' movement, as lots.retire_expired() does
+    lots = lots_in.get(key)
+    gone = 0
+    while lots and lots[0][0] + SHELF_LIFE_DAYS <= day:
+        gone += lots.popleft()[1]
+    if gone:
+        stock[key] -= gone
+        moves.append((key[0], key[1], -gone, "expiry", None, d))
+    return stock.get(key, 0)
+
+
+def _take(lots, units):
+    # first-expiry-first-out, like the lot_ai trigger
+    while units:
+        n = min(units, lots[0][1])
+        lots[0][1] -= n
+        units -= n
+        if not lots[0][1]:
+            lots.popleft()
+
+
+def generate(path, donors=10000, banks=200, years=2, donations_per_day=None, requests_per_day=None,
+             seed=42, end=None, progress=print):
+    """Build a synthetic database at `path` (must not exist). Returns row counts."""
+    if os.path.exists(path):
+        raise ValueError(f"{path} already exists; generate into a new file")
+    end = end or date.today()
+    g = _Gen(seed, end)
+    days = int(years * 365)
+    # defaults: about one donation per donor per year, requests using ~80% of what comes in
+    donations_per_day = donations_per_day if donations_per_day is not None else max(1, donors // 365)
+    requests_per_day = requests_per_day if requests_per_day is not None else max(1, int(donations_per_day * 0.8 / 2.2))
+
+    live, profile = db.DB, db.DB_PROFILE
+    db.configure(path, profile="fast")             # throwaway file: no fsyncs
+    try:
+        migrate()
+        t0 = time.perf_counter()
+        # bulk load: full-text index everything once at the end instead of row by row
+        # (create_search_schema puts the insert triggers back and rebuilds)
+        with transaction() as conn:
+            for idx in search.INDEXES:
+                conn.execute(f"DROP TRIGGER IF EXISTS {idx.lower()}_ai")
+        bank_rows, bank_city = _banks(g, banks)
+        banks_in = {}
+        for bid, ci in enumerate(bank_city, start=1):
+            banks_in.setdefault(ci, []).append(bid)
+        with transaction() as conn:
+            conn.executemany("INSERT INTO BloodBank (BankID, Name, Address, Phone, Latitude, Longitude, City) VALUES (?,?,?,?,?,?,?)",
+                             bank_rows)
+        city_of, group_of = bytearray(donors + 1), bytearray(donors + 1)
+        for rows in _donors(g, donors):
+            with transaction() as conn:
+                conn.executemany("""INSERT INTO Donor (DonorID, Name, Gender, DOB, BloodGroup, Phone, Email, Latitude, Longitude, City)
+                                    VALUES (?,?,?,?,?,?,?,?,?,?)""", [r[:10] for r in rows])
+            for r in rows:
+                city_of[r[0]], group_of[r[0]] = r[10], r[11]
+            progress(f"donors {rows[-1][0]:,}/{donors:,}")
+
+        last = [-MIN_GAP_DAYS - 1] * (donors + 1)       # day index of each donor's last donation
+        stock = {}                                       # (bank, group) -> units
+        lots_in = {}                                     # (bank, group) -> deque of [day collected, units], oldest first
+        n_don = n_req = 0
+        first = end - timedelta(days=days - 1)
+        for chunk in range(0, days, BATCH_DAYS):
+            don_rows, req_rows, moves = [], [], []
+            for day in range(chunk, min(days, chunk + BATCH_DAYS)):
+                d = (first + timedelta(days=day)).isoformat()
+                for _ in range(donations_per_day):
+                    for _try in range(3):
+                        did = g.rnd.randint(1, donors)
+                        if day - last[did] >= MIN_GAP_DAYS:
+                            break
+                    else:
+                        continue
+                    last[did] = day
+                    ci, grp = city_of[did], g.group_names[group_of[did]]
+                    bid = g.rnd.choice(banks_in.get(ci) or [g.rnd.randint(1, banks)])
+                    units = 2 if g.rnd.random() < 0.1 else 1
+                    n_don += 1
+                    don_rows.append((n_don, did, bid, d, units, round(min(17.0, max(12.5, g.rnd.gauss(13.8, 1.2))), 1)))
+                    moves.append((bid, grp, units, "donation", n_don, d))
+                    stock[(bid, grp)] = stock.get((bid, grp), 0) + units
+                    lots_in.setdefault((bid, grp), deque()).append([day, units])
+                for _ in range(requests_per_day):
+                    ci = g.city()
+                    grp = g.group_names[g.group()]
+                    units = g.rnd.randint(1, 4)
+                    lat, lon = g.near(ci)
+                    n_req += 1
+                    status, bank = "Pending", None
+                    if days - day > PENDING_DAYS:
+                        for b in banks_in.get(ci, []):
+                            give = next((x for x in compatible_groups(grp)
+                                         if _in_date(stock, lots_in, (b, x), day, d, moves) >= units), None)
+                            if give:
+                                status, bank = "Fulfilled", b
+                                stock[(b, give)] -= units
+                                _take(lots_in[(b, give)], units)
+                                moves.append((b, give, -units, "assignment", n_req, d))
+                                break
+                        else:
+                            status = "Cancelled" if g.rnd.random() < CANCEL_SHARE else "Fulfilled"
+                    req_rows.append((n_req, g.name(), grp, units, CITIES[ci][0], f"patient{n_req}@example.com",
+                                     lat, lon, d, status, bank))
+            with transaction() as conn:
+                conn.executemany("INSERT INTO Donation (DonationID, DonorID, BankID, Date, Units, Hemoglobin) VALUES (?,?,?,?,?,?)",
+                                 don_rows)
+                conn.executemany("""INSERT INTO Request (RequestID, PatientName, RequiredBloodGroup, UnitsRequired, City, Email,
+                                                         Latitude, Longitude, RequestDate, Status, AssignedBankID)
+                                    VALUES (?,?,?,?,?,?,?,?,?,?,?)""", req_rows)
+                conn.executemany("INSERT INTO InventoryLedger (BankID, BloodGroup, Delta, Kind, RefID, At) VALUES (?,?,?,?,?,?)",
+                                 moves)
+            progress(f"day {min(days, chunk + BATCH_DAYS)}/{days}: {n_don:,} donations, {n_req:,} requests")
+
+        with transaction() as conn:
+            conn.executemany("UPDATE Donor SET LastDonationDate = ? WHERE DonorID = ?",
+                             ((str(first + timedelta(days=day)), did) for did, day in enumerate(last) if day >= 0))
+        with transaction() as conn:
+            search.create_search_schema(conn)
+        with db.get_conn() as conn:
+            conn.execute("ANALYZE")
+        counts = {"donors": donors, "banks": banks, "donations": n_don, "requests": n_req, "days": days}
+        progress(f"done in {time.perf_counter() - t0:.1f}s: {counts}")
+        return counts
+    finally:
+        db.configure(live, profile=profile)
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Generate a synthetic blood donation database.")
+    p.add_argument("path", help="new database file to create")
+    p.add_argument("--donors", type=int, default=10000)
+    p.add_argument("--banks", type=int, default=200)
+    p.add_argument("--years", type=float, default=2)
+    p.add_argument("--donations-per-day", type=int, help="default: about one donation per donor per year")
+    p.add_argument("--requests-per-day", type=int)
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--end", type=date.fromisoformat, help="last simulated day, YYYY-MM-DD (default today)")
+    a = p.parse_args()
+    try:
+        generate(a.path, a.donors, a.banks, a.years, a.donations_per_day, a.requests_per_day, a.seed, a.end)
+    except ValueError as e:
+        p.exit(1, f"{e}\n")
@@ -0,0 +1,34 @@
+# conftest.py
+# Every test gets a scratch database built by the app's own migrations; the
+# live blood_donation.db is never touched.
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+from migrations import migrate
+
+
+@pytest.fixture
+def scratch_db(tmp_path):
+    live = db.DB
+    path = str(tmp_path / "test.db")
+    db.configure(path)
+    migrate()
+    yield path
+    db.configure(live)
+
+
+def add_bank(conn, name="Test Bank"):
+    return conn.execute("INSERT INTO BloodBank (Name, City) VALUES (?, 'Testville')", (name,)).lastrowid
+
+
+def add_donor(conn, group="O-"):
+    return conn.execute("INSERT INTO Donor (Name, BloodGroup) VALUES ('Test Donor', ?)", (group,)).lastrowid
+
+
+def add_request(conn, group="O-", units=2, name="patient"):
+    return conn.execute("""INSERT INTO Request (PatientName, RequiredBloodGroup, UnitsRequired, RequestDate)
+                           VALUES (?, ?, ?, date('now'))""", (name, group, units)).lastrowid
@@ -0,0 +1,45 @@
+# test_donations.py
+from datetime import date
+import pytest
+from conftest import add_bank, add_donor
+import lots
+from db import transaction, fetch_one
+from donations import log_donation, delete_donation
+from ledger import reconcile, transfer
+
+
+def _units(bank, group="O-"):
+    return fetch_one("SELECT UnitsAvailable FROM Inventory WHERE BankID = ? AND BloodGroup = ?", (bank, group))[0]
+
+
+def test_delete_donation_reverses_stock(scratch_db):
+    with transaction() as conn:
+        bank = add_bank(conn)
+        donor = add_donor(conn)
+    donation = log_donation(donor, bank, date.today().isoformat(), 2, 14.0)
+    delete_donation(donation)
+    assert _units(bank) == 0
+    assert reconcile() == []
+    assert lots.reconcile() == []
+
+
+def test_delete_donation_refused_once_units_left_the_bank(scratch_db):
+    with transaction() as conn:
+        bank = add_bank(conn, "A")
+        other = add_bank(conn, "B")
+        donor = add_donor(conn)
+    donation = log_donation(donor, bank, date.today().isoformat(), 4, 14.0)
+    transfer(bank, other, "O-", 3)
+
+    with pytest.raises(ValueError, match="only 1 units"):
+        delete_donation(donation)
+    assert _units(bank) == 1
+    assert fetch_one("SELECT COUNT(*) FROM Donation WHERE DonationID = ?", (donation,))[0] == 1
+    assert reconcile() == []
+    assert lots.reconcile() == []
+
+    transfer(other, bank, "O-", 3)
+    delete_donation(donation)
+    assert (_units(bank), _units(other)) == (0, 0)
+    assert reconcile() == []
+    assert lots.reconcile() == []
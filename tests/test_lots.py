@@ -0,0 +1,43 @@
+# test_lots.py
+from datetime import date, timedelta
+from conftest import add_bank, add_donor
+import lots
+from db import transaction, fetch_all
+from donations import log_donation
+from ledger import record, reconcile
+
+OLD = (date.today() - timedelta(days=60)).isoformat()      # past SHELF_LIFE_DAYS
+NEW = date.today().isoformat()
+
+
+def _stocked():
+    # 3 expired units and 2 in date of O- at one bank
+    with transaction() as conn:
+        bank = add_bank(conn)
+        donor = add_donor(conn, "O-")
+    old = log_donation(donor, bank, OLD, 3, 14.0)
+    new = log_donation(donor, bank, NEW, 2, 14.0)
+    return bank, old, new
+
+
+def _remaining(bank):
+    return {r["DonationID"]: r["Remaining"] for r in fetch_all("SELECT DonationID, Remaining FROM Lot WHERE BankID = ?", (bank,))}
+
+
+def test_plan_skips_expired_lots(scratch_db):
+    bank, old, new = _stocked()
+    planned = lots.plan(bank, "O-", 4)
+    assert [p["Units"] for p in planned] == [2]
+    assert all(p["ExpiresOn"] > NEW for p in planned)
+
+
+def test_only_expiry_movements_take_expired_lots(scratch_db):
+    bank, old, new = _stocked()
+    with transaction() as conn:
+        record(conn, bank, "O-", -1, "correction", note="count")
+    assert _remaining(bank) == {old: 3, new: 1}
+
+    assert lots.retire_expired(bank_id=bank) == 3
+    assert _remaining(bank) == {old: 0, new: 1}
+    assert lots.reconcile() == []
+    assert reconcile() == []
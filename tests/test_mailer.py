@@ -0,0 +1,64 @@
+# test_mailer.py
+from db import fetch_all
+from mailer import enqueue_email, process_batch
+from validation import valid_email
+
+CFG = {"email_address": "bank@example.org"}
+
+
+class FakeSession:
+    """Stands in for SmtpSession; refuses recipients listed in `refuse`."""
+
+    def __init__(self, refuse=()):
+        self.refuse = set(refuse)
+        self.sent = []
+        self.closed = 0
+
+    def send(self, msg):
+        if msg["To"] in self.refuse:
+            raise OSError("connection reset")
+        self.sent.append(msg["To"])
+
+    def close(self):
+        self.closed += 1
+
+
+def _outbox():
+    return {r["Recipient"]: r for r in fetch_all("SELECT Recipient, Status, Attempts, Body, LastError FROM Outbox")}
+
+
+def test_valid_email_rejects_line_breaks():
+    assert valid_email("a@example.org")
+    assert not valid_email("a@example.org\r\nBcc: b@example.org")
+    assert not valid_email("a@example.org\n")
+
+
+def test_bad_message_fails_alone(scratch_db):
+    enqueue_email("a@example.org", "hello", "code 123456")
+    enqueue_email("x@example.org\r\nBcc: evil@example.org", "hello", "code 654321")
+    enqueue_email("b@example.org", "hello", "code 111111")
+    session = FakeSession()
+
+    assert process_batch(session, CFG) == 3
+    assert session.sent == ["a@example.org", "b@example.org"]
+    rows = _outbox()
+    bad = rows["x@example.org\r\nBcc: evil@example.org"]
+    assert bad["Status"] == "failed" and bad["LastError"].startswith("bad message")
+    assert rows["a@example.org"]["Status"] == rows["b@example.org"]["Status"] == "sent"
+    # nothing done with keeps its body (one-time codes)
+    assert all(r["Body"] == "" for r in rows.values())
+
+
+def test_send_error_is_retried(scratch_db):
+    enqueue_email("a@example.org", "hello", "body a")
+    enqueue_email("b@example.org", "hello", "body b")
+    session = FakeSession(refuse=["a@example.org"])
+
+    assert process_batch(session, CFG) == 2
+    assert session.sent == ["b@example.org"] and session.closed == 1
+    rows = _outbox()
+    assert rows["a@example.org"]["Status"] == "queued" and rows["a@example.org"]["Attempts"] == 1
+    assert rows["a@example.org"]["Body"] == "body a"
+    assert rows["b@example.org"]["Status"] == "sent"
+    # due again only after the backoff
+    assert process_batch(session, CFG) == 0
@@ -0,0 +1,77 @@
+# test_reservations.py
+import random
+import threading
+from datetime import date, timedelta
+from conftest import add_bank, add_donor, add_request
+import lots
+from db import transaction, fetch_one
+from donations import log_donation
+from ledger import record, reconcile
+from reservations import reserve_bank, release, reserved_units
+
+THREADS = 16
+REQUESTS = 200
+
+
+def _units(bank, group="O-"):
+    row = fetch_one("SELECT UnitsAvailable FROM Inventory WHERE BankID = ? AND BloodGroup = ?", (bank, group))
+    return row[0] if row else 0
+
+
+def test_concurrent_reservations(scratch_db):
+    # many threads race to reserve the same requests against one bank that
+    # can only serve half of them, releasing some and trying again
+    stock = REQUESTS                               # 2 units per request
+    with transaction() as conn:
+        bank = add_bank(conn, "Stress Test Bank")
+        record(conn, bank, "O-", stock, "correction", note="stress test stock")
+        ids = [add_request(conn, "O-", 2, f"stress {i}") for i in range(REQUESTS)]
+    results, lock = [], threading.Lock()
+    start = threading.Barrier(THREADS)
+
+    def worker(seed):
+        order = ids[:]
+        random.Random(seed).shuffle(order)
+        start.wait()
+        mine = [(rid, reserve_bank(rid, bank, "O-")[0]) for rid in order]
+        for rid, ok in mine[: len(mine) // 10]:
+            if ok:
+                release(rid)
+                mine.append((rid, reserve_bank(rid, bank, "O-")[0]))
+        with lock:
+            results.extend(mine)
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(THREADS)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+
+    with transaction() as conn:
+        status = dict(conn.execute(f"SELECT RequestID, Status FROM Request WHERE RequestID IN ({','.join('?' * len(ids))})",
+                                   ids).fetchall())
+        held = {rid: sum(u for _, _, u in reserved_units(conn, rid)) for rid in ids}
+    left = _units(bank)
+    assert left >= 0
+    assert [rid for rid in ids if held[rid] != (2 if status[rid] == "Assigned" else 0)] == []
+    assert left + sum(held.values()) == stock
+    assert reconcile() == []
+    assert lots.reconcile() == []
+
+
+def test_reservation_never_counts_expired_units(scratch_db):
+    with transaction() as conn:
+        bank = add_bank(conn)
+        donor = add_donor(conn, "O-")
+        request = add_request(conn, "O-", 4)
+    log_donation(donor, bank, (date.today() - timedelta(days=60)).isoformat(), 3, 14.0)
+    log_donation(donor, bank, date.today().isoformat(), 2, 14.0)
+    assert _units(bank) == 5
+
+    ok, msg = reserve_bank(request, bank, "O-")
+    assert not ok and "only 2 units" in msg
+    # the expired lot was written off rather than issued
+    assert _units(bank) == 2
+    assert fetch_one("SELECT SUM(Delta) FROM InventoryLedger WHERE BankID = ? AND Kind = 'expiry'", (bank,))[0] == -3
+    assert reconcile() == []
+    assert lots.reconcile() == []
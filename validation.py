@@ -0,0 +1,34 @@
+# validation.py
+# Field rules shared by the forms (app.py) and the bulk importer (imports.py),
+# so a row that would be refused in the form is refused in a file too.
+import re
+from datetime import datetime
+
+GENDERS = ("M", "F", "Other")
+
+
+def valid_phone(p):
+    return bool(re.match(r"^[0-9]{10}$", p))
+
+
+def valid_email(e):
+    # whole string, no whitespace: a CR/LF would let the address inject mail headers
+    return bool(re.fullmatch(r"[^@\s]+@[^@\s]+\.[^@\s]+", e))
+
+
+def normalize_phone(p):
+    # spreadsheet spellings of the same number: "+91 98765-01234", "098765 01234"
+    digits = re.sub(r"[\s\-().]", "", str(p or ""))
+    if len(digits) > 10:
+        for prefix in ("+91", "91", "0"):
+            if digits.startswith(prefix) and len(digits) - len(prefix) == 10:
+                return digits[len(prefix):]
+    return digits
+
+
+def parse_date(s, field="Date"):
+    """'YYYY-MM-DD' -> the same string, checked; ValueError otherwise."""
+    try:
+        return datetime.strptime(str(s).strip(), "%Y-%m-%d").date().isoformat()
+    except ValueError:
+        raise ValueError(f"Bad {field} {s!r} (use YYYY-MM-DD)")